@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from config.settings import load_settings
+
+load_settings()
+
+# Modos de la caché de respuestas:
+#   on      - usa la respuesta guardada si existe; si no, llama a la API y la guarda
+#   refresh - ignora lo guardado, llama siempre a la API y sobrescribe la entrada
+#   replay  - nunca toca la red: solo respuestas guardadas (CacheMiss si no hay)
+#   off     - ni lee ni escribe
+CACHE_MODES = ('on', 'refresh', 'replay', 'off')
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "llm")
+
+
+class CacheMiss(Exception):
+    """No hay respuesta guardada y el modo 'replay' prohíbe llamar a la API."""
+
+
+class ResponseCache:
+    """Caché en disco de respuestas de LLM, direccionada por contenido.
+
+    Cada entrada es un JSON <sha256>.json cuya clave se calcula a partir de proveedor, modelo,
+    temperatura y prompt. Se desaloja por LRU (mtime, que se actualiza en cada acierto) cuando
+    el total supera max_bytes, y por antigüedad cuando una entrada supera max_age segundos."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = 200 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 3600, mode: str = 'on'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Modo de caché desconocido: {mode}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, prompt: str) -> str:
+        payload = json.dumps(
+            {'provider': provider, 'model': model, 'temperature': temperature, 'prompt': prompt},
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, key: str):
+        """Devuelve el texto guardado para key, o None si no existe o ha caducado."""
+        path = self._path(key)
+        try:
+            if self.max_age and time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                self._count('evictions')
+                return None
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            # Marca de uso para el LRU
+            os.utime(path)
+            return entry['text']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, text: str, meta: dict = None):
+        """Guarda text de forma atómica y aplica la política de desalojo."""
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {'text': text, 'created': time.time(), **(meta or {})}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.warning(f"No se pudo guardar la respuesta en caché: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._count('writes')
+        self.evict()
+
+    def evict(self):
+        """Elimina entradas caducadas y, después, las menos usadas hasta respetar max_bytes."""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith('.json')]
+        except OSError:
+            return
+        now = time.time()
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            expired = self.max_age and now - mtime > self.max_age
+            if not expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            self._count('evictions', removed)
+            logging.info(f"Caché LLM: {removed} entradas desalojadas")
+
+    def lookup(self, provider: str, model: str, temperature: float, prompt: str, mode: str = None):
+        """Busca la respuesta según el modo. Devuelve el texto o None; en 'replay' un fallo lanza CacheMiss."""
+        mode = self._resolve_mode(mode)
+        if mode == 'off':
+            return None
+
+        if mode != 'refresh':
+            text = self.get(self.make_key(provider, model, temperature, prompt))
+            if text is not None:
+                self._count('hits')
+                logging.info(f"Caché LLM: acierto ({provider}/{model})")
+                return text
+
+        self._count('misses')
+        if mode == 'replay':
+            raise CacheMiss(f"No hay respuesta en caché para este prompt ({provider}/{model}) y el modo es 'replay'")
+        return None
+
+    def store(self, provider: str, model: str, temperature: float, prompt: str, text: str, mode: str = None):
+        """Guarda la respuesta obtenida de la API (salvo en modo 'off')."""
+        if self._resolve_mode(mode) == 'off' or not text:
+            return
+        key = self.make_key(provider, model, temperature, prompt)
+        self.put(key, text, {'provider': provider, 'model': model, 'temperature': temperature})
+
+    def fetch(self, provider: str, model: str, temperature: float, prompt: str, compute, mode: str = None) -> str:
+        """Devuelve la respuesta para el prompt, llamando a compute() solo cuando hace falta."""
+        text = self.lookup(provider, model, temperature, prompt, mode)
+        if text is not None:
+            return text
+        text = compute()
+        self.store(provider, model, temperature, prompt, text, mode)
+        return text
+
+    def _resolve_mode(self, mode: str = None) -> str:
+        mode = mode or self.mode
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Modo de caché desconocido: {mode}")
+        return mode
+
+    def stats(self) -> dict:
+        """Aciertos, fallos, escrituras y desalojos desde el arranque, más el tamaño en disco."""
+        with self._lock:
+            data = dict(self._stats)
+        lookups = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / lookups, 3) if lookups else 0.0
+        entries, size = 0, 0
+        try:
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    entries += 1
+                    size += os.path.getsize(os.path.join(self.directory, name))
+        except OSError:
+            pass
+        data['entries'] = entries
+        data['bytes'] = size
+        return data
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """Caché compartida del proceso, configurada desde el .env (LLM_CACHE_*)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                directory=os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+                max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024),
+                max_age=float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+                mode=os.getenv("LLM_CACHE_MODE", "on").lower(),
+            )
+        return _cache
@@ -0,0 +1,335 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from config.settings import load_settings
+from core.jobs import CancelToken, JobCancelled
+from api.cache import CacheMiss
+from api.providers import Provider, PROVIDER_FACTORIES, get_provider
+from api.streaming import StreamStats, StreamAborted
+
+load_settings()
+
+# Reintentos por proveedor ante errores transitorios (timeouts, 429, 5xx), con espera
+# exponencial con jitter completo: uniforme entre 0 y min(BACKOFF_MAX, BACKOFF_BASE * 2^intento)
+RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+# Circuit breaker: tras BREAKER_FAILURES fallos seguidos el proveedor se salta durante
+# BREAKER_COOLDOWN segundos; después se deja pasar una sola petición de prueba
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+
+# Segundos sin primer token tras los que se lanza la misma petición al siguiente proveedor (0 = sin hedging)
+HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+
+_RETRYABLE_STATUS = {408, 409, 425, 429}
+_RETRYABLE_NAMES = ('Timeout', 'Connection', 'DeadlineExceeded', 'ServiceUnavailable')
+
+
+def failover_enabled() -> bool:
+    return os.getenv("LLM_FAILOVER", "on").lower() not in ("off", "false", "0", "no")
+
+
+def backoff_delay(attempt: int, base: float = None, cap: float = None) -> float:
+    """Espera antes del reintento attempt (0, 1, ...), con jitter completo."""
+    base = BACKOFF_BASE if base is None else base
+    cap = BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable(error: Exception) -> bool:
+    """True para errores transitorios: timeouts y fallos de conexión, 408/409/425/429 y 5xx.
+
+    Funciona con las excepciones de openai (status_code) y de google.api_core (code) sin importarlas."""
+    status = getattr(error, 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    if isinstance(status, int):
+        return status in _RETRYABLE_STATUS or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(part in cls.__name__ for cls in type(error).__mro__ for part in _RETRYABLE_NAMES)
+
+
+class CircuitBreaker:
+    """Circuit breaker por proveedor: cerrado -> abierto tras failures fallos seguidos -> medio
+    abierto pasado cooldown (una petición de prueba: si va bien se cierra, si falla se reabre)."""
+
+    def __init__(self, name: str, failures: int = None, cooldown: float = None):
+        self.name = name
+        self.failures = BREAKER_FAILURES if failures is None else failures
+        self.cooldown = BREAKER_COOLDOWN if cooldown is None else cooldown
+        self._errors = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return 'half-open'
+            return 'open'
+
+    def allow(self) -> bool:
+        """True si se puede llamar al proveedor ahora (en medio abierto, solo a un llamante)."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._errors += 1
+            if self._probing or self._errors >= self.failures:
+                if self._opened_at is None or self._probing:
+                    logging.warning(f"[{self.name}] circuito abierto durante {self.cooldown:.0f} s")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def failover_order(primary: str) -> list:
+    """Proveedores configurados en el .env, empezando por primary (el elegido en la GUI/roster).
+
+    LLM_FAILOVER_ORDER (nombres separados por comas) fija el orden del resto. Un proveedor sin
+    clave en el .env (su fábrica lanza ValueError) se omite."""
+    custom = [n.strip() for n in os.getenv("LLM_FAILOVER_ORDER", "").split(",") if n.strip()]
+    names = [primary] + [n for n in (custom or PROVIDER_FACTORIES) if n != primary]
+    configured = []
+    for name in names:
+        try:
+            get_provider(name)
+        except ValueError as e:
+            if name == primary:
+                logging.warning(f"{e}; se usarán los demás proveedores configurados")
+            continue
+        configured.append(name)
+    return configured
+
+
+def _merge_stats(target: StreamStats, source: StreamStats):
+    """Copia en las estadísticas del trabajo las del intento que ganó."""
+    if target is None:
+        return
+    target.add_usage(source.prompt_tokens, source.completion_tokens)
+    if target.first_token_at is None and source.first_token_at is not None:
+        target.first_token_at = source.first_token_at
+    target.chunks += source.chunks
+    target.chars += source.chars
+
+
+class FailoverProvider(Provider):
+    """Proveedor compuesto: prueba los proveedores de names en orden, con reintentos con backoff
+    y un circuit breaker por proveedor. Con hedge_after > 0, generate lanza la misma petición al
+    siguiente proveedor si el actual no ha enviado el primer token en ese tiempo y se queda con
+    la primera respuesta completa (la otra se cancela). Si el proveedor principal no informa del
+    primer token (reports_first_token, p. ej. Gemini) no se hace hedging: sin ese dato la segunda
+    petición saldría siempre y la de Gemini no se podría cancelar.
+
+    stream escribe en un único archivo, así que solo hace failover secuencial, sin hedging."""
+
+    def __init__(self, names: list, hedge_after: float = None):
+        self.names = list(names)
+        self.name = self.names[0]
+        self.hedge_after = HEDGE_AFTER if hedge_after is None else hedge_after
+
+    @property
+    def primary(self) -> Provider:
+        return get_provider(self.names[0])
+
+    @property
+    def model(self):
+        """Modelo del proveedor principal (el que se prueba primero)."""
+        return getattr(self.primary, 'model', None)
+
+    @property
+    def reasoning_filter(self):
+        """REASONING_FILTER del proveedor principal (forma parte de la clave de las etapas)."""
+        return getattr(self.primary, 'reasoning_filter', None)
+
+    def build_prompt(self, topic, instructions, student_data):
+        return self.primary.build_prompt(topic, instructions, student_data)
+
+    def build_body_prompt(self, topic, instructions):
+        return self.primary.build_body_prompt(topic, instructions)
+
+    def generate(self, prompt, options=None):
+        options = options or {}
+        if self.hedge_after > 0 and len(self.names) > 1 and self.primary.reports_first_token:
+            try:
+                return self._hedged(prompt, options)
+            except (JobCancelled, CacheMiss):
+                raise
+            except Exception as e:
+                logging.warning(f"Las peticiones en paralelo fallaron ({e}); se reintenta en orden")
+        return self._sequential(lambda provider, opts: provider.generate(prompt, opts), options)
+
+    def stream(self, prompt, output_path, options=None):
+        return self._sequential(lambda provider, opts: provider.stream(prompt, output_path, opts), options or {})
+
+    def _sequential(self, call, options: dict):
+        cancel_token = options.get('cancel_token')
+        errors = []
+        for name in self.names:
+            breaker = get_breaker(name)
+            if not breaker.allow():
+                errors.append(f"{name}: circuito abierto")
+                continue
+            provider = get_provider(name)
+            for attempt in range(RETRIES + 1):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                try:
+                    result = call(provider, options)
+                except (JobCancelled, CacheMiss):
+                    raise
+                except StreamAborted as e:
+                    # Respuesta inválida, no caída del servicio: probar otro proveedor sin penalizarlo
+                    errors.append(f"{name}: {e}")
+                    break
+                except Exception as e:
+                    breaker.failure()
+                    errors.append(f"{name}: {e}")
+                    if not is_retryable(e) or attempt == RETRIES or breaker.state != 'closed':
+                        break
+                    delay = backoff_delay(attempt)
+                    logging.warning(f"[{name}] error transitorio ({e}); reintento en {delay:.1f} s")
+                    if cancel_token is not None:
+                        if cancel_token.wait(delay):
+                            cancel_token.raise_if_cancelled()
+                    else:
+                        time.sleep(delay)
+                    continue
+                breaker.success()
+                if name != self.names[0]:
+                    logging.info(f"Respuesta servida por {name} (failover desde {self.names[0]})")
+                return result
+        raise Exception("Ningún proveedor respondió: " + "; ".join(errors))
+
+    def _hedged(self, prompt, options: dict):
+        """generate con hedging: como mucho dos peticiones en vuelo, la segunda solo si la primera
+        no ha dado su primer token tras hedge_after segundos."""
+        cancel_token = options.get('cancel_token')
+        # allow() se consulta solo al lanzar: en medio abierto reserva la única petición de prueba
+        candidates = iter(self.names)
+
+        def next_candidate():
+            return next((name for name in candidates if get_breaker(name).allow()), None)
+
+        results = queue.Queue()
+        attempts = {}  # name -> (CancelToken, StreamStats)
+
+        def launch(name):
+            token, stats = CancelToken(), StreamStats()
+            attempts[name] = (token, stats)
+            attempt_options = dict(options, cancel_token=token, stats=stats)
+
+            def run():
+                try:
+                    results.put((name, get_provider(name).generate(prompt, attempt_options), None))
+                except BaseException as e:
+                    results.put((name, None, e))
+
+            threading.Thread(target=run, daemon=True).start()
+
+        def cancel_all():
+            for token, _ in list(attempts.values()):
+                token.cancel()
+
+        if cancel_token is not None:
+            cancel_token.register(cancel_all)
+        try:
+            first_name = next_candidate()
+            if first_name is None:
+                raise Exception("Todos los proveedores tienen el circuito abierto")
+            launch(first_name)
+            started = time.monotonic()
+            pending, errors = 1, []
+            while True:
+                try:
+                    name, result, error = results.get(timeout=0.05)
+                except queue.Empty:
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+                    first = next(iter(attempts.values()))[1]
+                    if (len(attempts) == 1 and first.first_token_at is None
+                            and time.monotonic() - started >= self.hedge_after):
+                        hedge = next_candidate()
+                        if hedge is not None:
+                            logging.info(f"Sin primer token tras {self.hedge_after:.1f} s; se lanza también {hedge}")
+                            launch(hedge)
+                            pending += 1
+                        else:
+                            started = float('inf')  # No hay a quién lanzar: dejar de comprobar
+                    continue
+
+                pending -= 1
+                if error is None:
+                    get_breaker(name).success()
+                    _merge_stats(options.get('stats'), attempts[name][1])
+                    if name != self.names[0]:
+                        logging.info(f"Respuesta servida por {name} (hedging/failover desde {self.names[0]})")
+                    return result
+                if isinstance(error, (JobCancelled, CacheMiss)):
+                    raise error
+                if not isinstance(error, StreamAborted):
+                    get_breaker(name).failure()
+                errors.append(f"{name}: {error}")
+                if pending == 0:
+                    following = next_candidate() if len(attempts) < 2 else None
+                    if following is None:
+                        raise Exception("; ".join(errors))
+                    # El primero falló antes del umbral: pasar ya al siguiente
+                    launch(following)
+                    pending += 1
+        finally:
+            if cancel_token is not None:
+                cancel_token.unregister(cancel_all)
+            cancel_all()
+
+
+_failover = {}
+_failover_lock = threading.Lock()
+
+
+def get_job_provider(name: str) -> Provider:
+    """Proveedor para un trabajo: con LLM_FAILOVER activo y más de un proveedor configurado, un
+    FailoverProvider que empieza por name; si no, get_provider(name)."""
+    if not failover_enabled():
+        return get_provider(name)
+    with _failover_lock:
+        provider = _failover.get(name)
+        if provider is None:
+            names = failover_order(name)
+            if not names:
+                return get_provider(name)  # Lanza el ValueError de configuración del proveedor
+            provider = FailoverProvider(names) if len(names) > 1 else get_provider(names[0])
+            _failover[name] = provider
+        return provider
@@ -1,13 +1,23 @@
 import os
 import logging
-import re
+import threading
+from contextlib import nullcontext
+from functools import partial
 import google.generativeai as genai
-from dotenv import load_dotenv
+from config.settings import load_settings
+from api.streaming import StreamStats, StreamAborted, consume_stream, check_latex_start
+from api.cache import get_cache, CacheMiss
+from api.transforms import provider_chain, apply
 
-load_dotenv()
+load_settings()
 
 GOOGLE_GEMINI_API_KEY = os.getenv("GOOGLE_GEMINI_API_KEY")
 GOOGLE_GEMINI_MODEL = os.getenv("GOOGLE_GEMINI_MODEL")
+GEMINI_TIMEOUT = float(os.getenv("API_TIMEOUT", "180"))
+
+_models = {}
+_models_lock = threading.Lock()
+_configured = False
 
 # Eliminar este bloque si ya no se utiliza
 #LATEX_TEMPLATE = r"""
@@ -17,50 +27,170 @@ GOOGLE_GEMINI_MODEL = os.getenv("GOOGLE_GEMINI_MODEL")
 #"""{{document}}
 
 
-def generate_content_gemini(topic: str, instructions: str, student_data: dict) -> str:
-    """Genera un documento LaTeX completo, detallado y listo para compilar, usando la API de Google Gemini.
-    Se usa el marcador %%PROJECT_LOGO_PATH%% para la ruta del logo, que luego se reemplaza por la ruta relativa correcta."""
-    try:
-        genai.configure(api_key=GOOGLE_GEMINI_API_KEY)
-        model = genai.GenerativeModel(GOOGLE_GEMINI_MODEL)
-
-        prompt = (
-            "Diseña un documento LaTeX completo, elegante, profesional y muy detallado. "
-            "El contenido debe ser extenso y completo, con explicaciones profundas y ejemplos cuando corresponda. "
-            "El documento debe compilarse sin errores con pdflatex y no debe incluir tabla de contenidos ni texto de ejemplo como Lorem Ipsum. "
-            "Devuelve únicamente el código LaTeX. "
-            "Utiliza un preámbulo moderno, una portada llamativa y secciones claras. "
-            "Recuerda que los títulos de las secciones no deben llevar numeración. Por ejemplo, en lugar de '2 Estándar ISO/IEC 25010' "
-            "y '2.1 Características de la Calidad del Producto', simplemente usa 'Estándar ISO/IEC 25010' y 'Características de la Calidad del Producto'.\n\n"
-            "--- Información del Documento ---\n"
-            f"Tema: {topic}\n"
-            f"Instrucciones: {instructions}\n\n"
-            "--- Información del Estudiante ---\n"
-            f"Nombre: {student_data['nombre']}\n"
-            f"C.I.: {student_data['ci']}\n"
-            f"Materia: {student_data['materia']}\n"
-            f"Sección: {student_data['seccion']}\n"
-            f"Universidad: {student_data['universidad']}\n"
-            f"Carrera: {student_data['carrera']}\n"
-            f"Evaluación: Evaluación N° {student_data['eval_num']} - Corte {student_data['corte']}\n"
-            f"Fecha: {student_data['fecha']}\n\n"
-            "Requisitos adicionales:\n"
-            " - La portada debe incluir el logo de la Universidad. Usa el marcador %%PROJECT_LOGO_PATH%% en el comando "
-            "de \\includegraphics, para que luego se reemplace automáticamente por la ruta relativa correcta "
-            "(teniendo en cuenta que el archivo se compila desde la carpeta generated_docs).\n"
-            " - No incluir tabla de contenidos ni secciones con Lorem Ipsum.\n"
-            " - No agregar comentarios o texto extra fuera del código LaTeX.\n"
-            " - Asegúrate de que el contenido generado sea largo, completo y detallado, sin numerar los títulos de las secciones."
+def build_prompt(topic: str, instructions: str, student_data: dict) -> str:
+    """Construye el prompt enviado a Gemini."""
+    return (
+        "Diseña un documento LaTeX completo, elegante, profesional y muy detallado. "
+        "El contenido debe ser extenso y completo, con explicaciones profundas y ejemplos cuando corresponda. "
+        "El documento debe compilarse sin errores con pdflatex y no debe incluir tabla de contenidos ni texto de ejemplo como Lorem Ipsum. "
+        "Devuelve únicamente el código LaTeX. "
+        "Utiliza un preámbulo moderno, una portada llamativa y secciones claras. "
+        "Recuerda que los títulos de las secciones no deben llevar numeración. Por ejemplo, en lugar de '2 Estándar ISO/IEC 25010' "
+        "y '2.1 Características de la Calidad del Producto', simplemente usa 'Estándar ISO/IEC 25010' y 'Características de la Calidad del Producto'.\n\n"
+        "--- Información del Documento ---\n"
+        f"Tema: {topic}\n"
+        f"Instrucciones: {instructions}\n\n"
+        "--- Información del Estudiante ---\n"
+        f"Nombre: {student_data['nombre']}\n"
+        f"C.I.: {student_data['ci']}\n"
+        f"Materia: {student_data['materia']}\n"
+        f"Sección: {student_data['seccion']}\n"
+        f"Universidad: {student_data['universidad']}\n"
+        f"Carrera: {student_data['carrera']}\n"
+        f"Evaluación: Evaluación N° {student_data['eval_num']} - Corte {student_data['corte']}\n"
+        f"Fecha: {student_data['fecha']}\n\n"
+        "Requisitos adicionales:\n"
+        " - La portada debe incluir el logo de la Universidad. Usa el marcador %%PROJECT_LOGO_PATH%% en el comando "
+        "de \\includegraphics, para que luego se reemplace automáticamente por la ruta relativa correcta "
+        "(teniendo en cuenta que el archivo se compila desde la carpeta generated_docs).\n"
+        " - No incluir tabla de contenidos ni secciones con Lorem Ipsum.\n"
+        " - No agregar comentarios o texto extra fuera del código LaTeX.\n"
+        " - Asegúrate de que el contenido generado sea largo, completo y detallado, sin numerar los títulos de las secciones."
+    )
+
+
+def postprocessor():
+    """Cadena de post-proceso incremental (api.transforms.provider_chain): marcas ``` y marcador del logo."""
+    return provider_chain()
+
+
+def postprocess(latex_content: str) -> str:
+    """Post-procesa un texto completo con postprocessor()."""
+    return apply(postprocessor(), latex_content)
+
+
+def get_model(model_name: str = None):
+    """Devuelve el GenerativeModel de model_name, creado una sola vez por proceso.
+
+    genai.configure se llama solo la primera vez; el modelo (y su transporte) se reutiliza."""
+    global _configured
+    model_name = model_name or GOOGLE_GEMINI_MODEL
+    with _models_lock:
+        if not _configured:
+            genai.configure(api_key=GOOGLE_GEMINI_API_KEY)
+            _configured = True
+        model = _models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            _models[model_name] = model
+        return model
+
+
+def _record_usage(response, stats: StreamStats):
+    usage = getattr(response, "usage_metadata", None)
+    if stats is not None and usage is not None:
+        stats.add_usage(getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None))
+
+
+def complete(prompt: str, model_name: str = None, cache_mode: str = None, stats: StreamStats = None,
+             transform=None, schedule=None) -> str:
+    """Envía prompt a Gemini con el modelo compartido y devuelve el texto (con caché).
+
+    Los tokens de usage_metadata se suman a stats. Con transform (ver postprocessor) el texto se
+    devuelve y se guarda en caché ya post-procesado. schedule() (api.ratelimit.scheduled) envuelve
+    solo la petición a la API: un acierto de caché no ocupa turno."""
+    model_name = model_name or GOOGLE_GEMINI_MODEL
+
+    cache = get_cache()
+    text = cache.lookup("gemini", model_name, None, prompt, mode=cache_mode)
+    if text is None:
+        with schedule() if schedule is not None else nullcontext():
+            response = get_model(model_name).generate_content(prompt, request_options={"timeout": GEMINI_TIMEOUT})
+            _record_usage(response, stats)
+        text = apply(transform, response.text) if transform is not None else response.text
+        cache.store("gemini", model_name, None, prompt, text, mode=cache_mode)
+    elif transform is not None:
+        # Las entradas guardadas antes sin post-procesar; la cadena es idempotente
+        text = apply(transform, text)
+    return text
+
+
+def complete_stream(prompt: str, output_path: str, model_name: str = None, cancel_token=None,
+                    cache_mode: str = None, on_chunk=None, validate=None, stats: StreamStats = None,
+                    transform=None, schedule=None) -> str:
+    """Escribe en output_path la respuesta en streaming de prompt y devuelve su texto.
+
+    Con transform (ver postprocessor) cada fragmento se post-procesa antes de escribirse; schedule()
+    envuelve solo la petición a la API, como en complete."""
+    model_name = model_name or GOOGLE_GEMINI_MODEL
+    stats = stats or StreamStats()
+    if validate is None:
+        validate = partial(check_latex_start, allow_fence=True)
+
+    cache = get_cache()
+    text = cache.lookup("gemini", model_name, None, prompt, mode=cache_mode)
+    if text is not None:
+        return consume_stream(iter([text]), output_path, stats, validate, on_chunk, cancel_token, transform)
+
+    with schedule() if schedule is not None else nullcontext():
+        response = get_model(model_name).generate_content(
+            prompt, stream=True, request_options={"timeout": GEMINI_TIMEOUT}
         )
 
-        response = model.generate_content(prompt)
-        latex_content = response.text
+        def chunks():
+            for chunk in response:
+                yield chunk.text
+
+        text = consume_stream(chunks(), output_path, stats, validate, on_chunk, cancel_token, transform)
+        _record_usage(response, stats)
+    cache.store("gemini", model_name, None, prompt, text, mode=cache_mode)
+    return text
+
+
+def generate_content_gemini(topic: str, instructions: str, student_data: dict, cache_mode: str = None) -> str:
+    """Genera un documento LaTeX completo, detallado y listo para compilar, usando la API de Google Gemini.
+    Se usa el marcador %%PROJECT_LOGO_PATH%% para la ruta del logo, que luego se reemplaza por la ruta relativa correcta.
+    cache_mode sustituye a LLM_CACHE_MODE (ver api.cache)."""
+    try:
+        latex_content = complete(build_prompt(topic, instructions, student_data), cache_mode=cache_mode,
+                                 transform=postprocessor())
 
-        # La compilación se realiza desde la carpeta "generated_docs", por lo que la ruta relativa al logo debe ser "../logos/UAH.png"
-        latex_content = latex_content.replace("%%PROJECT_LOGO_PATH%%", "../logos/UAH.png")
         logging.info(f"Contenido generado exitosamente con Gemini. Longitud: {len(latex_content)} caracteres")
         return latex_content
 
+    except CacheMiss:
+        raise
+
+    except Exception as e:
+        logging.error(f"Error en la API de Gemini: {str(e)}")
+        raise Exception(f"Error al comunicarse con Google Gemini: {str(e)}")
+
+
+def stream_content_gemini(topic: str, instructions: str, student_data: dict, output_path: str,
+                          cancel_token=None, on_chunk=None, validate=None, stats: StreamStats = None,
+                          cache_mode: str = None) -> str:
+    """Versión en streaming de generate_content_gemini (stream=True), con la misma interfaz que
+    api.openai_client.stream_content_openai: escribe cada fragmento en output_path según llega y
+    permite detener la respuesta con validate. Gemini suele envolver la salida en ```latex, así que
+    por defecto se tolera la marca inicial."""
+    try:
+        latex_content = complete_stream(
+            build_prompt(topic, instructions, student_data), output_path,
+            cancel_token=cancel_token, cache_mode=cache_mode,
+            on_chunk=on_chunk, validate=validate, stats=stats,
+            transform=postprocessor()
+        )
+
+        logging.info(f"Contenido generado en streaming con Gemini. Longitud: {len(latex_content)} caracteres")
+        return latex_content
+
+    except StreamAborted as e:
+        logging.error(f"Streaming de Gemini detenido: {str(e)}")
+        raise
+
+    except CacheMiss:
+        raise
+
     except Exception as e:
         logging.error(f"Error en la API de Gemini: {str(e)}")
         raise Exception(f"Error al comunicarse con Google Gemini: {str(e)}")
@@ -1,95 +1,322 @@
 import os
 import logging
-import re
+import threading
+from contextlib import nullcontext
+import httpx
 from openai import OpenAI
-from dotenv import load_dotenv
+from config.settings import load_settings
+from api.streaming import StreamStats, StreamAborted, consume_stream, check_latex_start
+from api.cache import get_cache, CacheMiss
+from api.transforms import provider_chain, apply
 
-load_dotenv()
+load_settings()
+
+SYSTEM_PROMPT = "You are a helpful academic assistant capable of generating high-quality compiled LaTeX code."
+TEMPERATURE = 0.7
+
+# Timeouts and connection pool shared by every request (see get_client)
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "180"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "10"))
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "16"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def resolve_config(api_key: str = None, base_url: str = None, model: str = None) -> tuple:
+    """Returns (api_key, base_url, model), falling back to ENV for missing arguments."""
+    # If arguments are provided (from GUI), use them. Otherwise, fall back to ENV.
+    final_api_key = api_key or os.getenv("OPENAI_API_KEY")
+    final_base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    final_model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+    if not final_api_key:
+        raise ValueError("API Key is required. Please set it in the settings or .env file.")
+    return final_api_key, final_base_url, final_model
+
+def get_client(api_key: str, base_url: str) -> OpenAI:
+    """Returns the long-lived client for (api_key, base_url).
+
+    Clients are created once per process and reused, so batch and server workloads keep their
+    TCP/TLS connections alive (keep-alive pool) instead of re-handshaking for every document."""
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            timeout = httpx.Timeout(API_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+            http_client = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=API_MAX_CONNECTIONS,
+                    max_keepalive_connections=API_MAX_CONNECTIONS,
+                    keepalive_expiry=120,
+                ),
+            )
+            # No SDK-level retries: api.failover retries with backoff and api.ratelimit must see each 429
+            client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, http_client=http_client,
+                            max_retries=0)
+            _clients[key] = client
+        return client
+
+def close_clients():
+    """Closes every pooled client (on shutdown)."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+def build_prompt(topic: str, instructions: str, student_data: dict) -> str:
+    """Builds the user prompt sent to the OpenAI-compatible API."""
+    return (
+        "Actúa como un experto académico y diseñador de LaTeX. Tu tarea es generar el código fuente LaTeX para un trabajo universitario."
+        "REQUISITOS CRÍTICOS:\n"
+        "1. NO devuelvas bloques de código markdown (no uses ```latex). Devuelve SÓLO el código puro.\n"
+        "2. El documento debe compilar correctamente con 'pdflatex'.\n"
+        "3. Usa paquetes estándar y compatibles. Para el idioma español, usa \\usepackage[spanish]{babel} (sin opciones extra como es-tabla si causan error).\n"
+        "4. NO incluyas \\maketitle ni índices (\\tableofcontents).\n"
+        "5. NO numeres las secciones (usa \\section*{}).\n"
+        "6. El contenido debe ser EXTENSO, con introducciones, desarrollo detallado, ejemplos y conclusiones.\n"
+        "\n"
+        "--- DATOS DEL ESTUDIANTE ---\n"
+        f"Nombre: {student_data['nombre']}\n"
+        f"C.I.: {student_data['ci']}\n"
+        f"Materia: {student_data['materia']}\n"
+        f"Sección: {student_data['seccion']}\n"
+        f"Universidad: {student_data['universidad']}\n"
+        f"Carrera: {student_data['carrera']}\n"
+        f"Evaluación: Evaluación N° {student_data['eval_num']} - Corte {student_data['corte']}\n"
+        f"Fecha: {student_data['fecha']}\n"
+        "\n"
+        "--- TEMA Y CONTENIDO ---\n"
+        f"Tema Principal: {topic}\n"
+        f"Instrucciones: {instructions}\n"
+        "\n"
+        "--- ESTRUCTURA ---\n"
+        "1. Portada Personalizada: Usa el marcador %%PROJECT_LOGO_PATH%% para el logo (tamaño 4cm).\n"
+        "2. Introducción: Al menos 2 párrafos.\n"
+        "3. Desarrollo: Varias secciones (sin numerar). Usa negritas, listas y cursivas para dar formato profesional.\n"
+        "4. Si es relevante, incluye alguna tabla simple.\n"
+        "5. Conclusión.\n"
+    )
+
+def postprocessor(enable_reasoning_filter: bool = False):
+    """Returns a fresh incremental post-processing chain (see api.transforms.provider_chain):
+    <think> blocks (if enabled), markdown fences and the logo placeholder."""
+    return provider_chain(enable_reasoning_filter)
+
+def postprocess(generated_text: str, enable_reasoning_filter: bool = False) -> str:
+    """Removes reasoning tags (if enabled) and replaces the logo placeholder in a complete text."""
+    return apply(postprocessor(enable_reasoning_filter), generated_text)
+
+def _messages(prompt: str, system_prompt: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+
+def _iter_stream(stream, stats: StreamStats = None):
+    """Yields the text deltas of a chat completion stream, recording usage in stats if sent."""
+    for chunk in stream:
+        usage = getattr(chunk, "usage", None)
+        if stats is not None and usage is not None:
+            stats.add_usage(getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def complete(
+    prompt: str,
+    api_key: str,
+    base_url: str,
+    model: str,
+    temperature: float = TEMPERATURE,
+    system_prompt: str = SYSTEM_PROMPT,
+    cancel_token=None,
+    cache_mode: str = None,
+    stats: StreamStats = None,
+    transform=None,
+    schedule=None
+) -> str:
+    """Sends prompt through the pooled client and returns the completion text (cached).
+
+    With a cancel_token the request is streamed internally so that cancelling closes only this
+    request's connection, not the shared client. Token usage, when the API reports it, is
+    added to stats. With transform (see postprocessor) the text is post-processed on the way in,
+    chunk by chunk when streamed, and cached already post-processed. schedule() (see
+    api.ratelimit.scheduled) wraps only the network request, so cache hits take no rate-limit turn."""
+    client = get_client(api_key, base_url)
+
+    def request():
+        if cancel_token is None:
+            response = client.chat.completions.create(
+                model=model,
+                messages=_messages(prompt, system_prompt),
+                temperature=temperature,
+            )
+            usage = getattr(response, "usage", None)
+            if stats is not None and usage is not None:
+                stats.add_usage(usage.prompt_tokens, usage.completion_tokens)
+            text = response.choices[0].message.content
+            return apply(transform, text) if transform is not None else text
+
+        stream = client.chat.completions.create(
+            model=model,
+            messages=_messages(prompt, system_prompt),
+            temperature=temperature,
+            stream=True,
+        )
+        cancel_token.register(stream.close)
+        try:
+            parts = []
+            for text in _iter_stream(stream, stats):
+                if stats is not None:
+                    stats.record(text)
+                parts.append(transform.feed(text) if transform is not None else text)
+            if transform is not None:
+                parts.append(transform.finish())
+            return "".join(parts)
+        finally:
+            cancel_token.unregister(stream.close)
+            stream.close()
+
+    cache = get_cache()
+    cache_args = (f"openai:{base_url}", model, temperature, system_prompt + "\n" + prompt)
+    text = cache.lookup(*cache_args, mode=cache_mode)
+    if text is not None:
+        # Entries cached before post-processing moved here are raw; the chain is idempotent
+        return apply(transform, text) if transform is not None else text
+    with schedule() if schedule is not None else nullcontext():
+        text = request()
+    cache.store(*cache_args, text, mode=cache_mode)
+    return text
+
+def complete_stream(
+    prompt: str,
+    output_path: str,
+    api_key: str,
+    base_url: str,
+    model: str,
+    temperature: float = TEMPERATURE,
+    system_prompt: str = SYSTEM_PROMPT,
+    cancel_token=None,
+    cache_mode: str = None,
+    on_chunk=None,
+    validate=check_latex_start,
+    stats: StreamStats = None,
+    transform=None,
+    schedule=None
+) -> str:
+    """Streams the completion of prompt into output_path and returns its text (cached).
+
+    With transform (see postprocessor) each chunk is post-processed before it is written, so the
+    file and the cache only ever hold the final text. A cached response is written in one go
+    without touching the network or taking a schedule() turn."""
+    stats = stats or StreamStats()
+    cache = get_cache()
+    cache_args = (f"openai:{base_url}", model, temperature, system_prompt + "\n" + prompt)
+    text = cache.lookup(*cache_args, mode=cache_mode)
+    if text is not None:
+        return consume_stream(iter([text]), output_path, stats, validate, on_chunk, cancel_token, transform)
+
+    with schedule() if schedule is not None else nullcontext():
+        stream = get_client(api_key, base_url).chat.completions.create(
+            model=model,
+            messages=_messages(prompt, system_prompt),
+            temperature=temperature,
+            stream=True,
+        )
+        if cancel_token is not None:
+            cancel_token.register(stream.close)
+        try:
+            text = consume_stream(_iter_stream(stream, stats), output_path, stats, validate, on_chunk, cancel_token,
+                                  transform)
+        finally:
+            if cancel_token is not None:
+                cancel_token.unregister(stream.close)
+            stream.close()
+    cache.store(*cache_args, text, mode=cache_mode)
+    return text
 
 def generate_content_openai(
-    topic: str, 
-    instructions: str, 
-    student_data: dict, 
-    api_key: str = None, 
-    base_url: str = None, 
+    topic: str,
+    instructions: str,
+    student_data: dict,
+    api_key: str = None,
+    base_url: str = None,
     model: str = None,
-    enable_reasoning_filter: bool = False
+    enable_reasoning_filter: bool = False,
+    cancel_token=None,
+    cache_mode: str = None
 ) -> str:
-    """Generates LaTeX content using an OpenAI-compatible API."""
-    try:
-        # Configuration
-        # If arguments are provided (from GUI), use them. Otherwise, fall back to ENV.
-        final_api_key = api_key or os.getenv("OPENAI_API_KEY")
-        final_base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-        final_model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    """Generates LaTeX content using an OpenAI-compatible API.
 
-        if not final_api_key:
-            raise ValueError("API Key is required. Please set it in the settings or .env file.")
+    If a cancel_token (core.jobs.CancelToken) is given, cancelling it aborts the in-flight request.
+    cache_mode overrides LLM_CACHE_MODE (see api.cache)."""
+    try:
+        final_api_key, final_base_url, final_model = resolve_config(api_key, base_url, model)
 
         logging.info(f"Connecting to OpenAI API at {final_base_url} with model {final_model}")
 
-        client = OpenAI(
-            api_key=final_api_key,
-            base_url=final_base_url,
+        generated_text = complete(
+            build_prompt(topic, instructions, student_data),
+            final_api_key, final_base_url, final_model,
+            cancel_token=cancel_token, cache_mode=cache_mode,
+            transform=postprocessor(enable_reasoning_filter)
         )
 
-        prompt = (
-            "Actúa como un experto académico y diseñador de LaTeX. Tu tarea es generar el código fuente LaTeX para un trabajo universitario."
-            "REQUISITOS CRÍTICOS:\n"
-            "1. NO devuelvas bloques de código markdown (no uses ```latex). Devuelve SÓLO el código puro.\n"
-            "2. El documento debe compilar correctamente con 'pdflatex'.\n"
-            "3. Usa paquetes estándar y compatibles. Para el idioma español, usa \\usepackage[spanish]{babel} (sin opciones extra como es-tabla si causan error).\n"
-            "4. NO incluyas \\maketitle ni índices (\\tableofcontents).\n"
-            "5. NO numeres las secciones (usa \\section*{}).\n"
-            "6. El contenido debe ser EXTENSO, con introducciones, desarrollo detallado, ejemplos y conclusiones.\n"
-            "\n"
-            "--- DATOS DEL ESTUDIANTE ---\n"
-            f"Nombre: {student_data['nombre']}\n"
-            f"C.I.: {student_data['ci']}\n"
-            f"Materia: {student_data['materia']}\n"
-            f"Sección: {student_data['seccion']}\n"
-            f"Universidad: {student_data['universidad']}\n"
-            f"Carrera: {student_data['carrera']}\n"
-            f"Evaluación: Evaluación N° {student_data['eval_num']} - Corte {student_data['corte']}\n"
-            f"Fecha: {student_data['fecha']}\n"
-            "\n"
-            "--- TEMA Y CONTENIDO ---\n"
-            f"Tema Principal: {topic}\n"
-            f"Instrucciones: {instructions}\n"
-            "\n"
-            "--- ESTRUCTURA ---\n"
-            "1. Portada Personalizada: Usa el marcador %%PROJECT_LOGO_PATH%% para el logo (tamaño 4cm).\n"
-            "2. Introducción: Al menos 2 párrafos.\n"
-            "3. Desarrollo: Varias secciones (sin numerar). Usa negritas, listas y cursivas para dar formato profesional.\n"
-            "4. Si es relevante, incluye alguna tabla simple.\n"
-            "5. Conclusión.\n"
-        )
+        logging.info(f"Content generated successfully. Length: {len(generated_text)} chars")
+        return generated_text
 
-        response = client.chat.completions.create(
-            model=final_model,
-            messages=[
-                {"role": "system", "content": "You are a helpful academic assistant capable of generating high-quality compiled LaTeX code."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
+    except CacheMiss:
+        raise
+
+    except Exception as e:
+        logging.error(f"OpenAI API Error: {str(e)}")
+        raise Exception(f"Failed to communicate with API: {str(e)}")
 
-        generated_text = response.choices[0].message.content
+def stream_content_openai(
+    topic: str,
+    instructions: str,
+    student_data: dict,
+    output_path: str,
+    api_key: str = None,
+    base_url: str = None,
+    model: str = None,
+    enable_reasoning_filter: bool = False,
+    cancel_token=None,
+    on_chunk=None,
+    validate=check_latex_start,
+    stats: StreamStats = None,
+    cache_mode: str = None
+) -> str:
+    """Streaming version of generate_content_openai (stream=True).
 
-        # Handle Reasoning Tags (e.g., DeepSeek <think>)
-        if enable_reasoning_filter:
-            logging.info("Applying reasoning filter (<think> tags)...")
-            # Remove content between <think> and </think> including the tags
-            generated_text = re.sub(r'<think>.*?</think>', '', generated_text, flags=re.DOTALL)
-            # Also remove just the tags if they appear without closing/opening pair issues, just in case
-            generated_text = generated_text.replace("<think>", "").replace("</think>", "")
+    Chunks are written to output_path as they arrive; on_chunk(text, stats) is called for each one.
+    validate(text_so_far) may return a reason to stop early (see api.streaming.check_latex_start),
+    which closes the stream and raises StreamAborted. Chunks are post-processed as they arrive, so
+    output_path ends up holding exactly the returned LaTeX."""
+    try:
+        final_api_key, final_base_url, final_model = resolve_config(api_key, base_url, model)
 
-        # Post-processing: Replace Logo Placeholder
-        generated_text = generated_text.replace("%%PROJECT_LOGO_PATH%%", "../logos/UAH.png")
-        
-        logging.info(f"Content generated successfully. Length: {len(generated_text)} chars")
+        logging.info(f"Streaming from OpenAI API at {final_base_url} with model {final_model}")
+
+        generated_text = complete_stream(
+            build_prompt(topic, instructions, student_data), output_path,
+            final_api_key, final_base_url, final_model,
+            cancel_token=cancel_token, cache_mode=cache_mode,
+            on_chunk=on_chunk, validate=validate, stats=stats,
+            transform=postprocessor(enable_reasoning_filter)
+        )
+
+        logging.info(f"Content streamed successfully. Length: {len(generated_text)} chars")
         return generated_text
 
+    except StreamAborted as e:
+        logging.error(f"OpenAI stream aborted: {str(e)}")
+        raise
+
+    except CacheMiss:
+        raise
+
     except Exception as e:
         logging.error(f"OpenAI API Error: {str(e)}")
         raise Exception(f"Failed to communicate with API: {str(e)}")
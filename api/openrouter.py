@@ -1,9 +1,20 @@
 import os
 import logging
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from config.settings import load_settings
+from api.cache import get_cache
+from api.transforms import provider_chain, apply
 
-load_dotenv()
+load_settings()
+
+# (connect, read) en segundos; antes no había timeout y una petición colgada bloqueaba para siempre
+TIMEOUT = (float(os.getenv("API_CONNECT_TIMEOUT", "10")), float(os.getenv("API_TIMEOUT", "180")))
+
+# Sesión compartida: reutiliza las conexiones TCP/TLS (keep-alive) entre peticiones
+SESSION = requests.Session()
+_pool_size = int(os.getenv("API_MAX_CONNECTIONS", "16"))
+SESSION.mount("https://", HTTPAdapter(pool_connections=_pool_size, pool_maxsize=_pool_size))
 
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
 HEADERS = {
@@ -19,9 +30,10 @@ HEADERS = {
 #\end{{document}}
 #"""
 
-def generate_content(topic: str, instructions: str, student_data: dict) -> str:
+def generate_content(topic: str, instructions: str, student_data: dict, cache_mode: str = None) -> str:
     """Genera un documento LaTeX completo, detallado y listo para compilar.
-    Se utiliza el marcador %%PROJECT_LOGO_PATH%% para indicar la ubicación del logo, que luego se reemplaza por la ruta relativa correcta."""
+    Se utiliza el marcador %%PROJECT_LOGO_PATH%% para indicar la ubicación del logo, que luego se reemplaza por la ruta relativa correcta.
+    cache_mode sustituye a LLM_CACHE_MODE (ver api.cache)."""
     try:
         prompt = (
             "Diseña un documento LaTeX completo, elegante, profesional y muy detallado. "
@@ -56,12 +68,16 @@ def generate_content(topic: str, instructions: str, student_data: dict) -> str:
             "temperature": 0.7
         }
 
-        response = requests.post(API_URL, headers=HEADERS, json=payload)
-        response.raise_for_status()
+        def request():
+            response = SESSION.post(API_URL, headers=HEADERS, json=payload, timeout=TIMEOUT)
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
 
-        generated_text = response.json()["choices"][0]["message"]["content"]
-        # Reemplazar el marcador por la ruta relativa correcta (desde generated_docs hacia logos)
-        generated_text = generated_text.replace("%%PROJECT_LOGO_PATH%%", "../logos/UAH.png")
+        generated_text = get_cache().fetch(
+            "openrouter", payload["model"], payload["temperature"], prompt, request, mode=cache_mode
+        )
+        # Marcas ``` fuera y marcador del logo por la ruta relativa correcta (desde generated_docs hacia logos)
+        generated_text = apply(provider_chain(), generated_text)
         logging.info(f"Contenido generado exitosamente. Longitud: {len(generated_text)} caracteres")
         return generated_text
 
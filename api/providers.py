@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+from functools import partial
+from config.settings import load_settings, env_flag
+from api.ratelimit import scheduled
+
+load_settings()
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Paquetes que carga templates/preamble.tex (el modelo no debe pedir otros)
+TEMPLATE_PACKAGES = "amsmath, amssymb, graphicx, float, array, booktabs, longtable, enumitem, xcolor, hyperref"
+
+
+def build_body_prompt(topic: str, instructions: str) -> str:
+    """Prompt para pedir solo el cuerpo del documento: preámbulo y portada se generan localmente."""
+    return (
+        "Actúa como un experto académico. Escribe el CONTENIDO en LaTeX de un trabajo universitario.\n"
+        "REQUISITOS CRÍTICOS:\n"
+        "1. Devuelve SOLO el cuerpo del documento: sin \\documentclass, preámbulo, \\begin{document}, "
+        "portada ni \\end{document}. Empieza directamente con \\section*{Introducción}.\n"
+        "2. NO devuelvas bloques de código markdown.\n"
+        f"3. Ya están cargados estos paquetes: {TEMPLATE_PACKAGES}. No uses comandos de otros paquetes.\n"
+        "4. NO numeres las secciones (usa \\section* y \\subsection*). Sin índices ni \\maketitle.\n"
+        "5. El contenido debe ser EXTENSO: introducción de al menos 2 párrafos, desarrollo en varias secciones "
+        "con negritas, listas y cursivas, alguna tabla simple si es relevante, y una conclusión.\n"
+        "\n"
+        f"Tema Principal: {topic}\n"
+        f"Instrucciones: {instructions}\n"
+    )
+
+
+class Provider:
+    """Interfaz común de los proveedores: build_prompt, generate y stream.
+
+    options es un dict opcional con 'temperature', 'cache_mode', 'cancel_token', 'priority' y
+    'job' (turno en api.ratelimit) y, para stream, 'on_chunk', 'validate' y 'stats'.
+
+    reports_first_token indica que generate marca el primer token en options['stats'] y atiende
+    options['cancel_token'], lo que necesita el hedging de api.failover."""
+
+    name = ""
+    reports_first_token = False
+
+    def build_prompt(self, topic: str, instructions: str, student_data: dict) -> str:
+        raise NotImplementedError
+
+    def build_body_prompt(self, topic: str, instructions: str) -> str:
+        """Prompt de solo cuerpo, para usar con la portada y el preámbulo locales."""
+        return build_body_prompt(topic, instructions)
+
+    def generate(self, prompt: str, options: dict = None) -> str:
+        """Devuelve el LaTeX post-procesado para prompt."""
+        raise NotImplementedError
+
+    def stream(self, prompt: str, output_path: str, options: dict = None) -> str:
+        """Como generate, pero escribe la respuesta en output_path según llega."""
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(Provider):
+    """Cualquier API compatible con OpenAI (OpenAI, OpenRouter, Z.ai, DeepSeek...) con cliente compartido.
+
+    api.openai_client (y con él openai y httpx) se importa al construir el primer proveedor, no al
+    arrancar la aplicación."""
+
+    reports_first_token = True
+
+    def __init__(self, name: str, api_key: str, base_url: str, model: str, reasoning_filter: bool = False):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.reasoning_filter = reasoning_filter
+        from api import openai_client
+        self.client = openai_client
+
+    def build_prompt(self, topic, instructions, student_data):
+        return self.client.build_prompt(topic, instructions, student_data)
+
+    def generate(self, prompt, options=None):
+        options = options or {}
+        logging.info(f"[{self.name}] {self.base_url} con modelo {self.model}")
+        return self.client.complete(
+            prompt, self.api_key, self.base_url, self.model,
+            temperature=options.get('temperature', self.client.TEMPERATURE),
+            cancel_token=options.get('cancel_token'),
+            cache_mode=options.get('cache_mode'),
+            stats=options.get('stats'),
+            transform=self.client.postprocessor(self.reasoning_filter),
+            schedule=partial(scheduled, self.name, self.api_key, prompt, options),
+        )
+
+    def stream(self, prompt, output_path, options=None):
+        options = options or {}
+        logging.info(f"[{self.name}] streaming desde {self.base_url} con modelo {self.model}")
+        return self.client.complete_stream(
+            prompt, output_path, self.api_key, self.base_url, self.model,
+            temperature=options.get('temperature', self.client.TEMPERATURE),
+            cancel_token=options.get('cancel_token'),
+            cache_mode=options.get('cache_mode'),
+            on_chunk=options.get('on_chunk'),
+            validate=options.get('validate', self.client.check_latex_start),
+            stats=options.get('stats'),
+            transform=self.client.postprocessor(self.reasoning_filter),
+            schedule=partial(scheduled, self.name, self.api_key, prompt, options),
+        )
+
+
+class GeminiProvider(Provider):
+    """Google Gemini nativo con el GenerativeModel compartido."""
+
+    name = 'Google Gemini'
+
+    def __init__(self, model: str):
+        self.model = model
+        from api import gemini
+        self.client = gemini
+
+    def build_prompt(self, topic, instructions, student_data):
+        return self.client.build_prompt(topic, instructions, student_data)
+
+    def generate(self, prompt, options=None):
+        options = options or {}
+        return self.client.complete(
+            prompt, self.model, cache_mode=options.get('cache_mode'), stats=options.get('stats'),
+            transform=self.client.postprocessor(),
+            schedule=partial(scheduled, self.name, os.getenv("GOOGLE_GEMINI_API_KEY"), prompt, options),
+        )
+
+    def stream(self, prompt, output_path, options=None):
+        options = options or {}
+        return self.client.complete_stream(
+            prompt, output_path, self.model,
+            cancel_token=options.get('cancel_token'),
+            cache_mode=options.get('cache_mode'),
+            on_chunk=options.get('on_chunk'),
+            validate=options.get('validate'),
+            stats=options.get('stats'),
+            transform=self.client.postprocessor(),
+            schedule=partial(scheduled, self.name, os.getenv("GOOGLE_GEMINI_API_KEY"), prompt, options),
+        )
+
+
+def _openrouter() -> Provider:
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("Falta OPENROUTER_API_KEY en el archivo .env")
+    return OpenAICompatibleProvider('OpenRouter', api_key, OPENROUTER_BASE_URL, os.getenv("OPENROUTER_MODEL"))
+
+
+def _openai_custom() -> Provider:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Falta OPENAI_API_KEY en el archivo .env")
+    return OpenAICompatibleProvider(
+        'OpenAI / Custom',
+        api_key,
+        os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+        reasoning_filter=env_flag("REASONING_FILTER"),
+    )
+
+
+def _gemini() -> Provider:
+    if not os.getenv("GOOGLE_GEMINI_API_KEY"):
+        raise ValueError("Falta GOOGLE_GEMINI_API_KEY en el archivo .env")
+    return GeminiProvider(os.getenv("GOOGLE_GEMINI_MODEL"))
+
+
+# Nombre mostrado en la GUI -> función que construye el proveedor a partir del .env
+PROVIDER_FACTORIES = {
+    'OpenRouter': _openrouter,
+    'Google Gemini': _gemini,
+    'OpenAI / Custom': _openai_custom,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def register_provider(name: str, factory):
+    """Registra (o reemplaza) un proveedor con la función que lo construye."""
+    with _providers_lock:
+        PROVIDER_FACTORIES[name] = factory
+        _providers.pop(name, None)
+
+
+def get_provider(name: str) -> Provider:
+    """Devuelve el proveedor name, construido una vez y reutilizado durante todo el proceso."""
+    with _providers_lock:
+        provider = _providers.get(name)
+        if provider is None:
+            factory = PROVIDER_FACTORIES.get(name)
+            if factory is None:
+                raise ValueError(f"Proveedor API desconocido: {name}")
+            provider = factory()
+            _providers[name] = provider
+        return provider
+
+
+def generate(name: str, prompt: str, options: dict = None) -> str:
+    """Atajo: get_provider(name).generate(prompt, options)."""
+    return get_provider(name).generate(prompt, options)
@@ -0,0 +1,242 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config.settings import load_settings
+from core.jobs import JobCancelled
+
+load_settings()
+
+# Prioridades (menor = antes): la GUI espera a un usuario delante; los lotes pueden esperar
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Tokens de salida que se reservan por petición si no se sabe más (se ajusta al terminar con usage)
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "4000"))
+CHARS_PER_TOKEN = 4
+
+# Espera tras un 429 sin Retry-After
+RATE_LIMIT_PAUSE = 5.0
+
+# Nombre del proveedor -> prefijo de sus variables <PREFIJO>_RPM / <PREFIJO>_TPM en el .env
+LIMIT_PREFIXES = {
+    'OpenRouter': 'OPENROUTER',
+    'Google Gemini': 'GOOGLE_GEMINI',
+    'OpenAI / Custom': 'OPENAI',
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+
+def limits_for(provider_name: str) -> tuple:
+    """(peticiones/min, tokens/min) del proveedor: <PREFIJO>_RPM/_TPM o LLM_RPM/LLM_TPM; 0 = sin límite."""
+    prefix = LIMIT_PREFIXES.get(provider_name)
+    values = []
+    for suffix in ('RPM', 'TPM'):
+        value = os.getenv(f"{prefix}_{suffix}") if prefix else None
+        values.append(float(value if value not in (None, "") else os.getenv(f"LLM_{suffix}", "0")))
+    return tuple(values)
+
+
+class TokenBucket:
+    """Cubo de capacity unidades que se rellena a rate unidades/s. No es thread-safe por sí solo:
+    lo protege el lock de la clave a la que pertenece."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta poder tomar amount (0 si ya se puede)."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Devuelve (o, con amount negativo, cobra) la diferencia entre lo reservado y lo usado."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _KeyState:
+    """Cubos de peticiones y tokens de una clave de API y la cola de espera por prioridad."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm, rpm / 60) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, tpm / 60) if tpm > 0 else None
+        self.paused_until = 0.0
+        self.waiting = []  # (prioridad, orden, trabajo) de las peticiones en espera
+        self.served = {}  # trabajo -> peticiones concedidas (reparto justo entre trabajos)
+        self.condition = threading.Condition()
+
+    def head(self):
+        """Siguiente petición en salir: por prioridad, luego la del trabajo con menos peticiones
+        concedidas hasta ahora y luego por orden de llegada."""
+        return min(self.waiting, key=lambda w: (w[0], self.served.get(w[2], 0), w[1]))
+
+    def wait_time(self, tokens: int) -> float:
+        waits = [self.paused_until - time.monotonic()]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens))
+        return max(0.0, *waits)
+
+
+class RateLimiter:
+    """Planificador delante de las llamadas a los proveedores para claves de API compartidas.
+
+    Cada clave tiene un cubo de peticiones/min y otro de tokens/min. Una petición reserva sus
+    tokens estimados (prompt + salida esperada) antes de salir y, al terminar, se ajusta con el
+    usage real. Las peticiones en espera salen por prioridad y, a igual prioridad, primero las del
+    trabajo con menos peticiones concedidas (así un trabajo por secciones no acapara la clave) y
+    luego por orden de llegada. Un 429 pausa toda la clave en lugar de dejar que cada hilo
+    reintente por su cuenta."""
+
+    def __init__(self):
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+
+    def _state(self, key: str, provider_name: str):
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState(*limits_for(provider_name))
+            return state
+
+    def acquire(self, key: str, provider_name: str, tokens: int, priority: int = PRIORITY_INTERACTIVE,
+                job=None, cancel_token=None):
+        """Bloquea hasta que la petición puede salir y devuelve su estado de clave (para release)."""
+        state = self._state(key, provider_name)
+        if state.requests is None and state.tokens is None and state.paused_until <= time.monotonic():
+            return state
+
+        with state.condition:
+            entry = (priority, next(self._order), job)
+            state.waiting.append(entry)
+            queued_at = time.monotonic()
+            try:
+                while True:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        raise JobCancelled("Trabajo cancelado por el usuario")
+                    wait = state.wait_time(tokens) if state.head() is entry else None
+                    if wait == 0:
+                        break
+                    # Solo la cabeza de la cola mira los cubos; el resto espera a que salga
+                    state.condition.wait(min(wait, 0.5) if wait is not None else 0.5)
+            finally:
+                state.waiting.remove(entry)
+                state.condition.notify_all()
+
+            if state.requests is not None:
+                state.requests.take(1)
+            if state.tokens is not None:
+                state.tokens.take(tokens)
+            state.served[job] = state.served.get(job, 0) + 1
+        waited = time.monotonic() - queued_at
+        if waited > 1:
+            logging.info(f"[{provider_name}] petición retenida {waited:.1f} s por el límite de la API")
+        return state
+
+    def release(self, state: _KeyState, reserved: int, used: int = None, rate_limited: float = None):
+        """Ajusta la reserva con los tokens usados y, si hubo 429, pausa la clave rate_limited s."""
+        with state.condition:
+            if state.tokens is not None and used is not None:
+                state.tokens.give_back(reserved - used)
+            if rate_limited is not None:
+                state.paused_until = max(state.paused_until, time.monotonic() + rate_limited)
+            state.condition.notify_all()
+
+    def forget(self, job):
+        """Olvida el reparto del trabajo job cuando termina."""
+        with self._lock:
+            states = list(self._keys.values())
+        for state in states:
+            with state.condition:
+                state.served.pop(job, None)
+
+
+_limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    return _limiter
+
+
+def limit_key(provider_name: str, api_key: str = None) -> str:
+    """Clave del cubo: el proveedor y un hash de la clave de API (nunca la clave en claro)."""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    return f"{provider_name}:{digest}"
+
+
+def _retry_after(error: Exception):
+    """Segundos a esperar si error es un 429 (Retry-After si viene), o None si no lo es."""
+    status = getattr(error, 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    if status != 429:
+        return None
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after') or RATE_LIMIT_PAUSE)
+    except (TypeError, ValueError):
+        return RATE_LIMIT_PAUSE
+
+
+@contextmanager
+def scheduled(provider_name: str, api_key: str, prompt: str, options: dict = None):
+    """Envuelve una llamada al proveedor: espera turno y reserva prompt + salida esperada.
+
+    options puede traer 'priority', 'job', 'max_tokens', 'cancel_token' y 'stats' (para ajustar
+    la reserva con el usage real)."""
+    options = options or {}
+    if options.get('cache_mode') == 'replay':
+        yield  # Solo respuestas guardadas: no sale ninguna petición
+        return
+    stats = options.get('stats')
+    expected = options.get('max_tokens') or EXPECTED_OUTPUT_TOKENS
+    reserved = estimate_tokens(prompt) + expected
+    before = _usage(stats)
+
+    limiter = get_rate_limiter()
+    state = limiter.acquire(
+        limit_key(provider_name, api_key), provider_name, reserved,
+        priority=options.get('priority', PRIORITY_INTERACTIVE), job=options.get('job'),
+        cancel_token=options.get('cancel_token'),
+    )
+    try:
+        yield
+    except Exception as e:
+        pause = _retry_after(e)
+        if pause is not None:
+            logging.warning(f"[{provider_name}] 429 de la API; se pausa la clave {pause:.0f} s")
+        # Un 429 no consumió tokens: se devuelve la reserva
+        limiter.release(state, reserved, 0 if pause is not None else None, rate_limited=pause)
+        raise
+    # Con usage compartido entre llamadas paralelas la diferencia es aproximada; sin usage se
+    # mantiene la reserva
+    used = _usage(stats) - before if stats is not None and _usage(stats) > before else None
+    limiter.release(state, reserved, used)
+
+
+def _usage(stats) -> int:
+    if stats is None:
+        return 0
+    return (stats.prompt_tokens or 0) + (stats.completion_tokens or 0)
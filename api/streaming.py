@@ -0,0 +1,184 @@
+import logging
+import re
+import threading
+import time
+
+# Caracteres visibles (sin bloque <think>) tras los que debe haber aparecido \documentclass
+DOCUMENTCLASS_WINDOW = 400
+
+_LEADING_THINK = re.compile(r'^\s*<think>.*?</think>', flags=re.DOTALL)
+_LEADING_FENCE = re.compile(r'^\s*```[a-zA-Z]*\s*')
+
+
+class StreamAborted(Exception):
+    """La salida en streaming se detuvo antes de terminar (salida inválida o cancelación)."""
+
+
+class StreamStats:
+    """Tiempos de una respuesta en streaming (time-to-first-token y tokens por segundo) y tokens
+    informados por el proveedor, acumulados si el mismo objeto recorre varias llamadas."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.end = None
+        self.chunks = 0
+        self.chars = 0
+        self.prompt_tokens = None  # Los informa el proveedor si los envía (usage)
+        self.completion_tokens = None
+        self._lock = threading.Lock()
+
+    def add_usage(self, prompt_tokens=None, completion_tokens=None):
+        with self._lock:
+            if prompt_tokens:
+                self.prompt_tokens = (self.prompt_tokens or 0) + prompt_tokens
+            if completion_tokens:
+                self.completion_tokens = (self.completion_tokens or 0) + completion_tokens
+
+    def record(self, text: str):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+        self.chars += len(text)
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    @property
+    def tokens(self) -> int:
+        # Sin usage, cada delta del stream equivale aproximadamente a un token
+        return self.completion_tokens if self.completion_tokens is not None else self.chunks
+
+    @property
+    def tokens_per_second(self):
+        if self.first_token_at is None:
+            return None
+        elapsed = (self.end or time.perf_counter()) - self.first_token_at
+        return self.tokens / elapsed if elapsed > 0 else None
+
+    def as_dict(self) -> dict:
+        ttft = self.time_to_first_token
+        tps = self.tokens_per_second
+        return {
+            'ttft_s': round(ttft, 3) if ttft is not None else None,
+            'tokens': self.tokens,
+            'prompt_tokens': self.prompt_tokens,
+            'tokens_per_s': round(tps, 1) if tps is not None else None,
+            'chars': self.chars,
+            'seconds': round((self.end or time.perf_counter()) - self.start, 3),
+        }
+
+
+def check_latex_start(text: str, allow_fence: bool = False):
+    """Detecta pronto una salida claramente rota. Devuelve el motivo, True cuando el documento ya
+    arrancó bien (aparece \\documentclass) o None si aún no se puede saber.
+
+    Ignora un bloque <think> inicial. Con allow_fence se tolera un ```latex inicial,
+    que luego se elimina en el post-procesado."""
+    if text.lstrip().startswith('<think>'):
+        match = _LEADING_THINK.match(text)
+        if not match:
+            return None  # Sigue razonando: todavía no hay contenido visible
+        text = text[match.end():]
+
+    visible = text.lstrip()
+    if visible.startswith('```'):
+        if not allow_fence:
+            return "La respuesta empieza con un bloque de código markdown"
+        visible = _LEADING_FENCE.sub('', visible, count=1)
+
+    if '\\documentclass' in visible:
+        return True
+    if len(visible) >= DOCUMENTCLASS_WINDOW:
+        return "La respuesta no empieza con \\documentclass"
+    return None
+
+
+def check_latex_body(text: str, allow_fence: bool = True):
+    """Como check_latex_start, para respuestas que solo traen el cuerpo (plantilla local): basta con
+    que aparezca algún comando LaTeX en los primeros DOCUMENTCLASS_WINDOW caracteres."""
+    if text.lstrip().startswith('<think>'):
+        match = _LEADING_THINK.match(text)
+        if not match:
+            return None
+        text = text[match.end():]
+
+    visible = text.lstrip()
+    if visible.startswith('```'):
+        if not allow_fence:
+            return "La respuesta empieza con un bloque de código markdown"
+        visible = _LEADING_FENCE.sub('', visible, count=1)
+
+    if re.search(r'\\[a-zA-Z]', visible):
+        return True
+    if len(visible) >= DOCUMENTCLASS_WINDOW:
+        return "La respuesta no contiene código LaTeX"
+    return None
+
+
+def consume_stream(chunks, output_path: str, stats: StreamStats = None, validate=check_latex_start,
+                   on_chunk=None, cancel_token=None, transform=None) -> str:
+    """Escribe en output_path cada fragmento de texto según llega y devuelve el texto completo.
+
+    Con transform (un api.transforms.Transformer) cada fragmento pasa por él antes de escribirse,
+    validarse y guardarse, de modo que lo que descarta (p. ej. un bloque <think>) nunca se acumula.
+    validate(texto) se consulta hasta que devuelve True (el documento arrancó bien); si devuelve
+    un motivo se lanza StreamAborted. on_chunk(fragmento, stats) permite mostrar el avance y recibe
+    el fragmento tal como llegó."""
+    stats = stats or StreamStats()
+    parts = []
+    head = ""  # Texto acumulado mientras aún se valida el arranque
+    validated = validate is None
+
+    def emit(text):
+        nonlocal head, validated
+        if not text:
+            return
+        parts.append(text)
+        f.write(text)
+        f.flush()
+        if not validated:
+            head += text
+            reason = validate(head)
+            if reason is True:
+                validated = True
+                head = ""
+            elif reason:
+                raise StreamAborted(reason)
+
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        for text in chunks:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if not text:
+                continue
+
+            stats.record(text)
+            emit(transform.feed(text) if transform is not None else text)
+
+            if on_chunk is not None:
+                on_chunk(text, stats)
+
+        if transform is not None:
+            emit(transform.finish())
+
+    stats.finish()
+    if not validated:
+        raise StreamAborted("La respuesta terminó sin contenido LaTeX válido")
+
+    log_stream_stats(stats)
+    return "".join(parts)
+
+
+def log_stream_stats(stats: StreamStats):
+    data = stats.as_dict()
+    logging.info(
+        f"Streaming terminado: TTFT {data['ttft_s']} s, {data['tokens']} tokens, "
+        f"{data['tokens_per_s']} tokens/s, {data['chars']} caracteres"
+    )
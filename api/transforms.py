@@ -0,0 +1,265 @@
+"""Post-proceso incremental de la salida de los proveedores.
+
+Cada transformador recibe el texto por fragmentos (feed) y devuelve lo que ya puede emitir,
+reteniendo solo lo necesario para reconocer una marca partida entre dos fragmentos (y ThinkFilter,
+el bloque <think> aún abierto); finish() entrega lo retenido al terminar. Así el mismo código sirve para respuestas en streaming y para
+textos completos (apply), en una sola pasada y sin copiar el documento entero en cada paso.
+
+    chain = provider_chain(reasoning_filter=True)
+    for chunk in response:
+        f.write(chain.feed(chunk))
+    f.write(chain.finish())
+
+Los transformadores guardan estado: se crea una cadena nueva por respuesta.
+"""
+import logging
+import re
+
+from utils.latex_template import LOGO_PATH
+
+LOGO_PLACEHOLDER = "%%PROJECT_LOGO_PATH%%"
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+_FENCE_LINE = re.compile(r'^\s*```[a-zA-Z]*\s*$')
+# Inicio de línea que todavía puede acabar siendo una marca ``` (espacios, ` o ``` + lenguaje)
+_FENCE_PREFIX = re.compile(r'^\s*(`{0,2}|```[a-zA-Z]*\s*)$')
+# Más allá de esto un inicio de línea ya no se retiene esperando a ver si es una marca
+FENCE_MAX_PREFIX = 64
+
+
+def _partial(text: str, token: str) -> int:
+    """Longitud del final de text que coincide con el principio de token (lo que hay que retener)."""
+    for size in range(min(len(token) - 1, len(text)), 0, -1):
+        if text.endswith(token[:size]):
+            return size
+    return 0
+
+
+class Transformer:
+    """Transformador incremental: feed(fragmento) devuelve el texto listo, finish() el resto."""
+
+    def feed(self, text: str) -> str:
+        return text
+
+    def finish(self) -> str:
+        return ""
+
+
+class ThinkFilter(Transformer):
+    """Descarta los bloques <think>...</think> de los modelos de razonamiento según llegan.
+
+    Como el filtro anterior (re.sub no codicioso y luego quitar etiquetas sueltas): el texto de un
+    bloque se retiene hasta ver </think> y entonces se descarta; si el bloque no llega a cerrarse,
+    al terminar se entrega ese texto y solo se quitan las etiquetas, para que una etiqueta mal
+    puesta no vacíe el documento."""
+
+    def __init__(self):
+        self.inside = False
+        self.dropped = 0
+        self._buffer = ""
+        self._held = []  # Texto del bloque abierto, por fragmentos (sin copiarlo en cada feed)
+
+    def feed(self, text):
+        buffer = self._buffer + text
+        out = []
+        while buffer:
+            if self.inside:
+                end = buffer.find(THINK_CLOSE)
+                if end < 0:
+                    keep = _partial(buffer, THINK_CLOSE)
+                    self._held.append(buffer[:len(buffer) - keep])
+                    buffer = buffer[len(buffer) - keep:]
+                    break
+                self.dropped += sum(map(len, self._held)) + end
+                self._held = []
+                buffer = buffer[end + len(THINK_CLOSE):]
+                self.inside = False
+                continue
+            start = buffer.find(THINK_OPEN)
+            stray = buffer.find(THINK_CLOSE)
+            if stray >= 0 and (start < 0 or stray < start):
+                out.append(buffer[:stray])
+                buffer = buffer[stray + len(THINK_CLOSE):]
+                continue
+            if start < 0:
+                keep = max(_partial(buffer, THINK_OPEN), _partial(buffer, THINK_CLOSE))
+                out.append(buffer[:len(buffer) - keep])
+                buffer = buffer[len(buffer) - keep:]
+                break
+            out.append(buffer[:start])
+            buffer = buffer[start + len(THINK_OPEN):]
+            self.inside = True
+        self._buffer = buffer
+        return "".join(out)
+
+    def finish(self):
+        if self.dropped:
+            logging.info(f"Filtro de razonamiento: {self.dropped} caracteres de <think> descartados")
+        rest, self._buffer = self._buffer, ""
+        if self.inside:
+            logging.warning("Filtro de razonamiento: <think> sin cerrar, se quita solo la etiqueta")
+            rest = ("".join(self._held) + rest).replace(THINK_OPEN, "")
+            self._held = []
+            self.inside = False
+        return rest
+
+
+class Replace(Transformer):
+    """Sustituye cada aparición de old por new (p. ej. el marcador del logo)."""
+
+    def __init__(self, old: str, new: str):
+        self.old = old
+        self.new = new
+        self._buffer = ""
+
+    def feed(self, text):
+        # Como str.replace: apariciones de izquierda a derecha, sin solaparse
+        *parts, buffer = (self._buffer + text).split(self.old)
+        head = "".join(part + self.new for part in parts)
+        keep = _partial(buffer, self.old)
+        self._buffer = buffer[len(buffer) - keep:]
+        return head + buffer[:len(buffer) - keep]
+
+    def finish(self):
+        rest, self._buffer = self._buffer, ""
+        return rest
+
+
+class FenceFilter(Transformer):
+    """Quita las líneas de bloque de código markdown (```latex / ```) con las que algunos modelos
+    envuelven el documento y, como strip_fences, las marcas ``` que queden dentro de una línea.
+    Solo retiene el inicio de la línea en curso mientras pueda ser una marca."""
+
+    def __init__(self):
+        self.removed = 0
+        self._line = ""       # Inicio de la línea en curso, aún sin decidir
+        self._passing = False  # La línea en curso ya se sabe que no es una marca
+        self._newline = False  # Salto de línea retenido: se pierde si el texto acaba en una marca
+        self._inline = Chain(Replace('```latex', ''), Replace('```', ''))
+
+    def feed(self, text):
+        text = self._feed_lines(text)
+        if not text:
+            return ""
+        if self._newline:
+            text = "\n" + text
+        self._newline = text.endswith("\n")
+        return self._inline.feed(text[:-1] if self._newline else text)
+
+    def _feed_lines(self, text):
+        out = []
+        buffer = self._line + text
+        self._line = ""
+        while buffer:
+            newline = buffer.find('\n')
+            if self._passing:
+                if newline < 0:
+                    out.append(buffer)
+                    break
+                out.append(buffer[:newline + 1])
+                buffer = buffer[newline + 1:]
+                self._passing = False
+                continue
+            line = buffer if newline < 0 else buffer[:newline]
+            if newline < 0:
+                if len(line) <= FENCE_MAX_PREFIX and _FENCE_PREFIX.match(line):
+                    self._line = line
+                else:
+                    out.append(line)
+                    self._passing = True
+                break
+            if _FENCE_LINE.match(line):
+                self.removed += 1
+            else:
+                out.append(buffer[:newline + 1])
+            buffer = buffer[newline + 1:]
+        return "".join(out)
+
+    def finish(self):
+        rest, self._line = self._line, ""
+        self._passing = False
+        if _FENCE_LINE.match(rest):
+            self.removed += 1
+            rest = ""
+        elif self._newline:
+            rest = "\n" + rest
+        self._newline = False
+        return (self._inline.feed(rest) if rest else "") + self._inline.finish()
+
+
+class InsertBefore(Transformer):
+    """Inserta text antes de la primera aparición de marker (o al final si marker no aparece)."""
+
+    def __init__(self, marker: str, text: str):
+        self.marker = marker
+        self.text = text
+        self.done = not text
+        self._buffer = ""
+
+    def feed(self, text):
+        if self.done:
+            return text
+        buffer = self._buffer + text
+        index = buffer.find(self.marker)
+        if index >= 0:
+            self.done = True
+            self._buffer = ""
+            return buffer[:index] + self.text + buffer[index:]
+        keep = _partial(buffer, self.marker)
+        self._buffer = buffer[len(buffer) - keep:]
+        return buffer[:len(buffer) - keep]
+
+    def finish(self):
+        rest, self._buffer = self._buffer, ""
+        if self.done:
+            return rest
+        self.done = True
+        return rest + self.text
+
+
+class Chain(Transformer):
+    """Encadena transformadores: la salida de cada uno es la entrada del siguiente."""
+
+    def __init__(self, *transformers):
+        self.transformers = [t for t in transformers if t is not None]
+
+    def feed(self, text):
+        for transformer in self.transformers:
+            if not text:
+                return ""
+            text = transformer.feed(text)
+        return text
+
+    def finish(self):
+        text = ""
+        for transformer in self.transformers:
+            text = (transformer.feed(text) if text else "") + transformer.finish()
+        return text
+
+
+def apply(transformer: Transformer, text: str) -> str:
+    """Pasa un texto completo por transformer."""
+    return transformer.feed(text) + transformer.finish()
+
+
+def transform_stream(chunks, transformer: Transformer):
+    """Generador con la salida de transformer para cada fragmento de chunks."""
+    for chunk in chunks:
+        text = transformer.feed(chunk)
+        if text:
+            yield text
+    text = transformer.finish()
+    if text:
+        yield text
+
+
+def provider_chain(reasoning_filter: bool = False) -> Chain:
+    """Post-proceso común de la salida de los proveedores: bloques <think> (con REASONING_FILTER),
+    marcas ``` y marcador del logo (la compilación se hace desde generated_docs, así que el logo
+    queda en LOGO_PATH)."""
+    return Chain(
+        ThinkFilter() if reasoning_filter else None,
+        FenceFilter(),
+        Replace(LOGO_PLACEHOLDER, LOGO_PATH),
+    )
@@ -0,0 +1,283 @@
+"""Modo por lotes sin GUI: genera una tarea por cada fila de un roster CSV/JSONL.
+
+Uso:
+    python batch.py roster.csv --workers 4 --report generated_docs/batch_report.json
+    python batch.py roster.csv --fanout --variants 2   # un cuerpo por sección y tema (core.fanout)
+
+Columnas del roster (CSV con cabecera o una línea JSON por trabajo):
+    topic, instructions, subject, nombre, ci, turno (DCM/DCN), trimester, section,
+    eval_num, corte, provider, add_images, priority (menor = antes; por defecto 10)
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config.settings import load_settings
+from api.cache import get_cache, CACHE_MODES
+from api.ratelimit import PRIORITY_BATCH
+from core.artifacts import artifacts_enabled, get_store
+from core.metrics import JobMetrics, metrics_enabled, summarize, write_summary, print_stages
+from core.fanout import run_fanout
+from core.pipeline import run_pipeline, OUTPUT_DIR, IMAGE_DIR
+from utils import build_student_data
+from utils.latex_template import template_enabled
+from utils.logger import setup_logger
+from utils.validators import collect_input_errors
+
+load_settings()
+
+# Columna del roster -> clave del diccionario `values` que produce la GUI
+ROSTER_FIELDS = {
+    'topic': '-TOPIC-',
+    'instructions': '-INSTRUCTIONS-',
+    'subject': '-SUBJECT-',
+    'nombre': '-NOMBRE-',
+    'ci': '-CI-',
+    'trimester': '-TRIMESTER-',
+    'section': '-SECTION-',
+    'eval_num': '-EVAL_NUM-',
+    'corte': '-CORTE-',
+    'provider': '-API-PROVIDER-',
+}
+
+TRUE_VALUES = ('true', '1', 't', 'yes', 'si', 'sí', 'x')
+
+
+def read_roster(path: str) -> list:
+    """Lee un roster .csv o .jsonl y devuelve una lista de dicts (una fila por trabajo)."""
+    with open(path, encoding='utf-8-sig') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def row_to_values(row: dict, default_provider: str, default_images: bool) -> dict:
+    """Convierte una fila del roster al mismo diccionario `values` que entrega la ventana."""
+    row = {str(k).strip().lower(): v for k, v in row.items()}
+    values = {key: str(row.get(column) or '').strip() for column, key in ROSTER_FIELDS.items()}
+
+    values['-API-PROVIDER-'] = values['-API-PROVIDER-'] or default_provider
+    # Los combos de la GUI siempre usan dos dígitos ('01')
+    values['-TRIMESTER-'] = values['-TRIMESTER-'].zfill(2)
+    values['-SECTION-'] = values['-SECTION-'].zfill(2)
+
+    turno = str(row.get('turno') or 'DCM').strip().upper()
+    values['-MORNING-'] = turno != 'DCN'
+    values['-NIGHT-'] = turno == 'DCN'
+
+    add_images = row.get('add_images')
+    if add_images is None or add_images == '':
+        values['-ADD_IMAGES-'] = default_images
+    else:
+        values['-ADD_IMAGES-'] = str(add_images).strip().lower() in TRUE_VALUES
+
+    # Los lotes ceden el turno de la API a la GUI (ver api.ratelimit)
+    priority = str(row.get('priority') or '').strip()
+    values['-PRIORITY-'] = int(priority) if priority.lstrip('-').isdigit() else PRIORITY_BATCH
+    return values
+
+
+def find_existing(values: dict, output_dir: str):
+    """Documento ya generado para la fila según el índice de core.artifacts, o None."""
+    if not artifacts_enabled():
+        return None
+    try:
+        return get_store(output_dir).latest(build_student_data(values), values['-TOPIC-'])
+    except Exception as e:
+        logging.warning(f"No se pudo consultar el índice de documentos: {e}")
+        return None
+
+
+def new_job(index: int, values: dict) -> tuple:
+    """(status, metrics) iniciales del trabajo index del lote."""
+    job_id = f"{index:04d}_{uuid.uuid4().hex[:6]}"
+    status = {
+        'job': index,
+        'job_id': job_id,
+        'nombre': values['-NOMBRE-'],
+        'topic': values['-TOPIC-'],
+        'status': 'pending',
+    }
+    return status, JobMetrics(job_id, batch=True)
+
+
+def skip_job(status: dict, metrics: JobMetrics, values: dict, output_dir: str, reuse: bool = False) -> bool:
+    """Completa status y devuelve True si la fila no hay que generarla: datos inválidos o, con reuse,
+    documento ya existente."""
+    errors = collect_input_errors(values)
+    if errors:
+        status.update(status='invalid', error="; ".join(errors))
+        metrics.set(status='invalid')
+        status['metrics'] = metrics.as_dict()
+        return True
+
+    if reuse:
+        previous = find_existing(values, output_dir)
+        if previous is not None:
+            logging.info(f"[lote {status['job_id']}] Ya existe: {previous['pdf_path']}")
+            status.update(status='ok', pdf=previous['pdf_path'], tex=previous['tex_path'], reused=True, seconds=0)
+            metrics.set(status='reused')
+            status['metrics'] = metrics.as_dict()
+            return True
+    return False
+
+
+def run_job(index: int, values: dict, output_dir: str, image_dir: str, stream: bool = None,
+            cache_mode: str = None, reuse: bool = False) -> dict:
+    """Ejecuta un trabajo del lote y devuelve su estado con sus métricas (nunca lanza excepciones)."""
+    status, metrics = new_job(index, values)
+    job_id = status['job_id']
+    start = time.perf_counter()
+    if skip_job(status, metrics, values, output_dir, reuse):
+        return status
+
+    try:
+        logging.info(f"[lote {job_id}] Iniciando: {values['-NOMBRE-']} - {values['-TOPIC-']}")
+        result = run_pipeline(values, output_dir=output_dir, image_dir=image_dir, job_id=job_id, stream=stream,
+                              cache_mode=cache_mode, metrics=metrics)
+        status.update(status='ok', **result)
+    except Exception as e:
+        logging.error(f"[lote {job_id}] Error: {str(e)}")
+        status.update(status='error', error=str(e))
+    finally:
+        status['seconds'] = round(time.perf_counter() - start, 2)
+        status['metrics'] = metrics.as_dict()
+    logging.info(f"[lote {job_id}] {status['status']} en {status['seconds']} s")
+    return status
+
+
+def run_batch(rows: list, workers: int = 4, provider: str = 'OpenRouter', add_images: bool = True,
+              output_dir: str = OUTPUT_DIR, image_dir: str = IMAGE_DIR, stream: bool = None,
+              cache_mode: str = None, sectioned: bool = False, reuse: bool = False, fanout: bool = False,
+              variants: int = None) -> dict:
+    """Ejecuta todas las filas en un pool acotado de hilos y devuelve el resumen del lote.
+
+    Con reuse, las filas que ya tienen documento en el índice de core.artifacts (mismo estudiante,
+    sección, evaluación y tema) no se vuelven a generar. Con fanout (core.fanout) las filas de una
+    misma sección y tema comparten un cuerpo generado y compilado una vez, más hasta variants
+    reescrituras; el resumen incluye entonces 'groups'."""
+    start = time.perf_counter()
+    jobs = [row_to_values(row, provider, add_images) for row in rows]
+    for values in jobs:
+        values['-SECTIONED-'] = sectioned
+    if fanout and not template_enabled():
+        logging.warning("El modo fan-out necesita la plantilla local (LOCAL_TEMPLATE): "
+                        "cada fila se genera por separado")
+        fanout = False
+    results = []
+    groups = None
+
+    if fanout:
+        pending = []
+        for i, values in enumerate(jobs, start=1):
+            status, metrics = new_job(i, values)
+            if skip_job(status, metrics, values, output_dir, reuse):
+                results.append(status)
+            else:
+                pending.append((status, metrics, values))
+        shared = run_fanout(pending, workers, output_dir, image_dir, cache_mode, variants)
+        results += shared['jobs']
+        groups = shared['groups']
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(run_job, i, values, output_dir, image_dir, stream, cache_mode, reuse)
+                for i, values in enumerate(jobs, start=1)
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+    results.sort(key=lambda r: r['job'])
+    elapsed = time.perf_counter() - start
+    records = [r['metrics'] for r in results] + [g['metrics'] for g in groups or []]
+    if metrics_enabled():
+        # Resumen del lote en metrics/batch_<fecha>.prom y .csv
+        metrics_summary = write_summary(records, stem=f"batch_{time.strftime('%Y%m%d%H%M%S')}")
+    else:
+        metrics_summary = summarize(records)
+    ok = sum(1 for r in results if r['status'] == 'ok')
+    summary = {
+        'total': len(results),
+        'ok': ok,
+        'failed': len(results) - ok,
+        'workers': workers,
+        'seconds': round(elapsed, 2),
+        'docs_per_minute': round(ok / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        'llm_cache': get_cache().stats(),
+        'metrics': metrics_summary,
+        'jobs': results,
+    }
+    if groups is not None:
+        summary['groups'] = groups
+    return summary
+
+
+def print_summary(summary: dict):
+    """Imprime una tabla corta con el estado de cada trabajo."""
+    for job in summary['jobs']:
+        detail = job.get('pdf') or job.get('error', '')
+        print(f"{job['job']:>4}  {job['status']:<8} {job.get('seconds', 0):>7}s  {detail}")
+    print(
+        f"\nTotal: {summary['total']}  OK: {summary['ok']}  Fallidos: {summary['failed']}  "
+        f"Tiempo: {summary['seconds']} s  ({summary['docs_per_minute']} docs/min)"
+    )
+    cache = summary['llm_cache']
+    print(f"Caché LLM: {cache['hits']} aciertos, {cache['misses']} fallos ({cache['entries']} entradas)")
+    if 'groups' in summary:
+        versions = sum(group['variants'] for group in summary['groups'])
+        print(f"Fan-out: {len(summary['groups'])} grupos, {versions} cuerpos compartidos")
+    print()
+    print_stages(summary['metrics'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera tareas en lote a partir de un roster CSV/JSONL.")
+    parser.add_argument('roster', help="Ruta del roster .csv o .jsonl")
+    parser.add_argument('--workers', type=int, default=4, help="Trabajos simultáneos (por defecto 4)")
+    parser.add_argument('--provider', default='OpenRouter',
+                        choices=['OpenRouter', 'Google Gemini', 'OpenAI / Custom'],
+                        help="Proveedor para filas sin columna 'provider'")
+    parser.add_argument('--no-images', action='store_true', help="No añadir imágenes salvo que la fila lo pida")
+    parser.add_argument('--stream', action='store_true', default=None,
+                        help="Pedir las respuestas en streaming (por defecto según STREAM_OUTPUT)")
+    parser.add_argument('--cache', choices=CACHE_MODES, default=None,
+                        help="Modo de la caché de respuestas: on, refresh (forzar), replay (sin red) u off")
+    parser.add_argument('--sections', action='store_true',
+                        help="Generar por secciones en paralelo tras un esquema (por defecto según GENERATION_MODE)")
+    parser.add_argument('--reuse', action='store_true',
+                        help="No regenerar filas que ya tienen documento en el índice de generated_docs")
+    parser.add_argument('--fanout', action='store_true',
+                        help="Un solo cuerpo por sección y tema; a cada estudiante solo se le compone la portada")
+    parser.add_argument('--variants', type=int, default=None,
+                        help="Con --fanout, reescrituras extra del cuerpo por grupo (por defecto FANOUT_VARIANTS)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--report', help="Ruta del reporte JSON (por defecto <output-dir>/batch_report_<fecha>.json)")
+    args = parser.parse_args(argv)
+
+    setup_logger()
+    rows = read_roster(args.roster)
+    logging.info(f"Lote de {len(rows)} trabajos con {args.workers} workers")
+
+    summary = run_batch(rows, args.workers, args.provider, not args.no_images, args.output_dir,
+                        stream=args.stream, cache_mode=args.cache, sectioned=args.sections, reuse=args.reuse,
+                        fanout=args.fanout, variants=args.variants)
+
+    report_path = args.report or os.path.join(
+        args.output_dir, f"batch_report_{time.strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print_summary(summary)
+    print(f"Reporte: {report_path}")
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
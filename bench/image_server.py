@@ -0,0 +1,111 @@
+"""Buscador e hosting de imágenes locales para benchmarks sin red.
+
+GET /search?q=...  -> {"results": [{"thumbnail": "http://.../img/<n>.jpg"}, ...]}
+GET /img/<n>.jpg   -> JPEG generado al arrancar (cada uno visualmente distinto, para que la
+                      deduplicación perceptual no los descarte)
+
+search_local(query, session) se registra en utils.image_scraper.SEARCH_BACKENDS en lugar de
+Google/DuckDuckGo.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from PIL import Image, ImageDraw
+
+IMAGE_COUNT = 12
+RESULTS_PER_SEARCH = 6
+
+
+def make_images(count: int = IMAGE_COUNT, size: int = 480) -> list:
+    """JPEGs sintéticos: bloques de colores con una disposición distinta en cada uno."""
+    images = []
+    for n in range(count):
+        rng = random.Random(n)
+        image = Image.new("RGB", (size, size * 3 // 4), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x0, y0 = rng.randrange(size), rng.randrange(size * 3 // 4)
+            x1, y1 = x0 + rng.randrange(40, size // 2), y0 + rng.randrange(40, size // 2)
+            draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def make_handler(images: list, latency: float, base_url_ref: list):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            time.sleep(latency)
+            if url.path == "/search":
+                # Resultados distintos según la búsqueda, pero estables entre ejecuciones
+                start = sum(url.query.encode("utf-8")) % len(images)
+                indexes = [(start + i) % len(images) for i in range(RESULTS_PER_SEARCH)]
+                payload = {"results": [{"thumbnail": f"{base_url_ref[0]}/img/{i}.jpg"} for i in indexes]}
+                self._send(json.dumps(payload).encode("utf-8"), "application/json")
+            elif url.path.startswith("/img/"):
+                try:
+                    data = images[int(url.path[5:].split(".")[0])]
+                except (ValueError, IndexError):
+                    self.send_error(404)
+                    return
+                self._send(data, "image/jpeg")
+            else:
+                self.send_error(404)
+
+        def _send(self, data: bytes, content_type: str):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(port: int = 0, latency: float = 0.05, host: str = "127.0.0.1"):
+    """Arranca el servidor en un hilo y lo devuelve; server.base_url apunta a él."""
+    base_url_ref = [""]
+    server = ThreadingHTTPServer((host, port), make_handler(make_images(), latency, base_url_ref))
+    server.daemon_threads = True
+    server.base_url = base_url_ref[0] = f"http://{host}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def search_backend(base_url: str):
+    """Función de búsqueda para utils.image_scraper.SEARCH_BACKENDS que consulta este servidor."""
+    def search_local(query: str, session) -> list:
+        response = session.get(f"{base_url}/search", params={"q": query}, timeout=(2, 3))
+        response.raise_for_status()
+        return [item["thumbnail"] for item in response.json().get("results", [])]
+    return search_local
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Buscador de imágenes local para benchmarks")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.05, help="Segundos de espera por petición")
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, args.latency)
+    print(f"Imágenes de benchmark en {server.base_url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Servidor local compatible con la API de chat de OpenAI para benchmarks sin red.
+
+Responde a POST /v1/chat/completions (con y sin stream) con documentos del corpus, con latencia
+hasta el primer token y velocidad de salida configurables. Reconoce los prompts del pipeline:
+documento completo, solo cuerpo (plantilla local), esquema y secciones, y reparación.
+
+Uso:
+    python -m bench.llm_server --port 8765 --ttft 0.5 --tps 400 --doc rich --repeat 3
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+# Caracteres por "token" al trocear la respuesta en streaming
+CHARS_PER_TOKEN = 4
+
+
+def load_corpus(name: str) -> str:
+    with open(os.path.join(CORPUS_DIR, f"{name}.tex"), encoding="utf-8") as f:
+        return f.read()
+
+
+def split_document(document: str) -> tuple:
+    """(inicio hasta la portada incluida, cuerpo) de un documento del corpus."""
+    marker = "\\clearpage"
+    index = document.find(marker)
+    head_end = index + len(marker) if index != -1 else document.find("\\begin{document}") + len("\\begin{document}")
+    body = document[head_end:document.rfind("\\end{document}")]
+    return document[:head_end], body.strip() + "\n"
+
+
+class Responder:
+    """Elige la respuesta según el tipo de prompt. repeat multiplica el cuerpo para simular
+    documentos más largos."""
+
+    def __init__(self, doc: str = "basic", repeat: int = 1):
+        self.head, body = split_document(load_corpus(doc))
+        self.body = "\n".join([body] * max(1, repeat))
+        self.sections = re.split(r"(?=\\section\*)", self.body)
+        self.sections = [s for s in self.sections if s.strip()]
+
+    def reply(self, prompt: str) -> str:
+        if "FRAGMENTO" in prompt:
+            return prompt.split("--- FRAGMENTO ---", 1)[-1].strip()
+        if "esquema" in prompt and "JSON" in prompt:
+            titles = re.findall(r"\\section\*\{([^}]*)\}", self.body)[:8] or ["Introducción", "Desarrollo", "Conclusión"]
+            return json.dumps([{"titulo": t, "puntos": ["Desarrollo del punto"]} for t in titles], ensure_ascii=False)
+        if "ÚNICAMENTE la sección" in prompt:
+            title = re.search(r'ÚNICAMENTE la sección "([^"]*)"', prompt)
+            for section in self.sections:
+                if title and title.group(1) in section:
+                    return section
+            return self.sections[0]
+        if "SOLO el preámbulo" in prompt:
+            return self.head
+        if "SOLO el cuerpo" in prompt:
+            return self.body
+        return self.head + "\n\n" + self.body + "\n\\end{document}\n"
+
+
+def make_handler(responder: Responder, ttft: float, tps: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._json({"object": "list", "data": [{"id": "bench", "object": "model"}]})
+            else:
+                self._json({"status": "ok"})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            messages = request.get("messages", [])
+            prompt = messages[-1]["content"] if messages else ""
+            text = responder.reply(prompt)
+            usage = {
+                "prompt_tokens": sum(len(m.get("content", "")) for m in messages) // CHARS_PER_TOKEN,
+                "completion_tokens": len(text) // CHARS_PER_TOKEN,
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+            time.sleep(ttft)
+            if request.get("stream"):
+                self._stream(text, request.get("model", "bench"), usage)
+            else:
+                time.sleep(usage["completion_tokens"] / tps if tps else 0)
+                self._json({
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "bench"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+        def _json(self, payload: dict):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, text: str, model: str, usage: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            delay = 1 / tps if tps else 0
+
+            def event(delta: dict, finish=None, extra=None):
+                payload = {
+                    "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                }
+                payload.update(extra or {})
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+            try:
+                event({"role": "assistant", "content": ""})
+                for i in range(0, len(text), CHARS_PER_TOKEN):
+                    event({"content": text[i:i + CHARS_PER_TOKEN]})
+                    self.wfile.flush()
+                    if delay:
+                        time.sleep(delay)
+                event({}, finish="stop", extra={"usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # El cliente canceló o abortó el stream
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(port: int = 0, ttft: float = 0.5, tps: float = 400, doc: str = "basic", repeat: int = 1,
+          host: str = "127.0.0.1"):
+    """Arranca el servidor en un hilo y lo devuelve (server.server_port tiene el puerto real)."""
+    server = ThreadingHTTPServer((host, port), make_handler(Responder(doc, repeat), ttft, tps))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LLM local compatible con OpenAI para benchmarks")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=0.5, help="Segundos hasta el primer token")
+    parser.add_argument('--tps', type=float, default=400, help="Tokens por segundo de salida (0 = sin límite)")
+    parser.add_argument('--doc', default="basic", help="Documento del corpus (bench/corpus/<doc>.tex)")
+    parser.add_argument('--repeat', type=int, default=1, help="Repetir el cuerpo N veces (documentos largos)")
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, args.ttft, args.tps, args.doc, args.repeat)
+    print(f"LLM de benchmark en http://127.0.0.1:{server.server_port}/v1", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Benchmark de extremo a extremo del pipeline real, sin red ni APIs de pago.
+
+Arranca el LLM local (bench.llm_server) y el buscador de imágenes local (bench.image_server) y,
+para cada nivel de concurrencia, ejecuta un lote con batch.run_batch en un proceso hijo aparte
+(así el pico de memoria de cada nivel se mide por separado). Informa documentos por minuto,
+p50/p95 por etapa (de core.metrics), TTFT y pico de RSS del proceso y de pdflatex.
+
+Requiere pdflatex (TeX Live) como el uso normal.
+
+Uso:
+    python -m bench.run --concurrency 1,2,4,8 --jobs 8 --ttft 0.5 --tps 400 --doc rich
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+PROVIDER = 'OpenAI / Custom'
+
+TOPICS = [
+    "Fundamentos de redes de computadoras",
+    "Métodos numéricos para ecuaciones diferenciales",
+    "Historia de la computación",
+    "Seguridad informática en la empresa",
+]
+
+# Etapas que se muestran en la tabla (todas van al JSON de resultados)
+REPORT_STAGES = ('provider', 'images', 'image_download', 'sanitize', 'compile_pass', 'repair')
+
+
+def make_roster(jobs: int) -> list:
+    """Filas de roster válidas y distintas (el tema cambia para no repetir búsquedas de imágenes)."""
+    return [
+        {
+            'topic': f"{TOPICS[i % len(TOPICS)]} {i}",
+            'instructions': "Trabajo de benchmark",
+            'subject': "Benchmark",
+            'nombre': f"Estudiante {i}",
+            'ci': f"{10000000 + i}",
+            'turno': 'DCM',
+            'trimester': '01',
+            'section': '01',
+            'eval_num': '1',
+            'corte': '1',
+            'provider': PROVIDER,
+        }
+        for i in range(jobs)
+    ]
+
+
+def peak_rss_mb(who) -> float:
+    # ru_maxrss está en KiB en Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def run_level(args) -> dict:
+    """Proceso hijo: un lote de args.jobs trabajos con args.concurrency workers."""
+    from bench.image_server import search_backend
+    from utils import image_scraper
+    from batch import run_batch
+
+    image_scraper.SEARCH_BACKENDS.clear()
+    image_scraper.SEARCH_BACKENDS['local'] = search_backend(os.environ['BENCH_IMAGE_URL'])
+
+    work_dir = os.environ['BENCH_WORK_DIR']
+    summary = run_batch(
+        make_roster(args.jobs), workers=args.concurrency, provider=PROVIDER, add_images=not args.no_images,
+        output_dir=os.path.join(work_dir, "generated_docs"), image_dir=os.path.join(work_dir, "temp_images"),
+        stream=args.stream, cache_mode='off', sectioned=args.sections,
+    )
+    metrics = summary['metrics']
+    return {
+        'concurrency': args.concurrency,
+        'jobs': summary['total'],
+        'ok': summary['ok'],
+        'failed': summary['failed'],
+        'seconds': summary['seconds'],
+        'docs_per_minute': summary['docs_per_minute'],
+        'job_seconds': metrics['job_seconds'],
+        'ttft_s': metrics['ttft_s'],
+        'stages': metrics['stages'],
+        'tokens': {'prompt': metrics['prompt_tokens'], 'completion': metrics['completion_tokens']},
+        'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF),
+        'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'errors': sorted({job['error'][:200] for job in summary['jobs'] if job.get('error')})[:5],
+    }
+
+
+def child_env(args, llm_url: str, image_url: str, work_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_BASE_URL': llm_url,
+        'OPENAI_MODEL': 'bench',
+        'LLM_CACHE_MODE': 'off',
+        'IMAGE_CACHE': 'off',
+        'IMAGE_LIBRARY': 'off',
+        'STAGE_CACHE': 'off',
+        'ARTIFACT_INDEX': 'off',
+        'METRICS': 'on',
+        'METRICS_DIR': os.path.join(work_dir, "metrics"),
+        'LOCAL_TEMPLATE': args.template,
+        'BENCH_IMAGE_URL': image_url,
+        'BENCH_WORK_DIR': work_dir,
+        'PYTHONPATH': ROOT + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    if args.no_format_cache:
+        env['LATEX_FORMAT_CACHE'] = 'off'
+    return env
+
+
+def fmt(value, digits=2) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_results(results: list):
+    header = f"{'conc':>4} {'ok/n':>7} {'docs/min':>9} {'job p50':>8} {'job p95':>8} {'ttft p50':>9} {'RSS MB':>7} {'TeX MB':>7}"
+    print(header)
+    for r in results:
+        print(f"{r['concurrency']:>4} {r['ok']:>3}/{r['jobs']:<3} {r['docs_per_minute']:>9.2f} "
+              f"{fmt(r['job_seconds']['p50']):>8} {fmt(r['job_seconds']['p95']):>8} "
+              f"{fmt(r['ttft_s']['p50'], 3):>9} {r['peak_rss_mb']:>7.1f} {r['peak_child_rss_mb']:>7.1f}")
+
+    print(f"\n{'etapa':<16}" + "".join(f"{'c=' + str(r['concurrency']) + ' p50/p95':>20}" for r in results))
+    for stage in REPORT_STAGES:
+        if not any(stage in r['stages'] for r in results):
+            continue
+        cells = []
+        for r in results:
+            s = r['stages'].get(stage)
+            cells.append(f"{fmt(s['p50'], 3) + ' / ' + fmt(s['p95'], 3) if s else '-':>20}")
+        print(f"{stage:<16}" + "".join(cells))
+
+    for r in results:
+        for error in r['errors']:
+            print(f"[c={r['concurrency']}] error: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline con LLM e imágenes locales")
+    parser.add_argument('--concurrency', default="1,2,4", help="Niveles de concurrencia separados por comas")
+    parser.add_argument('--jobs', type=int, default=8, help="Trabajos por nivel")
+    parser.add_argument('--ttft', type=float, default=0.5, help="Latencia hasta el primer token del LLM local")
+    parser.add_argument('--tps', type=float, default=400, help="Tokens por segundo del LLM local")
+    parser.add_argument('--doc', default="basic", help="Documento del corpus que devuelve el LLM")
+    parser.add_argument('--repeat', type=int, default=1, help="Repetir el cuerpo del documento N veces")
+    parser.add_argument('--image-latency', type=float, default=0.05)
+    parser.add_argument('--no-images', action='store_true')
+    parser.add_argument('--stream', action='store_true', default=None)
+    parser.add_argument('--sections', action='store_true')
+    parser.add_argument('--template', choices=('on', 'off'), default='on', help="LOCAL_TEMPLATE de los trabajos")
+    parser.add_argument('--no-format-cache', action='store_true', help="Compilar sin preámbulo precompilado")
+    parser.add_argument('--output', help="JSON de resultados (por defecto bench/results/bench_<fecha>.json)")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        args.concurrency = int(args.concurrency)
+        print(json.dumps(run_level(args)))
+        return 0
+
+    from bench import llm_server, image_server
+    llm = llm_server.serve(ttft=args.ttft, tps=args.tps, doc=args.doc, repeat=args.repeat)
+    images = image_server.serve(latency=args.image_latency)
+    llm_url = f"http://127.0.0.1:{llm.server_port}/v1"
+    print(f"LLM local: {llm_url}  Imágenes: {images.base_url}", flush=True)
+
+    worker_args = ["--jobs", str(args.jobs)]
+    worker_args += [flag for flag, on in (("--no-images", args.no_images), ("--stream", args.stream),
+                                          ("--sections", args.sections)) if on]
+
+    results = []
+    started = time.strftime('%Y%m%d%H%M%S')
+    for level in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+        with tempfile.TemporaryDirectory(prefix=f"bench_c{level}_") as work_dir:
+            print(f"Nivel de concurrencia {level}: {args.jobs} trabajos...", flush=True)
+            process = subprocess.run(
+                [sys.executable, "-m", "bench.run", "--worker", "--concurrency", str(level)] + worker_args,
+                cwd=ROOT, env=child_env(args, llm_url, images.base_url, work_dir),
+                stdout=subprocess.PIPE, text=True,
+            )
+            if process.returncode != 0 or not process.stdout.strip():
+                print(f"El nivel {level} falló (código {process.returncode})", file=sys.stderr)
+                continue
+            results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    llm.shutdown()
+    images.shutdown()
+    if not results:
+        return 1
+
+    print()
+    print_results(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{started}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'config': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados: {output}")
+    return 0 if all(r['failed'] == 0 for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# Carga única de la configuración (.env) para todo el proceso
+import os
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_settings():
+    """Lee el .env una sola vez por proceso; las llamadas siguientes no hacen nada.
+
+    La llaman los puntos de entrada (main.py, batch.py) antes de importar el resto y los módulos
+    que leen variables al importarse, para que el orden de importación no importe. Las variables
+    ya definidas en el entorno tienen prioridad sobre el .env."""
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if _loaded:
+            return
+        from dotenv import load_dotenv
+        load_dotenv()
+        _loaded = True
+
+
+def env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ('true', '1', 't', 'yes')
@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+INDEX_FILE = "artifacts.sqlite"
+
+# Subproductos de pdflatex que no hacen falta una vez compilado el PDF
+AUX_EXTENSIONS = ('.aux', '.log', '.out', '.toc', '.lof', '.lot', '.fls', '.fdb_latexmk', '.synctex.gz', '.nav', '.snm')
+
+# Cuerpos compartidos del modo fan-out (core.fanout): no tienen registro propio en el índice
+BODY_PREFIX = "body-"
+
+# Como mucho una limpieza automática por retención al día
+PRUNE_INTERVAL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT,
+    created REAL NOT NULL,
+    nombre TEXT,
+    ci TEXT,
+    section TEXT,
+    subject TEXT,
+    eval_num TEXT,
+    corte TEXT,
+    topic TEXT,
+    provider TEXT,
+    content_sha256 TEXT,
+    tex_path TEXT,
+    pdf_path TEXT,
+    pdf_sha256 TEXT,
+    pdf_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_student ON jobs(ci, section, eval_num, corte, created);
+CREATE INDEX IF NOT EXISTS jobs_topic ON jobs(topic, created);
+CREATE INDEX IF NOT EXISTS jobs_content ON jobs(content_sha256);
+CREATE INDEX IF NOT EXISTS jobs_pdf_sha ON jobs(pdf_sha256);
+CREATE INDEX IF NOT EXISTS jobs_pdf_path ON jobs(pdf_path);
+CREATE INDEX IF NOT EXISTS jobs_tex_path ON jobs(tex_path);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs(created);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+COLUMNS = ('id', 'job_id', 'created', 'nombre', 'ci', 'section', 'subject', 'eval_num', 'corte', 'topic',
+           'provider', 'content_sha256', 'tex_path', 'pdf_path', 'pdf_sha256', 'pdf_bytes')
+
+
+def artifacts_enabled() -> bool:
+    return os.getenv("ARTIFACT_INDEX", "on").lower() not in ("off", "false", "0", "no")
+
+
+def retention_days() -> float:
+    """Días que se conservan los documentos (0 = para siempre)."""
+    return float(os.getenv("ARTIFACT_RETENTION_DAYS", "0"))
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remove_aux_files(tex_path: str) -> int:
+    """Borra los subproductos de pdflatex de tex_path (.aux, .log...) y devuelve cuántos borró."""
+    stem = os.path.splitext(tex_path)[0]
+    removed = 0
+    for extension in AUX_EXTENSIONS:
+        try:
+            os.remove(stem + extension)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.debug(f"No se pudo borrar {stem + extension}: {e}")
+    return removed
+
+
+def _link_or_copy(source: str, target: str):
+    """Deja en target el contenido de source: enlace duro si se puede (mismo sistema de
+    archivos), copia si no. Reemplaza target de forma atómica."""
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class ArtifactStore:
+    """Índice SQLite de los documentos generados en output_dir (<output_dir>/artifacts.sqlite).
+
+    Cada trabajo terminado guarda estudiante, sección, evaluación, tema, proveedor y el hash del
+    LaTeX generado, con índices B-tree para las búsquedas (por estudiante, tema, hash, fecha), así
+    que encontrar o reutilizar un documento no depende del tamaño de la carpeta. Los PDF idénticos
+    se comparten con enlaces duros y los subproductos de pdflatex se borran al registrar."""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.path = os.path.join(output_dir, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params).fetchall()]
+
+    def record(self, student_data: dict, topic: str, provider: str, content_sha256: str, tex_path: str,
+               pdf_path: str, job_id: str = None) -> dict:
+        """Registra un trabajo terminado, comparte con un enlace duro el PDF si ya había otro
+        idéntico y borra los subproductos de pdflatex. El .tex no se comparte: la reparación lo
+        reescribe en su sitio y modificaría también el de otro registro. content_sha256 es el hash
+        del LaTeX generado antes de compilar (la clave de find_content), no del .tex reparado."""
+        remove_aux_files(tex_path)
+        pdf_sha256 = sha256_file(pdf_path)
+        self._dedup('pdf_sha256', pdf_sha256, 'pdf_path', pdf_path)
+
+        row = {
+            'job_id': job_id,
+            'created': time.time(),
+            'nombre': student_data.get('nombre'),
+            'ci': student_data.get('ci'),
+            'section': student_data.get('seccion'),
+            'subject': student_data.get('materia'),
+            'eval_num': student_data.get('eval_num'),
+            'corte': student_data.get('corte'),
+            'topic': topic,
+            'provider': provider,
+            'content_sha256': content_sha256,
+            'tex_path': os.path.abspath(tex_path),
+            'pdf_path': os.path.abspath(pdf_path),
+            'pdf_sha256': pdf_sha256,
+            'pdf_bytes': os.path.getsize(pdf_path),
+        }
+        names = ", ".join(row)
+        with self._lock, self._db:
+            cursor = self._db.execute(f"INSERT INTO jobs ({names}) VALUES ({', '.join('?' * len(row))})",
+                                      tuple(row.values()))
+        row['id'] = cursor.lastrowid
+        return row
+
+    def _dedup(self, hash_column: str, digest: str, path_column: str, path: str):
+        """Si otro registro tiene el mismo hash y su archivo sigue existiendo, path pasa a ser un
+        enlace duro a ese archivo."""
+        for other in self._query(
+            f"SELECT {path_column} AS path FROM jobs WHERE {hash_column} = ? ORDER BY created DESC LIMIT 3", (digest,)
+        ):
+            other_path = other['path']
+            if not other_path or not os.path.exists(other_path):
+                continue
+            try:
+                if os.path.samefile(other_path, path):
+                    return
+                _link_or_copy(other_path, path)
+                return
+            except OSError as e:
+                logging.debug(f"No se pudo deduplicar {path}: {e}")
+
+    def find_content(self, content_sha256: str):
+        """Último registro con ese LaTeX cuyo PDF sigue en disco, o None."""
+        for row in self._query(
+            "SELECT * FROM jobs WHERE content_sha256 = ? ORDER BY created DESC LIMIT 5", (content_sha256,)
+        ):
+            if row['pdf_path'] and os.path.exists(row['pdf_path']) and sha256_file(row['pdf_path']) == row['pdf_sha256']:
+                return row
+        return None
+
+    def reuse_pdf(self, row: dict, target: str) -> str:
+        """Deja en target el PDF del registro row (sin volver a compilar)."""
+        if not (os.path.exists(target) and os.path.samefile(row['pdf_path'], target)):
+            _link_or_copy(row['pdf_path'], target)
+        return target
+
+    def find(self, ci: str = None, section: str = None, eval_num: str = None, corte: str = None,
+             topic: str = None, nombre: str = None, limit: int = 20) -> list:
+        """Registros más recientes que coinciden con los filtros dados (todos opcionales)."""
+        filters, params = [], []
+        for column, value in (('ci', ci), ('section', section), ('eval_num', eval_num), ('corte', corte),
+                              ('topic', topic)):
+            if value:
+                filters.append(f"{column} = ?")
+                params.append(value)
+        if nombre:
+            filters.append("nombre LIKE ?")
+            params.append(f"%{nombre}%")
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        return self._query(f"SELECT * FROM jobs {where} ORDER BY created DESC LIMIT ?", (*params, limit))
+
+    def latest(self, student_data: dict, topic: str):
+        """Último documento del mismo estudiante, sección, evaluación y tema cuyo PDF existe."""
+        rows = self.find(student_data.get('ci'), student_data.get('seccion'), student_data.get('eval_num'),
+                         student_data.get('corte'), topic, limit=5)
+        return next((row for row in rows if row['pdf_path'] and os.path.exists(row['pdf_path'])), None)
+
+    def prune(self, days: float = None, keep_latest: bool = True) -> dict:
+        """Borra registros (y sus archivos) de hace más de days días, subproductos viejos y los
+        cuerpos del fan-out sin usar desde entonces.
+
+        Con keep_latest se conserva siempre el último documento de cada estudiante/evaluación. Un
+        archivo solo se borra si ningún registro que se conserva apunta a él."""
+        days = retention_days() if days is None else days
+        removed = {'jobs': 0, 'files': 0, 'aux': 0, 'bytes': 0}
+        if days > 0:
+            cutoff = time.time() - days * 86400
+            sql = "SELECT * FROM jobs WHERE created < ?"
+            if keep_latest:
+                sql += (" AND id NOT IN (SELECT id FROM jobs AS j WHERE created = (SELECT MAX(created) FROM jobs"
+                        " WHERE ci IS j.ci AND section IS j.section AND eval_num IS j.eval_num AND corte IS j.corte))")
+            for row in self._query(sql, (cutoff,)):
+                with self._lock, self._db:
+                    self._db.execute("DELETE FROM jobs WHERE id = ?", (row['id'],))
+                removed['jobs'] += 1
+                for column in ('tex_path', 'pdf_path'):
+                    path = row[column]
+                    if not path or self._query(f"SELECT 1 FROM jobs WHERE {column} = ? LIMIT 1", (path,)):
+                        continue
+                    try:
+                        size = os.path.getsize(path)
+                        os.remove(path)
+                        removed['files'] += 1
+                        removed['bytes'] += size
+                    except FileNotFoundError:
+                        pass
+
+            # Subproductos de compilaciones fallidas o interrumpidas (no llegaron al índice) y cuerpos
+            # del fan-out que no se han vuelto a usar (compile_body actualiza su fecha al reutilizarlos)
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.stat().st_mtime >= cutoff:
+                        continue
+                    if entry.name.endswith(AUX_EXTENSIONS):
+                        os.remove(entry.path)
+                        removed['aux'] += 1
+                    elif entry.name.startswith(BODY_PREFIX) and entry.name.endswith(('.tex', '.pdf')):
+                        size = entry.stat().st_size
+                        os.remove(entry.path)
+                        removed['files'] += 1
+                        removed['bytes'] += size
+
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_prune', ?)", (str(time.time()),))
+        if removed['jobs'] or removed['files'] or removed['aux']:
+            logging.info(f"Retención: {removed['jobs']} trabajos, {removed['files']} archivos y "
+                         f"{removed['aux']} subproductos borrados ({removed['bytes'] / 1e6:.1f} MB)")
+        return removed
+
+    def maybe_prune(self):
+        """prune si hay retención configurada y no se hizo en las últimas PRUNE_INTERVAL s."""
+        if retention_days() <= 0:
+            return
+        last = self._query("SELECT value FROM meta WHERE key = 'last_prune'")
+        if last and time.time() - float(last[0]['value']) < PRUNE_INTERVAL:
+            return
+        try:
+            self.prune()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"La limpieza por retención falló: {e}")
+
+    def stats(self) -> dict:
+        row = self._query("SELECT COUNT(*) AS jobs, COUNT(DISTINCT ci) AS students, COUNT(DISTINCT pdf_sha256) AS pdfs,"
+                          " COALESCE(SUM(pdf_bytes), 0) AS pdf_bytes FROM jobs")[0]
+        return row
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(output_dir: str) -> ArtifactStore:
+    """Índice compartido de output_dir (uno por carpeta y proceso)."""
+    key = os.path.abspath(output_dir)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = ArtifactStore(output_dir)
+        return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consulta y mantenimiento del índice de documentos generados")
+    parser.add_argument('--output-dir', default="generated_docs")
+    commands = parser.add_subparsers(dest='command', required=True)
+    find = commands.add_parser('find', help="Buscar documentos")
+    find.add_argument('--ci')
+    find.add_argument('--section')
+    find.add_argument('--eval-num')
+    find.add_argument('--corte')
+    find.add_argument('--topic')
+    find.add_argument('--nombre', help="Coincidencia parcial")
+    find.add_argument('--limit', type=int, default=20)
+    prune = commands.add_parser('prune', help="Aplicar la retención")
+    prune.add_argument('--days', type=float, help="Por defecto ARTIFACT_RETENTION_DAYS")
+    prune.add_argument('--all', action='store_true', help="No conservar el último documento de cada estudiante")
+    commands.add_parser('stats', help="Resumen del índice")
+    args = parser.parse_args(argv)
+
+    store = get_store(args.output_dir)
+    if args.command == 'find':
+        for row in store.find(args.ci, args.section, args.eval_num, args.corte, args.topic, args.nombre, args.limit):
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['created']))
+            print(f"{created}  {row['ci'] or '':<12} {row['section'] or '':<8} Ev.{row['eval_num']} C.{row['corte']}  "
+                  f"{row['topic']}\n    {row['pdf_path']}")
+    elif args.command == 'prune':
+        print(store.prune(args.days, keep_latest=not args.all))
+    else:
+        print(store.stats())
+
+
+if __name__ == '__main__':
+    main()
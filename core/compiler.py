@@ -0,0 +1,434 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+FORMAT_DIR = os.path.join(".cache", "fmt")
+MAX_PASSES = 3
+
+# Segundos máximos de cada pasada de pdflatex antes de matarlo
+COMPILE_TIMEOUT = float(os.getenv("COMPILE_TIMEOUT", "120"))
+
+# Recompresión opcional del PDF final con Ghostscript (PDF_COMPRESS) y su ajuste de pdfwrite
+PDF_COMPRESS_PRESET = os.getenv("PDF_COMPRESS_PRESET", "/ebook")
+GHOSTSCRIPT_NAMES = ("gs", "gswin64c", "gswin32c")
+
+# Rutas relativas que lee el documento: imágenes y carpetas de \graphicspath
+GRAPHICS_RE = re.compile(r"\\include(?:graphics|pdf)\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}")
+GRAPHICSPATH_RE = re.compile(r"\\graphicspath\s*\{((?:\s*\{[^}]*\})+)\s*\}")
+
+# Mensajes del .log que indican que otra pasada cambiaría el resultado
+RERUN_PATTERNS = re.compile(
+    r"Rerun to get (cross-references|outlines|citations) right"
+    r"|Label\(s\) may have changed\. Rerun"
+    r"|Please rerun LaTeX"
+    r"|\(rerunfilecheck\).*Rerun"
+    r"|Rerun LaTeX"
+)
+
+_compile_slots = None
+_compile_slots_guard = threading.Lock()
+_format_locks = {}
+_format_locks_guard = threading.Lock()
+_engine_version = None
+_format_supported = None
+
+
+class CompilationError(Exception):
+    """Error de pdflatex al compilar el documento generado. log contiene el .log completo."""
+
+    def __init__(self, message: str, log: str = ""):
+        super().__init__(message)
+        self.log = log
+
+
+def split_preamble(content: str):
+    """Separa el documento en (preámbulo, resto) por el primer \\begin{document}."""
+    index = content.find("\\begin{document}")
+    if index == -1:
+        return None, content
+    return content[:index], content[index:]
+
+
+def engine_version() -> str:
+    """Primera línea de `pdflatex --version` (los .fmt solo valen para la misma versión)."""
+    global _engine_version
+    if _engine_version is None:
+        try:
+            output = subprocess.run(["pdflatex", "--version"], capture_output=True, text=True, timeout=10).stdout
+            _engine_version = output.splitlines()[0] if output else ""
+        except (OSError, subprocess.SubprocessError):
+            _engine_version = ""
+    return _engine_version
+
+
+def format_supported() -> bool:
+    """True si pdflatex y mylatexformat.ltx están disponibles para precompilar preámbulos."""
+    global _format_supported
+    if _format_supported is None:
+        try:
+            found = subprocess.run(["kpsewhich", "mylatexformat.ltx"], capture_output=True, text=True, timeout=10)
+            _format_supported = bool(found.stdout.strip())
+        except (OSError, subprocess.SubprocessError):
+            _format_supported = False
+        if not _format_supported:
+            logging.info("mylatexformat no disponible: se compila sin formato precompilado")
+    return _format_supported
+
+
+def preamble_hash(preamble: str) -> str:
+    normalized = "\n".join(line.rstrip() for line in preamble.strip().splitlines())
+    return hashlib.sha256((engine_version() + "\n" + normalized).encode("utf-8")).hexdigest()[:20]
+
+
+def _format_lock(key: str) -> threading.Lock:
+    with _format_locks_guard:
+        return _format_locks.setdefault(key, threading.Lock())
+
+
+def ensure_format(preamble: str, cwd: str, format_dir: str = FORMAT_DIR):
+    """Devuelve el nombre del formato precompilado para preamble, construyéndolo si no existe.
+
+    Usa mylatexformat para volcar el preámbulo en <hash>.fmt. Si el preámbulo no se puede volcar,
+    se recuerda con <hash>.fail y se devuelve None (compilación en frío)."""
+    key = preamble_hash(preamble)
+    format_dir = os.path.abspath(format_dir)
+    fmt_path = os.path.join(format_dir, f"{key}.fmt")
+    fail_path = os.path.join(format_dir, f"{key}.fail")
+
+    with _format_lock(key):
+        if os.path.exists(fmt_path):
+            return key
+        if os.path.exists(fail_path):
+            return None
+
+        os.makedirs(format_dir, exist_ok=True)
+        build_name = f"{key}_build{threading.get_ident()}"
+        source = os.path.join(format_dir, f"{build_name}.tex")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write(preamble)
+            f.write("\\begin{document}\n\\end{document}\n")
+
+        start = time.perf_counter()
+        # Las rutas relativas del preámbulo (logo, imágenes) se resuelven desde cwd, como el documento
+        command = [
+            "pdflatex", "-ini", "-interaction=nonstopmode", "-halt-on-error",
+            f"-jobname={build_name}", f"-output-directory={format_dir}",
+            "&pdflatex", "mylatexformat.ltx", os.path.relpath(source, cwd).replace(os.sep, "/"),
+        ]
+        try:
+            process = subprocess.run(command, cwd=cwd, capture_output=True, timeout=120)
+            built = os.path.join(format_dir, f"{build_name}.fmt")
+            if process.returncode == 0 and os.path.exists(built):
+                os.replace(built, fmt_path)
+                logging.info(f"Formato LaTeX {key} precompilado en {time.perf_counter() - start:.2f} s")
+                return key
+            logging.warning(f"No se pudo precompilar el preámbulo {key}; se compila en frío")
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.warning(f"No se pudo precompilar el preámbulo {key}: {e}")
+        finally:
+            for ext in (".tex", ".log", ".fmt"):
+                path = os.path.join(format_dir, build_name + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+
+        open(fail_path, "w").close()
+        return None
+
+
+def needs_rerun(log_text: str) -> bool:
+    """True si el .log pide otra pasada (referencias, etiquetas, índices de hyperref...)."""
+    return bool(RERUN_PATTERNS.search(log_text))
+
+
+def read_log(log_path: str) -> str:
+    try:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def summarize_errors(log_text: str, fallback: str = "") -> str:
+    """Primer error de LaTeX del .log ('! ...' y la línea 'l.N' que lo acompaña)."""
+    lines = log_text.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith("!") or re.match(r"^\S+:\d+: ", line):
+            context = [line]
+            for extra in lines[i + 1:i + 8]:
+                context.append(extra)
+                if re.match(r"^l\.\d+", extra):
+                    break
+            return "\n".join(context).strip()
+    return fallback[-300:]
+
+
+def compile_workers() -> int:
+    """pdflatex simultáneos en el proceso: COMPILE_WORKERS o, si no se indica, los núcleos."""
+    return int(os.getenv("COMPILE_WORKERS", "0")) or os.cpu_count() or 2
+
+
+@contextmanager
+def compile_slot(cancel_token=None, poll_interval: float = 0.1):
+    """Ocupa uno de los compile_workers() huecos de compilación del proceso mientras dura el bloque.
+
+    La GUI, los lotes y el servidor comparten el límite, así que muchos trabajos a la vez no lanzan
+    más pdflatex que núcleos; la espera se puede cancelar con cancel_token."""
+    global _compile_slots
+    with _compile_slots_guard:
+        if _compile_slots is None:
+            _compile_slots = threading.BoundedSemaphore(compile_workers())
+    while not _compile_slots.acquire(timeout=poll_interval):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+    try:
+        yield
+    finally:
+        _compile_slots.release()
+
+
+def build_root():
+    """Carpeta donde se crean las carpetas de compilación: COMPILE_BUILD_DIR, /dev/shm (tmpfs) si
+    COMPILE_TMPFS está activo y existe, o el temporal del sistema (None)."""
+    custom = os.getenv("COMPILE_BUILD_DIR")
+    if custom:
+        os.makedirs(custom, exist_ok=True)
+        return custom
+    tmpfs = os.getenv("COMPILE_TMPFS", "on").lower() not in ("off", "false", "0", "no")
+    if tmpfs and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+def relative_assets(content: str) -> list:
+    """Rutas relativas de \\includegraphics, \\includepdf y \\graphicspath que el documento lee al compilar."""
+    paths = [path.strip() for path in GRAPHICS_RE.findall(content)]
+    for group in GRAPHICSPATH_RE.findall(content):
+        paths += [path.strip() for path in re.findall(r"\{([^}]*)\}", group)]
+    return [path for path in paths if path and not os.path.isabs(path)]
+
+
+def _parent_levels(path: str) -> int:
+    parts = os.path.normpath(path).split(os.sep)
+    return next((i for i, part in enumerate(parts) if part != os.pardir), len(parts))
+
+
+def _link(source: str, target: str):
+    """Enlaza source en target (copia si el sistema no permite enlaces simbólicos, p. ej. Windows)."""
+    if os.path.lexists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.symlink(source, target, target_is_directory=os.path.isdir(source))
+    except OSError:
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy2(source, target)
+
+
+def prepare_build_dir(filepath: str, content: str) -> tuple:
+    """Crea una carpeta de compilación aislada para filepath y devuelve (raíz, carpeta de trabajo).
+
+    La carpeta de trabajo está a la misma profundidad dentro de la raíz que el .tex respecto a sus
+    recursos, así que rutas como ../logos/UAH.png o ../temp_images/img.jpg siguen valiendo: cada
+    recurso se enlaza en su sitio. Así los trabajos en paralelo no comparten .aux ni .log."""
+    source_dir = os.path.abspath(os.path.dirname(filepath) or ".")
+    assets = relative_assets(content)
+    levels = max((_parent_levels(path) for path in assets), default=0)
+    root = tempfile.mkdtemp(prefix="build_", dir=build_root())
+    work = os.path.join(root, *(["_"] * levels))
+    os.makedirs(work, exist_ok=True)
+    for asset in assets:
+        source = os.path.normpath(os.path.join(source_dir, asset))
+        target = os.path.normpath(os.path.join(work, asset))
+        if os.path.exists(source):
+            _link(source, target)
+            continue
+        # \\includegraphics sin extensión: enlazar las variantes que haya
+        for match in glob.glob(glob.escape(source) + ".*"):
+            _link(match, target + match[len(source):])
+    with open(os.path.join(work, os.path.basename(filepath)), "w", encoding="utf-8") as f:
+        f.write(content)
+    return root, work
+
+
+def move_into_place(source: str, target: str):
+    """Mueve source a target de forma atómica, también entre sistemas de archivos (tmpfs -> disco):
+    quien lea target ve el archivo anterior o el nuevo completo, nunca uno a medias."""
+    partial = f"{target}.part"
+    shutil.move(source, partial)
+    os.replace(partial, target)
+
+
+def pdf_compress_enabled() -> bool:
+    return os.getenv("PDF_COMPRESS", "off").lower() not in ("off", "false", "0", "no")
+
+
+def compress_pdf(pdf_path: str, cancel_token=None) -> int:
+    """Reescribe pdf_path con Ghostscript (pdfwrite con PDF_COMPRESS_PRESET, imágenes duplicadas
+    una sola vez) y se queda con el resultado solo si es más pequeño. Devuelve los bytes ahorrados;
+    0 si Ghostscript no está instalado, falla o no mejora (el PDF original sigue siendo válido)."""
+    ghostscript = next((path for path in map(shutil.which, GHOSTSCRIPT_NAMES) if path), None)
+    if ghostscript is None:
+        logging.debug("Ghostscript no está instalado: el PDF no se recomprime")
+        return 0
+    output = f"{os.path.splitext(pdf_path)[0]}_gs.pdf"
+    command = [
+        ghostscript, "-q", "-dNOPAUSE", "-dBATCH", "-dSAFER", "-sDEVICE=pdfwrite",
+        "-dCompatibilityLevel=1.5", f"-dPDFSETTINGS={PDF_COMPRESS_PRESET}", "-dDetectDuplicateImages=true",
+        f"-sOutputFile={output}", pdf_path,
+    ]
+    try:
+        returncode, stdout = _run_pass(command, os.path.dirname(pdf_path) or ".", None, cancel_token)
+        if returncode != 0 or not os.path.exists(output):
+            logging.warning(f"Ghostscript no pudo recomprimir el PDF: {stdout[-300:]}")
+            return 0
+        saved = os.path.getsize(pdf_path) - os.path.getsize(output)
+        if saved <= 0:
+            return 0
+        os.replace(output, pdf_path)
+        return saved
+    except (OSError, CompilationError) as e:
+        logging.warning(f"No se pudo recomprimir el PDF: {e}")
+        return 0
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+
+
+def _run_pass(command, cwd, env, cancel_token, timeout: float = None):
+    timeout = COMPILE_TIMEOUT if timeout is None else timeout
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if cancel_token is not None:
+        cancel_token.register(process.kill)
+    try:
+        stdout, _ = process.communicate(timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        stdout, _ = process.communicate()
+        output = stdout.decode("utf-8", errors="replace")
+        raise CompilationError(f"pdflatex no terminó en {timeout:.0f} s y se detuvo", output)
+    finally:
+        if cancel_token is not None:
+            cancel_token.unregister(process.kill)
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    return process.returncode, stdout.decode("utf-8", errors="replace")
+
+
+def compile_latex(filepath: str, cancel_token=None, use_format: bool = None, max_passes: int = MAX_PASSES,
+                  metrics=None) -> dict:
+    """Compila filepath con pdflatex y devuelve un dict con 'pdf' (junto al .tex), 'passes', 'format'
+    y 'seconds'.
+
+    Cada compilación ocupa un hueco de compile_slot y corre en su propia carpeta (prepare_build_dir,
+    en tmpfs si se puede), con un límite de COMPILE_TIMEOUT s por pasada; el PDF se mueve junto al
+    .tex de forma atómica y la carpeta se borra. Si falla, el .log se deja junto al .tex. Con
+    PDF_COMPRESS, antes de moverlo el PDF se recomprime con Ghostscript (compress_pdf).
+
+    Si use_format (por defecto LATEX_FORMAT_CACHE), el preámbulo se precompila una vez por hash y
+    los documentos con el mismo preámbulo arrancan desde ese .fmt. Solo se repite la pasada cuando
+    el .log lo pide, hasta max_passes. Con metrics (core.metrics.JobMetrics) se registran la etapa
+    'format' y cada 'compile_pass', y 'compile_wait' si hubo que esperar un hueco."""
+    source_dir = os.path.dirname(filepath) or "."
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    with open(filepath, encoding="utf-8") as f:
+        content = f.read()
+
+    wait_start = time.perf_counter()
+    with compile_slot(cancel_token):
+        waited = time.perf_counter() - wait_start
+        if metrics is not None and waited >= 0.01:
+            metrics.add('compile_wait', waited)
+        root, work = prepare_build_dir(filepath, content)
+        try:
+            result = _compile(os.path.join(work, os.path.basename(filepath)), content, cancel_token,
+                              use_format, max_passes, metrics)
+            if pdf_compress_enabled():
+                compress_start = time.perf_counter()
+                saved = compress_pdf(result['pdf'], cancel_token)
+                if metrics is not None:
+                    metrics.add('pdf_compress', time.perf_counter() - compress_start, saved_bytes=saved)
+            target = os.path.join(source_dir, f"{stem}.pdf")
+            move_into_place(result['pdf'], target)
+            result['pdf'] = target
+            return result
+        except CompilationError:
+            log_path = os.path.join(work, f"{stem}.log")
+            if os.path.exists(log_path):
+                shutil.copyfile(log_path, os.path.join(source_dir, f"{stem}.log"))
+            raise
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def _compile(filepath: str, content: str, cancel_token, use_format: bool, max_passes: int, metrics) -> dict:
+    if use_format is None:
+        use_format = os.getenv("LATEX_FORMAT_CACHE", "on").lower() not in ("off", "false", "0", "no")
+
+    start = time.perf_counter()
+    cwd = os.path.dirname(filepath) or "."
+    basename = os.path.basename(filepath)
+    stem = os.path.splitext(basename)[0]
+    log_path = os.path.join(cwd, f"{stem}.log")
+    env = dict(os.environ)
+
+    command = ["pdflatex", "-interaction=nonstopmode", "-halt-on-error", "-file-line-error"]
+    format_key = None
+    if use_format and format_supported():
+        format_start = time.perf_counter()
+        preamble, _ = split_preamble(content)
+        if preamble is not None:
+            format_key = ensure_format(preamble, cwd)
+        if metrics is not None:
+            metrics.add('format', time.perf_counter() - format_start, hit=format_key is not None)
+    if format_key:
+        # TEXFORMATS con ':' final conserva las rutas por defecto de kpathsea
+        env["TEXFORMATS"] = os.path.abspath(FORMAT_DIR) + os.pathsep + env.get("TEXFORMATS", "")
+        command.append(f"-fmt={format_key}")
+    command.append(basename)
+
+    passes = 0
+    while True:
+        passes += 1
+        logging.info(f"Ejecutando comando LaTeX (pasada {passes}): {' '.join(command)}")
+        pass_start = time.perf_counter()
+        returncode, output = _run_pass(command, cwd, env, cancel_token)
+        if metrics is not None:
+            metrics.add('compile_pass', time.perf_counter() - pass_start, ok=returncode == 0,
+                        format=format_key is not None)
+        log_text = read_log(log_path)
+
+        if returncode != 0:
+            if format_key and passes == 1 and "format file" in output.lower():
+                # Formato corrupto o de otra versión: descartarlo y compilar en frío
+                logging.warning(f"Formato {format_key} inválido, compilando sin él")
+                os.remove(os.path.join(FORMAT_DIR, f"{format_key}.fmt"))
+                command.remove(f"-fmt={format_key}")
+                format_key = None
+                passes = 0
+                continue
+            logging.error(f"Salida de LaTeX: {output}")
+            raise CompilationError(f"Error LaTeX: {summarize_errors(log_text, output)}", log_text or output)
+
+        if passes >= max_passes or not needs_rerun(log_text):
+            break
+        logging.info("El .log pide otra pasada de LaTeX")
+
+    seconds = time.perf_counter() - start
+    logging.info(f"PDF compilado en {passes} pasada(s), {seconds:.2f} s" + (f" con formato {format_key}" if format_key else ""))
+    return {
+        'pdf': os.path.join(cwd, f"{stem}.pdf"),
+        'passes': passes,
+        'format': format_key,
+        'seconds': round(seconds, 3),
+    }
@@ -0,0 +1,288 @@
+"""Modo fan-out: un solo cuerpo por tema para toda una sección.
+
+Los estudiantes de una misma sección (build_section_code) que entregan la misma evaluación sobre el
+mismo tema comparten el cuerpo del documento: se pide al proveedor, se corrige y se compila una vez
+por grupo, y a cada estudiante solo se le compone su portada (con sus datos y metadatos), que incluye
+las páginas ya compiladas del cuerpo con pdfpages. Con FANOUT_VARIANTS se piden además hasta N
+reescrituras del cuerpo, repartidas por turnos entre los estudiantes del grupo. Así las llamadas al
+proveedor y las compilaciones completas crecen con el número de temas, no con el de estudiantes.
+
+Necesita la plantilla local (LOCAL_TEMPLATE): si el modelo escribe también la portada no hay cuerpo
+común. Sin pdfpages instalado, el cuerpo se sigue generando una vez pero cada estudiante se compila
+completo.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from api.failover import get_job_provider
+from api.ratelimit import get_rate_limiter
+from api.streaming import StreamStats
+from core.artifacts import BODY_PREFIX, artifacts_enabled, get_store, sha256_text
+from core.compiler import split_preamble
+from core.metrics import JobMetrics, metrics_enabled
+from core.pipeline import (OUTPUT_DIR, IMAGE_DIR, generate_latex, fetch_images, sanitize_content, inject_images,
+                           write_tex, compile_pdf, build_tex_path, build_pdf_name, rename_pdf, index_job,
+                           provider_options, provider_inputs, provider_reuse)
+from core.sections import SECTION_WORKERS
+from core.stages import get_stage_store
+from utils import build_student_data, build_section_code
+from utils.latex_lint import missing_packages
+from utils.latex_template import render_body_document, render_cover, render_cover_document
+
+# Reescrituras del cuerpo por grupo (llamadas extra al proveedor); 0 = todos comparten el mismo texto
+FANOUT_VARIANTS = int(os.getenv("FANOUT_VARIANTS", "0"))
+
+_body_locks = {}
+_body_locks_guard = threading.Lock()
+
+
+def group_key(values) -> tuple:
+    """Filas con la misma clave comparten cuerpo: sección, materia, evaluación, tema, instrucciones,
+    proveedor y opciones que cambian el contenido."""
+    return (
+        build_section_code(values),
+        values['-SUBJECT-'].strip().lower(),
+        values['-EVAL_NUM-'],
+        values['-CORTE-'],
+        " ".join(values['-TOPIC-'].split()).lower(),
+        values['-INSTRUCTIONS-'].strip(),
+        values.get('-API-PROVIDER-', 'OpenRouter'),
+        bool(values.get('-ADD_IMAGES-')),
+        bool(values.get('-SECTIONED-')),
+    )
+
+
+def pdfpages_available() -> bool:
+    """True si pdfpages está instalado (o kpsewhich no permite comprobarlo)."""
+    return not missing_packages(['pdfpages'])
+
+
+def build_variant_prompt(topic: str, body: str, number: int) -> str:
+    return (
+        f"Reescribe con otras palabras el siguiente contenido LaTeX de un trabajo universitario sobre: {topic}\n"
+        f"Esta es la versión {number}: debe leerse como un trabajo distinto escrito por otro estudiante.\n"
+        "REQUISITOS: mismas secciones (\\section* y \\subsection*), mismos datos y el mismo nivel de detalle; "
+        "cambia la redacción, el orden de las ideas dentro de cada sección y los ejemplos. Devuelve SOLO el "
+        "cuerpo en LaTeX, sin bloques markdown, sin \\documentclass, preámbulo, \\begin{document} ni "
+        "\\end{document}.\n\n"
+        f"{body}"
+    )
+
+
+def _body_lock(key: str) -> threading.Lock:
+    with _body_locks_guard:
+        return _body_locks.setdefault(key, threading.Lock())
+
+
+def generate_variants(values, body: str, count: int, stats: StreamStats, cache_mode: str = None,
+                      metrics: JobMetrics = None) -> list:
+    """Hasta count reescrituras de body, en paralelo (SECTION_WORKERS) y guardadas como etapa
+    'variant' de core.stages. Una reescritura que falla se omite: sus estudiantes usan otra."""
+    if count <= 0:
+        return []
+    metrics = metrics or JobMetrics()
+    provider = get_job_provider(values.get('-API-PROVIDER-', 'OpenRouter'))
+    options = provider_options(values, metrics, None, cache_mode, stats)
+    reuse = provider_reuse(cache_mode)
+
+    def variant(number):
+        prompt = build_variant_prompt(values['-TOPIC-'], body, number)
+        try:
+            with metrics.stage('variant', provider=provider.name, variant=number) as fields:
+                text, fields['cached'] = get_stage_store().run(
+                    'variant', dict(provider_inputs(provider, options), prompt=prompt),
+                    lambda: provider.generate(prompt, options), reuse=reuse, valid=bool
+                )
+            return text
+        except Exception as e:
+            logging.warning(f"No se pudo generar la versión {number} del cuerpo: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(count, SECTION_WORKERS)) as executor:
+        return [text for text in executor.map(variant, range(1, count + 1)) if text]
+
+
+def compile_body(body: str, image_paths: list, values, output_dir: str, cache_mode: str = None,
+                 stats: StreamStats = None, metrics: JobMetrics = None, build_pdf: bool = True) -> dict:
+    """Corrige el cuerpo como documento sin portada, le añade las imágenes y, con build_pdf, lo compila
+    a <output_dir>/body-<hash>.pdf (una vez por contenido: si el PDF ya existe se reutiliza).
+
+    Devuelve un dict con 'content' (el documento corregido), 'pdf' (o None), 'lint' y 'repairs'."""
+    metrics = metrics or JobMetrics()
+    lint_report = []
+    with metrics.stage('sanitize'):
+        content = sanitize_content(render_body_document(body), output_dir, lint_report)
+    with metrics.stage('inject_images'):
+        content = inject_images(content, image_paths)
+    result = {'content': content, 'pdf': None, 'lint': lint_report, 'repairs': 0}
+    if not build_pdf:
+        return result
+
+    digest = sha256_text(content)
+    tex_path = os.path.join(output_dir, f"{BODY_PREFIX}{digest[:20]}.tex")
+    pdf_path = os.path.splitext(tex_path)[0] + ".pdf"
+    with _body_lock(digest):
+        if os.path.exists(pdf_path):
+            logging.info(f"Cuerpo ya compilado, se reutiliza: {pdf_path}")
+            os.utime(pdf_path)  # La retención (ArtifactStore.prune) cuenta desde el último uso
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            with metrics.stage('tex_write'):
+                write_tex(content, tex_path)
+            provider = get_job_provider(values.get('-API-PROVIDER-', 'OpenRouter'))
+            options = provider_options(values, metrics, None, cache_mode, stats)
+            result['repairs'] = compile_pdf(tex_path, None, provider, options, metrics)['repairs']
+    result['pdf'] = pdf_path
+    return result
+
+
+def prepare_group(group_id: str, values, students: int, output_dir: str = OUTPUT_DIR, image_dir: str = IMAGE_DIR,
+                  cache_mode: str = None, variants: int = None, use_pdfpages: bool = True) -> dict:
+    """Genera, corrige y compila el cuerpo (y sus reescrituras) de un grupo a partir de la primera fila.
+
+    Devuelve {'group', 'bodies', 'metrics'} y 'error' si falló; nunca lanza excepciones. Como mucho se
+    piden students - 1 reescrituras: más no se usarían."""
+    variants = FANOUT_VARIANTS if variants is None else variants
+    metrics = JobMetrics(group_id, batch=True, fanout='body', students=students)
+    metrics.set(topic=values.get('-TOPIC-'), provider=values.get('-API-PROVIDER-', 'OpenRouter'))
+    stats = StreamStats()
+    shared = {'group': group_id, 'bodies': [], 'metrics': metrics}
+    try:
+        student_data = build_student_data(values)
+        body = generate_latex(values, student_data, None, None, stats, cache_mode, metrics, assemble=False)
+        bodies = [body] + generate_variants(values, body, min(variants, students - 1), stats, cache_mode, metrics)
+        with metrics.stage('images'):
+            image_paths = fetch_images(values, image_dir, metrics)
+        for text in bodies:
+            shared['bodies'].append(
+                compile_body(text, image_paths, values, output_dir, cache_mode, stats, metrics, build_pdf=use_pdfpages)
+            )
+    except Exception as e:
+        logging.error(f"[fan-out {group_id}] Error: {str(e)}")
+        metrics.set(status='error', error_type=type(e).__name__, error=str(e)[:300])
+        shared['error'] = str(e)
+    else:
+        metrics.set(status='shared', variants=len(shared['bodies']))
+    finally:
+        get_rate_limiter().forget(group_id)
+        metrics.set(prompt_tokens=stats.prompt_tokens, completion_tokens=stats.completion_tokens)
+        metrics.finish()
+        if metrics_enabled():
+            try:
+                metrics.write()
+            except OSError as e:
+                logging.warning(f"No se pudieron guardar las métricas: {e}")
+    return shared
+
+
+def stamp_student(status: dict, metrics: JobMetrics, values, shared: dict, number: int,
+                  output_dir: str = OUTPUT_DIR, cache_mode: str = None) -> dict:
+    """Documento de un estudiante a partir del cuerpo number de shared: solo su portada se compone
+    (o, sin PDF del cuerpo, el documento completo). Completa y devuelve status; nunca lanza excepciones."""
+    start = time.perf_counter()
+    metrics.set(topic=values.get('-TOPIC-'), provider=values.get('-API-PROVIDER-', 'OpenRouter'),
+                fanout='cover', group=shared['group'], variant=number)
+    status.update(group=shared['group'], variant=number)
+    try:
+        if shared.get('error'):
+            raise Exception(f"No se pudo generar el cuerpo del grupo: {shared['error']}")
+        body = shared['bodies'][number]
+        student_data = build_student_data(values)
+        filepath = build_tex_path(values, output_dir, status['job_id'])
+        if body['pdf']:
+            content = render_cover_document(student_data, os.path.basename(body['pdf']))
+            provider = options = None
+        else:
+            # Sin pdfpages: el documento del cuerpo ya corregido por lint_latex, con la portada delante
+            preamble, rest = split_preamble(body['content'])
+            begin = "\\begin{document}"
+            content = preamble + begin + "\n\n" + render_cover(student_data) + rest[len(begin):]
+            provider = get_job_provider(values.get('-API-PROVIDER-', 'OpenRouter'))
+            options = provider_options(values, metrics, None, cache_mode)
+        with metrics.stage('tex_write'):
+            write_tex(content, filepath)
+
+        store = get_store(output_dir) if artifacts_enabled() else None
+        content_sha256 = sha256_text(content)
+        previous = store.find_content(content_sha256) if store is not None else None
+        if previous is not None:
+            with metrics.stage('reuse'):
+                pdf_path = store.reuse_pdf(previous, os.path.join(output_dir, build_pdf_name(student_data)))
+            repairs = 0
+        else:
+            compiled = compile_pdf(filepath, None, provider, options, metrics)
+            repairs = compiled['repairs']
+            with metrics.stage('rename'):
+                pdf_path = rename_pdf(compiled['pdf'], student_data)
+        if store is not None:
+            with metrics.stage('index'):
+                index_job(store, values, student_data, content_sha256, filepath, pdf_path, status['job_id'])
+    except Exception as e:
+        logging.error(f"[fan-out {status['job_id']}] Error: {str(e)}")
+        metrics.set(status='error', error_type=type(e).__name__, error=str(e)[:300])
+        status.update(status='error', error=str(e))
+    else:
+        metrics.set(status='ok', lint_fixes=len(body['lint']), repairs=body['repairs'] + repairs,
+                    reused=previous is not None)
+        status.update(status='ok', tex=filepath, pdf=pdf_path, lint=body['lint'], repairs=body['repairs'] + repairs,
+                      reused=previous is not None)
+    finally:
+        get_rate_limiter().forget(metrics.job_id or id(metrics))
+        metrics.finish()
+        if metrics_enabled():
+            try:
+                metrics.write()
+            except OSError as e:
+                logging.warning(f"No se pudieron guardar las métricas: {e}")
+        status['seconds'] = round(time.perf_counter() - start, 2)
+        status['metrics'] = metrics.as_dict()
+    logging.info(f"[fan-out {status['job_id']}] {status['status']} en {status['seconds']} s")
+    return status
+
+
+def run_fanout(jobs: list, workers: int = 4, output_dir: str = OUTPUT_DIR, image_dir: str = IMAGE_DIR,
+               cache_mode: str = None, variants: int = None) -> dict:
+    """Agrupa los trabajos por group_key y genera cada grupo con prepare_group y cada estudiante con
+    stamp_student, todo en un pool de workers hilos (pdflatex sigue limitado por COMPILE_WORKERS).
+
+    jobs es una lista de (status, metrics, values) como los de batch.run_job. Devuelve {'jobs': los
+    status en el orden recibido, 'groups': resumen de cada grupo con sus métricas}."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(group_key(job[2]), []).append(job)
+    use_pdfpages = pdfpages_available()
+    if not use_pdfpages:
+        logging.warning("pdfpages no está instalado: el cuerpo se genera una vez por grupo, pero cada "
+                        "estudiante se compila completo")
+    logging.info(f"Fan-out: {len(jobs)} estudiantes en {len(groups)} grupos")
+
+    summaries = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        def prepare(members):
+            values = members[0][2]
+            group_id = f"{build_section_code(values)}_{uuid.uuid4().hex[:6]}"
+            logging.info(f"[fan-out {group_id}] {values['-TOPIC-']}: {len(members)} estudiantes")
+            shared = prepare_group(group_id, values, len(members), output_dir, image_dir, cache_mode, variants,
+                                   use_pdfpages)
+            summary = {'group': group_id, 'section': build_section_code(values), 'topic': values['-TOPIC-'],
+                       'students': len(members), 'variants': len(shared['bodies']),
+                       'status': 'error' if shared.get('error') else 'ok', 'metrics': shared['metrics'].as_dict()}
+            if shared.get('error'):
+                summary['error'] = shared['error']
+            summaries.append(summary)
+            # Cada estudiante recibe una versión del cuerpo por turnos
+            return [
+                executor.submit(stamp_student, status, metrics, member_values, shared,
+                                i % max(1, len(shared['bodies'])), output_dir, cache_mode)
+                for i, (status, metrics, member_values) in enumerate(members)
+            ]
+
+        stamped = [executor.submit(prepare, members) for members in groups.values()]
+        for future in stamped:
+            for student in future.result():
+                student.result()
+
+    return {'jobs': [status for status, _, _ in jobs], 'groups': summaries}
@@ -0,0 +1,84 @@
+import logging
+import threading
+
+
+class JobCancelled(Exception):
+    """El usuario canceló el trabajo en curso."""
+
+
+class CancelToken:
+    """Señal de cancelación compartida entre la GUI y el hilo que ejecuta el pipeline.
+
+    Las etapas bloqueantes registran un callback (cerrar el cliente HTTP, matar pdflatex)
+    que se ejecuta en cuanto se llama a cancel()."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.debug(f"Error en callback de cancelación: {e}")
+
+    def register(self, callback):
+        """Registra callback para la cancelación; se ejecuta de inmediato si ya se canceló."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled("Trabajo cancelado por el usuario")
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._event.wait(timeout)
+
+
+def run_cancellable(func, cancel_token: CancelToken = None, poll_interval: float = 0.1):
+    """Ejecuta func() en un hilo auxiliar y vuelve en cuanto termine o se cancele el token.
+
+    Si se cancela, lanza JobCancelled sin esperar a func; su resultado se descarta."""
+    if cancel_token is None:
+        return func()
+
+    cancel_token.raise_if_cancelled()
+    outcome = {}
+    done = threading.Event()
+
+    def target():
+        try:
+            outcome['result'] = func()
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, daemon=True).start()
+    while not done.wait(poll_interval):
+        cancel_token.raise_if_cancelled()
+
+    if 'error' in outcome:
+        if cancel_token.cancelled:
+            raise JobCancelled("Trabajo cancelado por el usuario") from outcome['error']
+        raise outcome['error']
+    return outcome['result']
@@ -0,0 +1,238 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from io import StringIO
+
+METRICS_DIR = "metrics"
+JOBS_FILE = "jobs.jsonl"
+
+_write_lock = threading.Lock()
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("METRICS", "on").lower() not in ("off", "false", "0", "no")
+
+
+def metrics_dir() -> str:
+    return os.getenv("METRICS_DIR", METRICS_DIR)
+
+
+class JobMetrics:
+    """Tiempos por etapa y datos de un trabajo del pipeline, exportables como una línea JSON.
+
+    Cada etapa se guarda como {'stage', 'seconds', ...campos extra}; una misma etapa puede
+    repetirse (cada descarga de imagen, cada pasada de pdflatex). Es seguro usarlo desde varios
+    hilos (descargas de imágenes, secciones en paralelo)."""
+
+    def __init__(self, job_id: str = None, **fields):
+        self.job_id = job_id
+        self.started = time.time()
+        self.finished = None
+        self.fields = dict(fields)
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """Mide el bloque como la etapa name (también si lanza una excepción)."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.add(name, time.perf_counter() - start, **fields)
+
+    def add(self, name: str, seconds: float, **fields):
+        entry = {'stage': name, 'seconds': round(seconds, 4)}
+        entry.update(fields)
+        with self._lock:
+            self.stages.append(entry)
+
+    def set(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def finish(self):
+        """Fija la duración total del trabajo (si no, as_dict mide hasta el momento de llamarlo)."""
+        self.finished = time.time()
+
+    def total(self, name: str) -> float:
+        with self._lock:
+            return sum(s['seconds'] for s in self.stages if s['stage'] == name)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            record = {
+                'job_id': self.job_id,
+                'ts': round(self.started, 3),
+                'seconds': round((self.finished or time.time()) - self.started, 3),
+            }
+            record.update(self.fields)
+            record['stages'] = list(self.stages)
+        return record
+
+    def write(self, path: str = None) -> str:
+        """Añade el registro como una línea a path (por defecto <METRICS_DIR>/jobs.jsonl)."""
+        path = path or os.path.join(metrics_dir(), JOBS_FILE)
+        line = json.dumps(self.as_dict(), ensure_ascii=False)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _write_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return path
+
+
+def load_records(path: str) -> list:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logging.warning(f"Línea de métricas inválida en {path}")
+    return records
+
+
+def percentile(values: list, q: float):
+    """Percentil q (0-100) por interpolación lineal; None si no hay valores."""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def _distribution(values: list) -> dict:
+    return {
+        'count': len(values),
+        'sum': round(sum(values), 4),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+    }
+
+
+def summarize(records: list) -> dict:
+    """Agrega registros de trabajos: por etapa (count, sum, p50, p95, max), estados y tokens."""
+    per_stage = {}
+    for record in records:
+        # Cada entrada cuenta por separado: cada descarga de imagen, cada pasada de pdflatex...
+        for entry in record.get('stages', []):
+            per_stage.setdefault(entry['stage'], []).append(entry['seconds'])
+
+    stages = {}
+    for name, values in sorted(per_stage.items()):
+        stages[name] = {
+            'count': len(values),
+            'sum': round(sum(values), 4),
+            'p50': round(percentile(values, 50), 4),
+            'p95': round(percentile(values, 95), 4),
+            'max': round(max(values), 4),
+        }
+
+    status = {}
+    for record in records:
+        key = record.get('status', 'unknown')
+        status[key] = status.get(key, 0) + 1
+
+    ttfts = [r['ttft_s'] for r in records if r.get('ttft_s') is not None]
+    return {
+        'jobs': len(records),
+        'status': status,
+        'stages': stages,
+        'job_seconds': _distribution([r['seconds'] for r in records]),
+        'ttft_s': _distribution(ttfts),
+        'prompt_tokens': sum(r.get('prompt_tokens') or 0 for r in records),
+        'completion_tokens': sum(r.get('completion_tokens') or 0 for r in records),
+    }
+
+
+def _atomic_write(path: str, text: str):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def to_prometheus(summary: dict) -> str:
+    """Formato de texto de Prometheus (para el textfile collector de node_exporter)."""
+    lines = [
+        "# HELP autohmwrk_stage_seconds Duración de cada etapa del pipeline.",
+        "# TYPE autohmwrk_stage_seconds summary",
+    ]
+    for name, s in summary['stages'].items():
+        lines.append(f'autohmwrk_stage_seconds{{stage="{name}",quantile="0.5"}} {s["p50"]}')
+        lines.append(f'autohmwrk_stage_seconds{{stage="{name}",quantile="0.95"}} {s["p95"]}')
+        lines.append(f'autohmwrk_stage_seconds_sum{{stage="{name}"}} {s["sum"]}')
+        lines.append(f'autohmwrk_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+    lines += ["# HELP autohmwrk_jobs_total Trabajos por estado.", "# TYPE autohmwrk_jobs_total counter"]
+    for status, count in sorted(summary['status'].items()):
+        lines.append(f'autohmwrk_jobs_total{{status="{status}"}} {count}')
+    lines += ["# HELP autohmwrk_tokens_total Tokens informados por los proveedores.", "# TYPE autohmwrk_tokens_total counter"]
+    lines.append(f'autohmwrk_tokens_total{{kind="prompt"}} {summary["prompt_tokens"]}')
+    lines.append(f'autohmwrk_tokens_total{{kind="completion"}} {summary["completion_tokens"]}')
+    for key, metric in (('ttft_s', 'autohmwrk_ttft_seconds'), ('job_seconds', 'autohmwrk_job_seconds')):
+        dist = summary[key]
+        if not dist['count']:
+            continue
+        lines.append(f"# TYPE {metric} summary")
+        lines.append(f'{metric}{{quantile="0.5"}} {round(dist["p50"], 4)}')
+        lines.append(f'{metric}{{quantile="0.95"}} {round(dist["p95"], 4)}')
+        lines.append(f"{metric}_sum {dist['sum']}")
+        lines.append(f"{metric}_count {dist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def to_csv(summary: dict) -> str:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['stage', 'count', 'sum_s', 'p50_s', 'p95_s', 'max_s'])
+    for name, s in summary['stages'].items():
+        writer.writerow([name, s['count'], s['sum'], s['p50'], s['p95'], s['max']])
+    return buffer.getvalue()
+
+
+def write_summary(records: list, directory: str = None, stem: str = "summary") -> dict:
+    """Escribe <stem>.prom y <stem>.csv en directory y devuelve el resumen."""
+    directory = directory or metrics_dir()
+    summary = summarize(records)
+    _atomic_write(os.path.join(directory, f"{stem}.prom"), to_prometheus(summary))
+    _atomic_write(os.path.join(directory, f"{stem}.csv"), to_csv(summary))
+    return summary
+
+
+def print_stages(summary: dict):
+    print(f"{'etapa':<18}{'n':>6}{'suma s':>10}{'p50 s':>9}{'p95 s':>9}{'max s':>9}")
+    for name, s in summary['stages'].items():
+        print(f"{name:<18}{s['count']:>6}{s['sum']:>10.2f}{s['p50']:>9.3f}{s['p95']:>9.3f}{s['max']:>9.3f}")
+    print(f"\nTrabajos: {summary['jobs']} {summary['status']}  "
+          f"Tokens: {summary['prompt_tokens']} prompt / {summary['completion_tokens']} salida")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resume metrics/jobs.jsonl en .prom y .csv")
+    parser.add_argument('jobs', nargs='?', help="Archivo JSON-lines (por defecto <METRICS_DIR>/jobs.jsonl)")
+    parser.add_argument('--output-dir', help="Carpeta de salida (por defecto METRICS_DIR)")
+    parser.add_argument('--since', type=float, default=0, help="Solo trabajos de las últimas N horas")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.jobs or os.path.join(metrics_dir(), JOBS_FILE))
+    if args.since:
+        cutoff = time.time() - args.since * 3600
+        records = [r for r in records if r.get('ts', 0) >= cutoff]
+    summary = write_summary(records, args.output_dir)
+    print_stages(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+import logging
+import os
+from datetime import datetime
+from core.artifacts import artifacts_enabled, get_store, sha256_text
+from core.compiler import CompilationError
+from core.repair import compile_with_repair
+from core.jobs import run_cancellable, JobCancelled
+from core.metrics import JobMetrics, metrics_enabled
+from core.sections import generation_mode, generate_sectioned
+from core.stages import get_stage_store, stage_cache_enabled
+from api.cache import CacheMiss, get_cache
+from api.failover import get_job_provider
+from api.providers import TEMPLATE_PACKAGES
+from api.ratelimit import get_rate_limiter, PRIORITY_INTERACTIVE
+from api.streaming import StreamStats, StreamAborted, check_latex_body
+from api.transforms import InsertBefore, apply
+from config.settings import env_flag
+from utils.latex_lint import lint_latex
+from utils.latex_template import template_enabled, assemble_document
+from utils import build_student_data, build_section_code
+
+OUTPUT_DIR = "generated_docs"
+IMAGE_DIR = "temp_images"
+
+# Etapas que se notifican al callback `progress` de run_pipeline, con su porcentaje aproximado
+STAGES = {
+    'generating': 10,
+    'images': 55,
+    'compiling': 75,
+    'done': 100,
+}
+
+
+def stream_enabled() -> bool:
+    """Streaming por defecto según STREAM_OUTPUT en el .env."""
+    return env_flag("STREAM_OUTPUT")
+
+
+def provider_options(values, metrics: JobMetrics, cancel_token=None, cache_mode: str = None,
+                     stats: StreamStats = None) -> dict:
+    """options de las llamadas al proveedor de un trabajo; 'job' y 'priority' dan su turno en
+    api.ratelimit ('-PRIORITY-' en values, interactiva por defecto)."""
+    return {
+        'cancel_token': cancel_token,
+        'cache_mode': cache_mode,
+        'stats': stats,
+        'job': metrics.job_id or id(metrics),
+        'priority': values.get('-PRIORITY-', PRIORITY_INTERACTIVE),
+    }
+
+
+def provider_reuse(cache_mode: str = None) -> bool:
+    """True si las etapas que guardan salidas del proveedor pueden reutilizarse: STAGE_CACHE activo
+    y modo de caché efectivo (cache_mode o, si no se indica, LLM_CACHE_MODE) distinto de 'refresh'
+    y 'off'."""
+    return stage_cache_enabled() and (cache_mode or get_cache().mode) not in ('refresh', 'off')
+
+
+def provider_inputs(provider, options: dict) -> dict:
+    """Entradas de etapa que identifican quién genera: proveedor, modelo y opciones de generación
+    (cambiar el modelo en el .env invalida lo guardado)."""
+    return {
+        'provider': provider.name,
+        'model': getattr(provider, 'model', None),
+        'temperature': options.get('temperature'),
+        'reasoning_filter': getattr(provider, 'reasoning_filter', None),
+    }
+
+
+def generate_latex(values, student_data, cancel_token=None, stream_path: str = None, stats: StreamStats = None,
+                   cache_mode: str = None, metrics: JobMetrics = None, assemble: bool = True) -> str:
+    """Llama al proveedor seleccionado en '-API-PROVIDER-' y devuelve el código LaTeX.
+
+    Con stream_path la respuesta se pide en streaming y se va escribiendo en ese archivo.
+    cache_mode ('on', 'refresh', 'replay', 'off') sustituye a LLM_CACHE_MODE; si no se indica,
+    '-FORCE-REFRESH-' en values equivale a 'refresh'. En modo por secciones (core.sections) se
+    pide un esquema y luego las secciones en paralelo; ese modo no usa streaming.
+
+    Con la plantilla local (utils.latex_template) el modelo solo escribe el cuerpo y el preámbulo
+    y la portada se renderizan a partir de student_data (con assemble=False se devuelve solo el
+    cuerpo, que core.fanout comparte entre estudiantes). Con metrics se miden las etapas 'prompt'
+    y 'provider'.
+
+    La salida del modelo es la etapa 'content' de core.stages: se guarda con el hash de sus
+    entradas (proveedor, modelo, opciones, modo y prompt; con la plantilla local el prompt no lleva
+    los datos del estudiante), así que corregir el nombre o repetir tras un error de compilación no vuelve a
+    llamar al proveedor. 'refresh' y 'off' la recalculan siempre."""
+    metrics = metrics or JobMetrics()
+    if cache_mode is None and values.get('-FORCE-REFRESH-'):
+        cache_mode = 'refresh'
+
+    provider = get_job_provider(values.get('-API-PROVIDER-', 'OpenRouter'))
+    logging.info(f"Usando el proveedor {provider.name}")
+    options = provider_options(values, metrics, cancel_token, cache_mode, stats)
+    topic, instructions = values['-TOPIC-'], values['-INSTRUCTIONS-']
+    sectioned = generation_mode(values) == 'sections'
+    templated = template_enabled()
+    metrics.set(mode='sections' if sectioned else 'single', template=templated)
+    with metrics.stage('prompt'):
+        if templated:
+            prompt = provider.build_body_prompt(topic, instructions)
+            options['validate'] = check_latex_body
+        else:
+            prompt = provider.build_prompt(topic, instructions, student_data)
+
+    def call():
+        if sectioned:
+            # Con la plantilla local la portada no se pide: el cuerpo no depende del estudiante
+            return generate_sectioned(provider, topic, instructions, student_data, options,
+                                      front="" if templated else None,
+                                      packages=TEMPLATE_PACKAGES if templated else None)
+        if stream_path:
+            return provider.stream(prompt, stream_path, options)
+        return provider.generate(prompt, options)
+
+    inputs = dict(provider_inputs(provider, options), mode='sections' if sectioned else 'single',
+                  template=templated, prompt=prompt)
+    if sectioned:
+        inputs.update(topic=topic, instructions=instructions)
+        if not templated:
+            inputs['student'] = student_data
+    reuse = provider_reuse(cache_mode)
+    try:
+        with metrics.stage('provider', provider=provider.name) as fields:
+            content, fields['cached'] = get_stage_store().run(
+                'content', inputs, lambda: run_cancellable(call, cancel_token), reuse=reuse, valid=bool
+            )
+    except (JobCancelled, CacheMiss, StreamAborted):
+        raise
+    except Exception as e:
+        logging.error(f"Error del proveedor {provider.name}: {str(e)}")
+        raise Exception(f"Error al comunicarse con {provider.name}: {str(e)}")
+    if templated and assemble:
+        content = assemble_document(student_data, content)
+    logging.info(f"Contenido generado exitosamente. Longitud: {len(content or '')} caracteres")
+    return content
+
+
+def fetch_images(values, image_dir: str = IMAGE_DIR, metrics: JobMetrics = None) -> list:
+    """Descarga imágenes del tema si '-ADD_IMAGES-' está activo. Nunca lanza excepciones.
+
+    Es la etapa 'images' de core.stages: la lista se guarda por (búsqueda, carpeta) y se reutiliza
+    mientras los archivos sigan en disco."""
+    if not values.get('-ADD_IMAGES-'):
+        return []
+
+    # Usar el tema principal para buscar imágenes, es más preciso que el contenido completo
+    search_query = values['-TOPIC-']
+    # Si hay materia, combinarla para contexto
+    if values.get('-SUBJECT-'):
+        search_query += f" {values['-SUBJECT-']}"
+
+    def download():
+        logging.info("Buscando imágenes relacionadas...")
+        try:
+            # La biblioteca local va primero; la web (requests, bs4, PIL) solo si no basta
+            from utils.image_sources import download_images
+            return download_images(search_query, image_dir, metrics=metrics)
+        except Exception as img_err:
+            logging.warning(f"No se pudieron descargar imágenes: {img_err}")
+            return []
+
+    def valid(paths):
+        # Una búsqueda sin resultados (p. ej. sin red) no se da por buena
+        return bool(paths) and all(os.path.exists(path) for path in paths)
+
+    paths, _ = get_stage_store().run('images', {'query': search_query, 'dir': image_dir}, download,
+                                     reuse=stage_cache_enabled(), valid=valid)
+    return paths
+
+
+def sanitize_content(full_content: str, output_dir: str = OUTPUT_DIR, report: list = None) -> str:
+    """Corrige la salida del proveedor con utils.latex_lint antes de escribirla.
+
+    Las rutas de \\includegraphics se comprueban relativas a output_dir (donde corre pdflatex).
+    Si se pasa report, se le añaden las correcciones aplicadas."""
+    if not full_content:
+        raise ValueError("La API no devolvió contenido.")
+    full_content, fixes = lint_latex(full_content, output_dir)
+    if report is not None:
+        report.extend(fixes)
+    return full_content
+
+
+def inject_images(content: str, image_paths: list) -> str:
+    """Injects images into the LaTeX content before the end of the document"""
+    if not image_paths:
+        return content
+
+    image_section = "\n\n\\section*{Anexos Gráficos}\n"
+
+    for i, path in enumerate(image_paths):
+        # path is usually like "temp_images/img_testtest_0.jpg"
+        # Since we compile inside generated_docs/, we need "../" to go back to root
+        # Ensure we use forward slashes for LaTeX
+        relative_path = path if os.path.isabs(path) else "../" + path
+        relative_path = relative_path.replace(os.sep, '/')
+
+        # Use float barrier or clearpage to prevent messy layout
+        image_section += "\\begin{figure}[h!]\n\\centering\n"
+        image_section += f"\\includegraphics[width=0.75\\textwidth]{{{relative_path}}}\n"
+        image_section += f"\\caption{{Imagen ilustrativa {i+1}}}\n"
+        image_section += "\\end{figure}\n\\clearpage\n"
+
+    return apply(InsertBefore("\\end{document}", image_section), content)
+
+
+def build_tex_path(values, output_dir: str = OUTPUT_DIR, job_id: str = None) -> str:
+    """Ruta del .tex del trabajo: <sección>_<fecha>[_<job_id>].tex dentro de output_dir.
+
+    job_id se añade al nombre para que trabajos paralelos del mismo segundo no colisionen."""
+    os.makedirs(output_dir, exist_ok=True)
+    stem = f"{build_section_code(values)}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    if job_id:
+        stem += f"_{job_id}"
+    return os.path.join(output_dir, f"{stem}.tex")
+
+
+def write_tex(content: str, filepath: str) -> str:
+    """Guarda el contenido LaTeX en filepath y devuelve la ruta. Sin traducir los saltos de línea,
+    así el archivo tiene los mismos bytes que el texto del que se calcula content_sha256."""
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+    return filepath
+
+
+def compile_pdf(filepath: str, cancel_token=None, provider=None, options: dict = None,
+                metrics: JobMetrics = None) -> dict:
+    """Compila el .tex con pdflatex dentro de su carpeta y devuelve el dict de core.compiler
+    ('pdf', 'passes', ...) más 'repairs'.
+
+    Con provider, los errores de compilación se intentan reparar pidiéndole solo el fragmento
+    que falla (core.repair). Si se cancela cancel_token mientras corre, pdflatex se mata."""
+    logging.info("Compilando a PDF...")
+    return compile_with_repair(filepath, provider, options, cancel_token, metrics=metrics)
+
+
+def build_pdf_name(student_data) -> str:
+    """Nombre final del PDF a partir de los datos del estudiante (ya saneado)."""
+    new_pdf_name = (
+        f"{student_data['nombre']} - V{student_data['ci']} - "
+        f"{student_data['materia']} - {student_data['seccion']} - "
+        f"Ev. {student_data['eval_num']} Corte {student_data['corte']} - UAH.pdf"
+    )
+    # Sanitize filename
+    return "".join([c for c in new_pdf_name if c.isalnum() or c in (' ', '-', '.', '_')]).strip()
+
+
+def rename_pdf(pdf_path: str, student_data) -> str:
+    """Renombra el PDF compilado con los datos del estudiante."""
+    new_pdf_path = os.path.join(os.path.dirname(pdf_path), build_pdf_name(student_data))
+    os.replace(pdf_path, new_pdf_path)
+    logging.info("PDF compilado y renombrado exitosamente.")
+    return new_pdf_path
+
+
+def index_job(store, values, student_data, content_sha256: str, tex_path: str, pdf_path: str, job_id: str = None):
+    """Registra el trabajo en el índice de core.artifacts (y borra los subproductos de pdflatex).
+    Un fallo del índice no hace fallar el trabajo: el PDF ya está generado."""
+    try:
+        store.record(student_data, values.get('-TOPIC-'), values.get('-API-PROVIDER-', 'OpenRouter'),
+                     content_sha256, tex_path, pdf_path, job_id)
+        store.maybe_prune()
+    except Exception as e:
+        logging.warning(f"No se pudo registrar el documento en el índice: {e}")
+
+
+def run_pipeline(values, output_dir: str = OUTPUT_DIR, image_dir: str = IMAGE_DIR, job_id: str = None,
+                 progress=None, cancel_token=None, stream: bool = None, cache_mode: str = None,
+                 metrics: JobMetrics = None) -> dict:
+    """Ejecuta la generación completa sin GUI: proveedor, imágenes, .tex, pdflatex y renombrado.
+
+    progress(stage) se llama al entrar en cada etapa de STAGES. cancel_token (core.jobs.CancelToken)
+    aborta la petición HTTP o pdflatex en curso y hace lanzar JobCancelled. Con stream (por defecto
+    STREAM_OUTPUT) el .tex se escribe mientras llega la respuesta y el resultado incluye 'stream'
+    con TTFT y tokens/s. cache_mode controla la caché de respuestas (ver api.cache).
+
+    Las etapas son prompt -> content -> sanitize -> images -> inject_images -> compile -> rename.
+    Las costosas guardan su resultado con el hash de sus entradas: 'content' e 'images' en
+    core.stages y 'compile' en el índice de core.artifacts (por hash del .tex). Repetir un trabajo,
+    o retomarlo tras una interrupción, solo recalcula las etapas cuyas entradas cambiaron.
+
+    Cada etapa se mide en metrics (core.metrics.JobMetrics, se crea uno si no se pasa) y, con
+    METRICS activo, el trabajo se añade como una línea a metrics/jobs.jsonl, también si falla.
+
+    Devuelve un dict con las rutas 'tex' y 'pdf', 'lint' (correcciones de utils.latex_lint), 'repairs'
+    (reparaciones del bucle de core.repair) y 'reused' (True si el mismo LaTeX ya estaba compilado en
+    el índice de core.artifacts y se reutilizó su PDF). Los errores de compilación se lanzan como
+    CompilationError; el resto de errores se propagan tal cual."""
+    def stage(name):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if progress is not None:
+            progress(name)
+
+    if stream is None:
+        stream = stream_enabled()
+    if metrics is None:
+        metrics = JobMetrics(job_id)
+    stats = StreamStats()
+    metrics.set(topic=values.get('-TOPIC-'), provider=values.get('-API-PROVIDER-', 'OpenRouter'), stream=stream)
+
+    try:
+        filepath = build_tex_path(values, output_dir, job_id)
+
+        stage('generating')
+        logging.info("Generando contenido con API...")
+        student_data = build_student_data(values)
+        full_content = generate_latex(
+            values, student_data, cancel_token, filepath if stream else None, stats, cache_mode, metrics
+        )
+
+        lint_report = []
+        with metrics.stage('sanitize'):
+            full_content = sanitize_content(full_content, output_dir, lint_report)
+        stage('images')
+        with metrics.stage('images'):
+            image_paths = fetch_images(values, image_dir, metrics)
+        with metrics.stage('inject_images'):
+            full_content = inject_images(full_content, image_paths)
+
+        stage('compiling')
+        with metrics.stage('tex_write'):
+            write_tex(full_content, filepath)
+        store = get_store(output_dir) if artifacts_enabled() else None
+        content_sha256 = sha256_text(full_content)
+        previous = store.find_content(content_sha256) if store is not None else None
+        if previous is not None:
+            # El mismo LaTeX ya se compiló (p. ej. respuesta de la caché): reutilizar su PDF
+            with metrics.stage('reuse'):
+                new_pdf_path = store.reuse_pdf(previous, os.path.join(output_dir, build_pdf_name(student_data)))
+            compiled = {'repairs': 0}
+            logging.info(f"PDF reutilizado de un trabajo anterior idéntico: {previous['pdf_path']}")
+        else:
+            provider = get_job_provider(values.get('-API-PROVIDER-', 'OpenRouter'))
+            options = provider_options(values, metrics, cancel_token, cache_mode, stats)
+            compiled = compile_pdf(filepath, cancel_token, provider, options, metrics)
+            with metrics.stage('rename'):
+                new_pdf_path = rename_pdf(compiled['pdf'], student_data)
+        if store is not None:
+            with metrics.stage('index'):
+                index_job(store, values, student_data, content_sha256, filepath, new_pdf_path, job_id)
+    except JobCancelled:
+        metrics.set(status='cancelled')
+        raise
+    except Exception as e:
+        metrics.set(status='error', error_type=type(e).__name__, error=str(e)[:300])
+        raise
+    else:
+        metrics.set(status='ok', lint_fixes=len(lint_report), repairs=compiled['repairs'], reused=previous is not None)
+    finally:
+        get_rate_limiter().forget(metrics.job_id or id(metrics))
+        metrics.set(**_usage_fields(stats))
+        metrics.finish()
+        if metrics_enabled():
+            try:
+                metrics.write()
+            except OSError as e:
+                logging.warning(f"No se pudieron guardar las métricas: {e}")
+
+    if progress is not None:
+        progress('done')
+    result = {'tex': filepath, 'pdf': new_pdf_path, 'lint': lint_report, 'repairs': compiled['repairs'],
+              'reused': previous is not None}
+    if stream:
+        result['stream'] = stats.as_dict()
+    return result
+
+
+def _usage_fields(stats: StreamStats) -> dict:
+    """TTFT y tokens de la generación para el registro de métricas."""
+    data = stats.as_dict()
+    return {
+        'ttft_s': data['ttft_s'],
+        'tokens_per_s': data['tokens_per_s'],
+        'prompt_tokens': stats.prompt_tokens,
+        'completion_tokens': stats.completion_tokens,
+    }
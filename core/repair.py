@@ -0,0 +1,181 @@
+import logging
+import os
+import re
+import time
+from api.cache import get_cache
+from core.compiler import compile_latex, CompilationError
+from core.jobs import run_cancellable, JobCancelled
+from config.settings import load_settings
+from utils.latex_lint import lint_latex, strip_fences
+
+load_settings()
+
+# Intentos de reparación por documento (0 desactiva el bucle)
+REPAIR_ATTEMPTS = int(os.getenv("LATEX_REPAIR_ATTEMPTS", "2"))
+
+# Tamaño máximo del fragmento enviado al proveedor
+MAX_FRAGMENT_LINES = 40
+CONTEXT_LINES = 8
+
+_FILE_LINE_ERROR = re.compile(r"^(?:\./)?(?P<file>[^:\n]+\.tex):(?P<line>\d+): (?P<message>.*)$", re.MULTILINE)
+_LINE_MARKER = re.compile(r"^l\.(?P<line>\d+)", re.MULTILINE)
+_BEGIN_END = re.compile(r"\\(begin|end)\{([^}]+)\}")
+
+
+def locate_error(log_text: str, tex_name: str, line_count: int) -> dict:
+    """Primer error del .log de tex_name: {'line' (1-based), 'message'}, o None si no hay línea.
+
+    Usa las líneas 'archivo.tex:N: mensaje' de -file-line-error y, si no, el marcador 'l.N'.
+    Un final de archivo inesperado ('Emergency stop', '\\end occurred...') se sitúa al final."""
+    for match in _FILE_LINE_ERROR.finditer(log_text):
+        if os.path.basename(match.group('file')) == tex_name:
+            return {'line': int(match.group('line')), 'message': match.group('message').strip()}
+
+    bang = re.search(r"^! (.*)$", log_text, re.MULTILINE)
+    message = bang.group(1).strip() if bang else ""
+    marker = _LINE_MARKER.search(log_text, bang.end() if bang else 0)
+    if marker:
+        return {'line': int(marker.group('line')), 'message': message}
+    if "Emergency stop" in log_text or "end occurred inside a group" in log_text:
+        return {'line': line_count, 'message': message or "Fin de archivo inesperado"}
+    return None
+
+
+def fragment_bounds(lines: list, error_line: int) -> tuple:
+    """(inicio, fin) del fragmento a reparar alrededor de error_line, como rebanada de lines.
+
+    Si la línea está dentro de un entorno (distinto de document) que cabe en MAX_FRAGMENT_LINES,
+    se envía el entorno completo; si no, el párrafo que la contiene, acotado a CONTEXT_LINES."""
+    index = min(max(error_line - 1, 0), len(lines) - 1)
+
+    # Buscar hacia atrás el \begin que sigue abierto en la línea del error
+    depth = 0
+    for start in range(index, max(index - MAX_FRAGMENT_LINES, -1), -1):
+        for kind, env in reversed(_BEGIN_END.findall(lines[start])):
+            if env == 'document':
+                continue
+            if kind == 'end' and start != index:
+                depth += 1
+            elif kind == 'begin':
+                if depth == 0:
+                    end = _matching_end(lines, start, env)
+                    if end is not None and end - start <= MAX_FRAGMENT_LINES:
+                        return start, end
+                else:
+                    depth -= 1
+
+    start = index
+    while start > 0 and index - start < CONTEXT_LINES and lines[start - 1].strip():
+        start -= 1
+    end = index + 1
+    while end < len(lines) and end - index < CONTEXT_LINES and lines[end].strip():
+        end += 1
+    return start, end
+
+
+def _matching_end(lines: list, start: int, env: str):
+    depth = 0
+    for i in range(start, min(start + MAX_FRAGMENT_LINES + 1, len(lines))):
+        for kind, name in _BEGIN_END.findall(lines[i]):
+            if name != env:
+                continue
+            depth += 1 if kind == 'begin' else -1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def build_repair_prompt(fragment: str, message: str) -> str:
+    return (
+        "El siguiente fragmento de un documento LaTeX no compila con pdflatex.\n"
+        f"Error: {message}\n"
+        "Corrige SOLO este fragmento y devuélvelo completo, sin explicaciones ni bloques markdown. "
+        "No añadas \\documentclass, preámbulo ni \\begin{document}; conserva el contenido y el idioma.\n"
+        "\n--- FRAGMENTO ---\n"
+        f"{fragment}\n"
+    )
+
+
+def repair_document(content: str, log_text: str, tex_name: str, provider, options: dict = None,
+                    cancel_token=None):
+    """Pide al proveedor la corrección del fragmento que falla y devuelve el documento con ella, o
+    None si no se pudo localizar el error o la respuesta no cambia nada."""
+    lines = content.split('\n')
+    error = locate_error(log_text, tex_name, len(lines))
+    if error is None:
+        logging.info("No se encontró la línea del error en el .log; no se intenta reparar")
+        return None
+
+    start, end = fragment_bounds(lines, error['line'])
+    fragment = '\n'.join(lines[start:end])
+    logging.info(f"Reparando líneas {start + 1}-{end} ({error['message']})")
+
+    prompt = build_repair_prompt(fragment, error['message'])
+    fixed = run_cancellable(lambda: provider.generate(prompt, options), cancel_token)
+    fixed, _ = strip_fences(fixed or "")
+    fixed = fixed.strip('\n')
+    if not fixed.strip() or fixed == fragment:
+        return None
+    if '\\documentclass' in fixed and '\\documentclass' not in fragment:
+        # El modelo devolvió el documento entero: usarlo tal cual
+        return fixed
+    return '\n'.join(lines[:start] + [fixed] + lines[end:])
+
+
+def _refresh_options(options: dict = None) -> dict:
+    """options para volver a pedir una reparación: con la caché activa se pide en modo 'refresh', así
+    una respuesta guardada que no compiló no se repite y se sustituye por la nueva."""
+    options = dict(options or {})
+    if (options.get('cache_mode') or get_cache().mode) == 'on':
+        options['cache_mode'] = 'refresh'
+    return options
+
+
+def compile_with_repair(filepath: str, provider=None, options: dict = None, cancel_token=None,
+                        max_attempts: int = None, metrics=None) -> dict:
+    """compile_latex con bucle de reparación: si pdflatex falla, se envía al proveedor solo el
+    fragmento del error, se empalma la corrección (pasada otra vez por utils.latex_lint) y se
+    recompila, hasta max_attempts veces (LATEX_REPAIR_ATTEMPTS por defecto). El primer intento puede
+    salir de la caché de respuestas; los siguientes la saltan (_refresh_options).
+
+    Devuelve el dict de compile_latex con 'repairs' (intentos usados). Si no se logra compilar,
+    se lanza la CompilationError original."""
+    max_attempts = REPAIR_ATTEMPTS if max_attempts is None else max_attempts
+    base_dir = os.path.dirname(filepath) or "."
+    tex_name = os.path.basename(filepath)
+    first_error = None
+    attempt = 0
+
+    while True:
+        try:
+            result = compile_latex(filepath, cancel_token, metrics=metrics)
+            result['repairs'] = attempt
+            if attempt:
+                logging.info(f"Documento reparado tras {attempt} intento(s)")
+            return result
+        except CompilationError as e:
+            first_error = first_error or e
+            if provider is None or attempt >= max_attempts:
+                raise first_error
+            attempt += 1
+
+            with open(filepath, encoding='utf-8') as f:
+                content = f.read()
+            repair_start = time.perf_counter()
+            try:
+                repair_options = options if attempt == 1 else _refresh_options(options)
+                repaired = repair_document(content, e.log, tex_name, provider, repair_options, cancel_token)
+            except JobCancelled:
+                raise
+            except Exception as repair_err:
+                logging.warning(f"La reparación falló: {repair_err}")
+                raise first_error
+            finally:
+                if metrics is not None:
+                    metrics.add('repair', time.perf_counter() - repair_start, attempt=attempt)
+            if repaired is None:
+                raise first_error
+
+            repaired, _ = lint_latex(repaired, base_dir)
+            with open(filepath, 'w', encoding='utf-8', newline='') as f:
+                f.write(repaired)
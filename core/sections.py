@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import load_settings
+from utils.latex_lint import strip_fences
+
+load_settings()
+
+# Llamadas simultáneas al proveedor al generar por secciones
+SECTION_WORKERS = int(os.getenv("SECTION_WORKERS", "4"))
+MAX_SECTIONS = 8
+
+
+def generation_mode(values) -> str:
+    """'sections' si '-SECTIONED-' está marcado o GENERATION_MODE=sections; si no, 'single'."""
+    if values.get('-SECTIONED-'):
+        return 'sections'
+    return 'sections' if os.getenv("GENERATION_MODE", "single").lower() == 'sections' else 'single'
+
+
+def _student_block(student_data: dict) -> str:
+    return (
+        f"Nombre: {student_data['nombre']}\n"
+        f"C.I.: {student_data['ci']}\n"
+        f"Materia: {student_data['materia']}\n"
+        f"Sección: {student_data['seccion']}\n"
+        f"Universidad: {student_data['universidad']}\n"
+        f"Carrera: {student_data['carrera']}\n"
+        f"Evaluación: Evaluación N° {student_data['eval_num']} - Corte {student_data['corte']}\n"
+        f"Fecha: {student_data['fecha']}\n"
+    )
+
+
+def build_outline_prompt(topic: str, instructions: str) -> str:
+    return (
+        "Eres un experto académico. Propón el esquema de un trabajo universitario extenso.\n"
+        f"Tema: {topic}\n"
+        f"Instrucciones: {instructions}\n\n"
+        f"Devuelve SOLO un arreglo JSON de 4 a {MAX_SECTIONS} objetos, sin texto adicional ni markdown, con la forma:\n"
+        '[{"titulo": "Introducción", "puntos": ["...", "..."]}, ...]\n'
+        "Incluye una introducción al principio y una conclusión al final. Títulos sin numeración."
+    )
+
+
+def build_front_prompt(topic: str, student_data: dict) -> str:
+    return (
+        "Genera SOLO el preámbulo y la portada de un documento LaTeX universitario (compila con pdflatex).\n"
+        "REQUISITOS:\n"
+        "1. Sin bloques markdown. Usa paquetes estándar; para el español \\usepackage[spanish]{babel}.\n"
+        "2. Incluye \\documentclass, el preámbulo, \\begin{document} y una portada profesional seguida de \\clearpage.\n"
+        "3. La portada lleva el logo con el marcador %%PROJECT_LOGO_PATH%% (tamaño 4cm).\n"
+        "4. NO escribas el contenido del trabajo, ni \\maketitle, ni índices, ni \\end{document}.\n\n"
+        f"Tema: {topic}\n"
+        "--- DATOS DEL ESTUDIANTE ---\n"
+        f"{_student_block(student_data)}"
+    )
+
+
+def build_section_prompt(topic: str, instructions: str, outline: list, index: int, packages: str = None) -> str:
+    """Prompt de la sección index del esquema. Con packages (el preámbulo fijo de la plantilla) se
+    limita el modelo a esos paquetes."""
+    section = outline[index]
+    titles = "\n".join(f"- {s['titulo']}" for s in outline)
+    points = "\n".join(f"- {p}" for p in section.get('puntos', []))
+    return (
+        f"Estás escribiendo una sección de un trabajo universitario en LaTeX sobre: {topic}\n"
+        f"Instrucciones generales: {instructions}\n\n"
+        f"Esquema completo del trabajo:\n{titles}\n\n"
+        f"Escribe ÚNICAMENTE la sección \"{section['titulo']}\", empezando por \\section*{{{section['titulo']}}}.\n"
+        f"Puntos a desarrollar:\n{points}\n\n"
+        "REQUISITOS: sin bloques markdown, sin \\documentclass, preámbulo, \\begin{document} ni \\end{document}. "
+        "Contenido extenso y detallado, con negritas, listas y, si es relevante, una tabla simple. "
+        "Subtítulos sin numerar (\\subsection*). No repitas lo que corresponde a otras secciones."
+        + (f"\nYa están cargados estos paquetes: {packages}. No uses comandos de otros paquetes." if packages else "")
+    )
+
+
+def parse_outline(text: str) -> list:
+    """Lista de secciones {'titulo', 'puntos'} a partir de la respuesta del esquema.
+
+    Acepta el JSON pedido y, si el modelo no lo respeta, una lista de títulos con viñetas o números."""
+    text, _ = strip_fences(text or "")
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            outline = []
+            for item in data:
+                if isinstance(item, str):
+                    item = {'titulo': item}
+                title = str(item.get('titulo') or item.get('title') or '').strip()
+                if title:
+                    points = item.get('puntos') or item.get('points') or []
+                    outline.append({'titulo': title, 'puntos': [str(p) for p in points]})
+            if outline:
+                return outline[:MAX_SECTIONS]
+        except (ValueError, AttributeError):
+            pass
+
+    outline = []
+    for line in text.splitlines():
+        m = re.match(r"^\s*(?:[-*•]|\d+[.)])\s+(.+)$", line)
+        if m:
+            outline.append({'titulo': m.group(1).strip().strip('*'), 'puntos': []})
+    return outline[:MAX_SECTIONS]
+
+
+def _front_matter(text: str) -> str:
+    """Preámbulo y portada hasta antes de \\end{document}."""
+    text, _ = strip_fences(text)
+    end = text.find("\\end{document}")
+    if end != -1:
+        text = text[:end]
+    if "\\begin{document}" not in text:
+        text += "\n\\begin{document}\n"
+    return text.rstrip() + "\n"
+
+
+def _section_body(text: str) -> str:
+    """Cuerpo de una sección, sin preámbulo ni \\begin/\\end{document} si el modelo los añadió."""
+    text, _ = strip_fences(text)
+    begin = text.find("\\begin{document}")
+    if begin != -1:
+        text = text[begin + len("\\begin{document}"):]
+    end = text.find("\\end{document}")
+    if end != -1:
+        text = text[:end]
+    return text.strip() + "\n"
+
+
+def generate_sectioned(provider, topic: str, instructions: str, student_data: dict, options: dict = None,
+                       workers: int = None, front: str = None, packages: str = None) -> str:
+    """Genera el documento en dos fases: un esquema corto y luego la portada y cada sección en
+    paralelo (hasta `workers` llamadas simultáneas, SECTION_WORKERS por defecto).
+
+    El tiempo total se acerca al de la sección más lenta y ninguna respuesta individual es lo
+    bastante larga como para cortarse en el límite de salida del proveedor. Si se pasa front
+    (preámbulo y portada ya renderizados), no se piden al proveedor; packages son entonces los
+    paquetes que ese preámbulo carga. Si el esquema no se puede interpretar se lanza ValueError."""
+    workers = workers or SECTION_WORKERS
+    outline = parse_outline(provider.generate(build_outline_prompt(topic, instructions), options))
+    if not outline:
+        raise ValueError("El proveedor no devolvió un esquema válido")
+    logging.info(f"Esquema con {len(outline)} secciones; generando en paralelo ({workers} a la vez)")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        if front is None:
+            front_future = executor.submit(provider.generate, build_front_prompt(topic, student_data), options)
+        sections = [
+            executor.submit(provider.generate, build_section_prompt(topic, instructions, outline, i, packages), options)
+            for i in range(len(outline))
+        ]
+        parts = [front if front is not None else _front_matter(front_future.result())]
+        parts += [_section_body(future.result()) for future in sections]
+
+    parts.append("\\end{document}\n")
+    return "\n".join(parts)
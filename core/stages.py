@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+STAGE_DIR = os.path.join(".cache", "stages")
+
+# Cambiarlo invalida todos los artefactos guardados (p. ej. si cambia el formato de una etapa)
+STAGE_VERSION = 1
+
+
+def stage_cache_enabled() -> bool:
+    return os.getenv("STAGE_CACHE", "on").lower() not in ("off", "false", "0", "no")
+
+
+def input_key(stage: str, inputs: dict) -> str:
+    """Hash de las entradas de una etapa: dos ejecuciones con las mismas entradas comparten artefacto."""
+    payload = json.dumps({'stage': stage, 'version': STAGE_VERSION, 'inputs': inputs},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class StageStore:
+    """Artefactos persistidos de las etapas del pipeline, direccionados por el hash de sus entradas.
+
+    Cada artefacto es <directory>/<etapa>/<hash>.json y se escribe de forma atómica en cuanto la
+    etapa termina, así que un trabajo interrumpido o repetido con las mismas entradas retoma
+    desde la última etapa completada. Las entradas de más de max_age segundos se descartan."""
+
+    def __init__(self, directory: str = STAGE_DIR, max_age: float = 30 * 24 * 3600):
+        self.directory = directory
+        self.max_age = max_age
+        self._swept = False
+        self._lock = threading.Lock()
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.directory, stage, f"{key}.json")
+
+    def load(self, stage: str, key: str):
+        """Salida guardada de la etapa para key, o None."""
+        path = self._path(stage, key)
+        try:
+            if self.max_age and time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)['output']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, stage: str, key: str, output):
+        directory = os.path.join(self.directory, stage)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'stage': stage, 'created': time.time(), 'output': output}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(stage, key))
+        except OSError as e:
+            logging.warning(f"No se pudo guardar el artefacto de la etapa {stage}: {e}")
+        self._sweep()
+
+    def run(self, stage: str, inputs: dict, compute, reuse: bool = True, valid=None):
+        """Devuelve (salida, reutilizada): la guardada para inputs si existe (y valid(salida) lo
+        acepta) o la de compute(), que se guarda. Con reuse=False siempre se recalcula."""
+        key = input_key(stage, inputs)
+        if reuse:
+            output = self.load(stage, key)
+            if output is not None and (valid is None or valid(output)):
+                logging.info(f"Etapa {stage}: entradas sin cambios, se reutiliza el resultado anterior")
+                return output, True
+        output = compute()
+        self.save(stage, key, output)
+        return output, False
+
+    def _sweep(self):
+        """Borra una vez por proceso los artefactos caducados."""
+        with self._lock:
+            if self._swept or not self.max_age:
+                return
+            self._swept = True
+        cutoff = time.time() - self.max_age
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_stage_store() -> StageStore:
+    """Almacén compartido del proceso, configurado desde el .env (STAGE_CACHE_*)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StageStore(
+                directory=os.getenv("STAGE_CACHE_DIR", STAGE_DIR),
+                max_age=float(os.getenv("STAGE_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+            )
+        return _store
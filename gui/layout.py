@@ -35,7 +35,12 @@ def create_main_window():
          sg.Combo(['OpenRouter', 'Google Gemini', 'OpenAI / Custom'], key='-API-PROVIDER-', default_value='OpenRouter', readonly=True)],
         
         [sg.Checkbox('Desea añadir imágenes?', key='-ADD_IMAGES-', default=True, font=font_settings)],
-        [sg.Button('Generar', font=font_settings), sg.Button('Salir', font=font_settings)]
+        [sg.Checkbox('Forzar regeneración (ignorar caché)', key='-FORCE-REFRESH-', default=False, font=font_settings)],
+        [sg.Checkbox('Generar por secciones en paralelo (documentos largos)', key='-SECTIONED-', default=False, font=font_settings)],
+        [sg.ProgressBar(100, orientation='h', size=(30, 15), key='-PROGRESS-')],
+        [sg.Text('', key='-STATUS-', size=(45, 1), font=font_settings)],
+        [sg.Button('Generar', font=font_settings), sg.Button('Cancelar', font=font_settings),
+         sg.Button('Salir', font=font_settings)]
     ]
     
     window = sg.Window('Generador de Tareas Universitarias',
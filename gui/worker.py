@@ -0,0 +1,103 @@
+import itertools
+import logging
+import queue
+import threading
+from core.jobs import CancelToken, JobCancelled
+from core.pipeline import run_pipeline, CompilationError
+
+# Eventos que el worker envía a la ventana mediante window.write_event_value
+EVENT_PROGRESS = '-JOB-PROGRESS-'   # (job_id, stage)
+EVENT_DONE = '-JOB-DONE-'           # (job_id, result)
+EVENT_ERROR = '-JOB-ERROR-'         # (job_id, tipo, mensaje) con tipo 'compile' | 'general' | 'cancelled'
+
+
+class GenerationWorker:
+    """Ejecuta los trabajos de generación en un hilo de fondo, uno tras otro.
+
+    La ventana sigue atendiendo eventos mientras tanto: el worker solo se comunica con ella
+    mediante write_event_value, que es seguro desde otros hilos."""
+
+    def __init__(self, window):
+        self.window = window
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._current = None  # (job_id, CancelToken) del trabajo en ejecución
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, values) -> int:
+        """Encola un trabajo con una copia de los valores de la ventana y devuelve su id."""
+        job_id = next(self._ids)
+        self._queue.put((job_id, dict(values)))
+        logging.info(f"Trabajo {job_id} encolado ({self.pending()} en cola)")
+        return job_id
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def busy(self) -> bool:
+        return self._current is not None
+
+    def cancel_current(self):
+        """Cancela el trabajo en ejecución (aborta la petición HTTP o mata pdflatex)."""
+        with self._lock:
+            if self._current is not None:
+                logging.info(f"Cancelando trabajo {self._current[0]}")
+                self._current[1].cancel()
+
+    def cancel_all(self, notify: bool = True):
+        """Cancela el trabajo en ejecución y descarta los que esperan en la cola."""
+        while True:
+            try:
+                job_id, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if notify:
+                self._post(EVENT_ERROR, (job_id, 'cancelled', "Trabajo cancelado"))
+        self.cancel_current()
+
+    def stop(self):
+        """Detiene el worker al cerrar la ventana (sin enviarle más eventos)."""
+        self._stopped = True
+        self.cancel_all(notify=False)
+        self._queue.put(None)
+
+    def _post(self, event, value):
+        if self._stopped:
+            return
+        try:
+            self.window.write_event_value(event, value)
+        except Exception as e:
+            logging.debug(f"No se pudo enviar el evento {event} a la ventana: {e}")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job_id, values = item
+            token = CancelToken()
+            with self._lock:
+                self._current = (job_id, token)
+            try:
+                result = run_pipeline(
+                    values,
+                    progress=lambda stage, job_id=job_id: self._post(EVENT_PROGRESS, (job_id, stage)),
+                    cancel_token=token,
+                )
+                self._post(EVENT_DONE, (job_id, result))
+            except JobCancelled as e:
+                logging.info(f"Trabajo {job_id} cancelado")
+                self._post(EVENT_ERROR, (job_id, 'cancelled', str(e)))
+            except CompilationError as e:
+                logging.error(f"Error al compilar LaTeX: {str(e)}")
+                self._post(EVENT_ERROR, (job_id, 'compile', str(e)))
+            except Exception as e:
+                logging.error(f"Error al generar tarea: {str(e)}")
+                self._post(EVENT_ERROR, (job_id, 'general', str(e)))
+            finally:
+                with self._lock:
+                    self._current = None
@@ -1,30 +1,71 @@
-import logging
 import os
-from dotenv import load_dotenv
+import sys
+import time
+
+_STARTED = time.perf_counter()
+
+from config.settings import load_settings
+
+load_settings()
+
+# Solo la GUI y el pipeline ligero: los clientes de los proveedores y el buscador de imágenes
+# se importan con el primer trabajo que los usa
 import FreeSimpleGUI as sg
-from api.openrouter import generate_content
 from utils.logger import setup_logger
-from utils.validators import validate_ci, validate_section
 from gui.layout import create_main_window
-from gui.handlers import handle_generate_event, handle_exit_event
+from gui.handlers import handle_generate_event, handle_cancel_event, handle_job_event, handle_exit_event
+from gui.worker import GenerationWorker, EVENT_PROGRESS, EVENT_DONE, EVENT_ERROR
 
-load_dotenv()
 setup_logger()
 
 def main():
     window = create_main_window()
-    
+    # Generation runs in a background thread so the window stays responsive
+    worker = GenerationWorker(window)
+
     while True:
         event, values = window.read()
-        
+
         if event == sg.WIN_CLOSED or event == 'Salir':
-            handle_exit_event(window)
+            handle_exit_event(window, worker)
             break
-            
+
         if event == 'Generar':
-            handle_generate_event(window, values)
-            
+            handle_generate_event(window, values, worker)
+
+        elif event == 'Cancelar':
+            handle_cancel_event(window, worker)
+
+        elif event in (EVENT_PROGRESS, EVENT_DONE, EVENT_ERROR):
+            handle_job_event(window, event, values, worker)
+
+    window.close()
+
+def profile_startup():
+    """--profile-startup: tiempo de importación por módulo al arrancar y con el primer trabajo,
+    y tiempo hasta que la ventana está dibujada. No inicia ninguna generación."""
+    from utils.startup_profile import import_times, print_import_times, DEFERRED_MODULES
+
+    imports_done = time.perf_counter()
+    window = create_main_window()
+    window.read(timeout=0)
+    window_ready = time.perf_counter()
     window.close()
 
+    here = os.path.dirname(os.path.abspath(__file__))
+    startup = import_times("import main", cwd=here)
+    print_import_times("Arranque (import main)", startup)
+
+    # Lo que paga el primer trabajo: los módulos diferidos, importados después de main
+    entries = import_times("import main\n" + "\n".join(f"import {m}" for m in DEFERRED_MODULES), cwd=here)
+    deferred = entries[next((i + 1 for i, e in enumerate(entries) if e[0] == 'main' and e[3] == 0), 0):]
+    print_import_times("Primer trabajo (" + ", ".join(DEFERRED_MODULES) + ")", deferred)
+
+    print(f"\nImports de main.py en este proceso: {(imports_done - _STARTED) * 1000:.0f} ms")
+    print(f"Hasta la ventana: {(window_ready - _STARTED) * 1000:.0f} ms")
+
 if __name__ == "__main__":
-    main()
+    if '--profile-startup' in sys.argv:
+        profile_startup()
+    else:
+        main()
@@ -0,0 +1,448 @@
+"""Servicio HTTP local para que toda una clase genere sus tareas desde una sola máquina.
+
+Uso:
+    python server.py --port 8080 --workers 16
+
+Rutas:
+    POST   /jobs              crea un trabajo; responde 202 con su id y sus URLs
+    GET    /jobs/<id>         estado del trabajo (JSON)
+    GET    /jobs/<id>/events  estado en vivo como server-sent events
+    GET    /jobs/<id>/pdf     el PDF terminado
+    DELETE /jobs/<id>         cancela el trabajo
+    GET    /health            trabajos en curso y en cola
+
+El cuerpo de POST /jobs es JSON o un formulario con las columnas del roster de batch.py (topic,
+instructions, subject, nombre, ci, turno, trimester, section, eval_num, corte, provider, add_images)
+más force_refresh y sectioned; también se aceptan las claves de la ventana ('-TOPIC-', ...).
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, urlsplit
+from config.settings import load_settings
+from api.providers import PROVIDER_FACTORIES
+from api.ratelimit import PRIORITY_INTERACTIVE
+from batch import ROSTER_FIELDS, TRUE_VALUES, row_to_values
+from core.compiler import CompilationError, compile_workers
+from core.jobs import CancelToken, JobCancelled
+from core.metrics import JobMetrics
+from core.pipeline import run_pipeline, STAGES, OUTPUT_DIR, IMAGE_DIR
+from utils.logger import setup_logger
+from utils.validators import collect_input_errors
+
+load_settings()
+
+# Trabajos ejecutándose a la vez: casi todo el tiempo esperan al proveedor, así que pueden ser
+# muchos más que núcleos; pdflatex queda acotado aparte por COMPILE_WORKERS (core.compiler)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "16"))
+# Trabajos sin terminar (en curso + en cola) antes de responder 503
+SERVER_MAX_JOBS = int(os.getenv("SERVER_MAX_JOBS", "200"))
+# Segundos que se recuerda un trabajo terminado (su PDF sigue en generated_docs)
+SERVER_JOB_TTL = float(os.getenv("SERVER_JOB_TTL", "3600"))
+
+MAX_BODY = 64 * 1024
+READ_TIMEOUT = 15
+SSE_KEEPALIVE = 15
+CHUNK_SIZE = 64 * 1024
+
+# Claves de la ventana que no son columnas del roster -> columna equivalente
+WINDOW_FIELDS = {key: column for column, key in ROSTER_FIELDS.items()}
+WINDOW_FIELDS.update({'-ADD_IMAGES-': 'add_images', '-FORCE-REFRESH-': 'force_refresh',
+                      '-SECTIONED-': 'sectioned'})
+
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def payload_to_values(payload: dict) -> dict:
+    """Convierte el cuerpo de POST /jobs al diccionario `values` de la ventana."""
+    payload = {key: value[-1] if isinstance(value, list) and value else value  # parse_qs da listas
+               for key, value in payload.items()}
+    row = {WINDOW_FIELDS.get(key, str(key).strip().lower()): value for key, value in payload.items()
+           if key not in ('-MORNING-', '-NIGHT-')}
+    if '-NIGHT-' in payload and not row.get('turno'):
+        row['turno'] = 'DCN' if str(payload['-NIGHT-']).strip().lower() in TRUE_VALUES else 'DCM'
+
+    provider = str(row.get('provider') or '').strip()
+    if provider and provider not in PROVIDER_FACTORIES:
+        raise HTTPError(400, f"Proveedor desconocido: {provider}")
+    # La prioridad la fija el servidor: un cliente no puede adelantarse en la cola de api.ratelimit
+    row.pop('priority', None)
+    values = row_to_values(row, 'OpenRouter', True)
+    # A diferencia de los lotes, aquí hay un estudiante esperando
+    values['-PRIORITY-'] = PRIORITY_INTERACTIVE
+    for column, key in (('force_refresh', '-FORCE-REFRESH-'), ('sectioned', '-SECTIONED-')):
+        values[key] = str(row.get(column) or '').strip().lower() in TRUE_VALUES
+    return values
+
+
+class Job:
+    """Estado de un trabajo del servidor. Solo se modifica desde el hilo del event loop."""
+
+    def __init__(self, job_id: str, values: dict):
+        self.id = job_id
+        self.values = values
+        self.token = CancelToken()
+        self.status = 'queued'  # queued | running | done | error | cancelled
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.error_type = None
+        self.created = time.time()
+        self.finished = None
+        self._subscribers = set()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ('queued', 'running')
+
+    def as_dict(self) -> dict:
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': STAGES.get(self.stage, 0),
+            'nombre': self.values.get('-NOMBRE-'),
+            'topic': self.values.get('-TOPIC-'),
+            'created': self.created,
+        }
+        if self.finished is not None:
+            data['seconds'] = round(self.finished - self.created, 2)
+        if self.result is not None:
+            data.update(pdf=f"/jobs/{self.id}/pdf", filename=os.path.basename(self.result['pdf']),
+                        reused=self.result.get('reused', False), repairs=self.result.get('repairs', 0),
+                        lint_fixes=len(self.result.get('lint') or []))
+        if self.error is not None:
+            data.update(error=self.error, error_type=self.error_type)
+        return data
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if not self.active and self.finished is None:
+            self.finished = time.time()
+        snapshot = self.as_dict()
+        for queue in self._subscribers:
+            queue.put_nowait(snapshot)
+
+    def advance(self, stage: str):
+        """Progreso notificado por run_pipeline; se ignora si el trabajo ya terminó."""
+        if self.active:
+            self.update(status='running', stage=stage)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+
+class GenerationService:
+    """Cola de trabajos del servidor sobre run_pipeline.
+
+    Cada trabajo corre en un pool de workers hilos; el event loop solo atiende HTTP y reenvía el
+    progreso a los clientes conectados, así que nunca se bloquea esperando al proveedor o a pdflatex."""
+
+    def __init__(self, workers: int = SERVER_WORKERS, max_jobs: int = SERVER_MAX_JOBS,
+                 output_dir: str = OUTPUT_DIR, image_dir: str = IMAGE_DIR, job_ttl: float = SERVER_JOB_TTL):
+        self.workers = max(1, workers)
+        self.max_jobs = max_jobs
+        self.output_dir = output_dir
+        self.image_dir = image_dir
+        self.job_ttl = job_ttl
+        self.jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._tasks = set()
+
+    def active_jobs(self) -> list:
+        return [job for job in self.jobs.values() if job.active]
+
+    def submit(self, values: dict) -> Job:
+        errors = collect_input_errors(values)
+        if errors:
+            raise HTTPError(400, "; ".join(errors))
+        if len(self.active_jobs()) >= self.max_jobs:
+            raise HTTPError(503, "Demasiados trabajos en cola, inténtelo más tarde", {'Retry-After': '30'})
+        job = Job(uuid.uuid4().hex[:12], values)
+        self.jobs[job.id] = job
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logging.info(f"[servidor {job.id}] Encolado: {values['-NOMBRE-']} - {values['-TOPIC-']}")
+        return job
+
+    def cancel(self, job: Job):
+        if job.active:
+            logging.info(f"[servidor {job.id}] Cancelando")
+            job.token.cancel()
+
+    async def _run(self, job: Job):
+        loop = asyncio.get_running_loop()
+
+        def progress(stage):
+            loop.call_soon_threadsafe(job.advance, stage)
+
+        call = functools.partial(
+            run_pipeline, job.values, output_dir=self.output_dir, image_dir=self.image_dir, job_id=job.id,
+            progress=progress, cancel_token=job.token, metrics=JobMetrics(job.id, server=True),
+        )
+        try:
+            if job.token.cancelled:
+                raise JobCancelled("Trabajo cancelado por el usuario")
+            result = await loop.run_in_executor(self._executor, call)
+        except JobCancelled as e:
+            job.update(status='cancelled', error=str(e), error_type='cancelled')
+        except CompilationError as e:
+            logging.error(f"[servidor {job.id}] Error al compilar LaTeX: {e}")
+            job.update(status='error', error=str(e), error_type='compile')
+        except Exception as e:
+            logging.error(f"[servidor {job.id}] Error: {e}")
+            job.update(status='error', error=str(e), error_type='general')
+        else:
+            job.update(status='done', stage='done', result=result)
+            logging.info(f"[servidor {job.id}] Terminado: {result['pdf']}")
+
+    async def expire(self):
+        """Olvida periódicamente los trabajos terminados hace más de job_ttl segundos."""
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.job_ttl
+            for job_id, job in list(self.jobs.items()):
+                if job.finished is not None and job.finished < cutoff:
+                    del self.jobs[job_id]
+
+    def shutdown(self):
+        for job in self.active_jobs():
+            job.token.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Request:
+    def __init__(self, method: str, path: str, query: dict, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def payload(self) -> dict:
+        content_type = self.headers.get('content-type', '')
+        text = self.body.decode('utf-8', errors='replace')
+        if 'json' in content_type or text.lstrip().startswith('{'):
+            try:
+                data = json.loads(text or '{}')
+            except ValueError as e:
+                raise HTTPError(400, f"JSON inválido: {e}")
+            if not isinstance(data, dict):
+                raise HTTPError(400, "Se esperaba un objeto JSON")
+            return data
+        return parse_qs(text, keep_blank_values=True)
+
+
+async def read_request(reader: asyncio.StreamReader) -> Request:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Conexión cerrada")
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, "Petición mal formada")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+        if len(headers) > 100:
+            raise HTTPError(400, "Demasiadas cabeceras")
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPError(400, "Content-Length inválido")
+    if length > MAX_BODY:
+        raise HTTPError(413, "Cuerpo demasiado grande")
+    body = await reader.readexactly(length) if length else b''
+    url = urlsplit(target)
+    return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+
+def response_head(status: int, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data, headers: dict = None):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    head = {'Content-Type': 'application/json; charset=utf-8', 'Content-Length': len(body),
+            'Connection': 'close'}
+    head.update(headers or {})
+    writer.write(response_head(status, head) + body)
+    await writer.drain()
+
+
+class Server:
+    """Servidor HTTP/1.1 mínimo sobre asyncio (una petición por conexión) delante de GenerationService."""
+
+    ROUTE = re.compile(r"^/jobs/([0-9a-f]+)(?:/(events|pdf))?/?$")
+
+    def __init__(self, service: GenerationService):
+        self.service = service
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await asyncio.wait_for(read_request(reader), READ_TIMEOUT)
+                await self.dispatch(request, writer)
+            except HTTPError as e:
+                await send_json(writer, e.status, {'error': str(e)}, e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logging.error(f"Error atendiendo la petición HTTP: {e}")
+            try:
+                await send_json(writer, 500, {'error': "Error interno del servidor"})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    def _job(self, job_id: str) -> Job:
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            raise HTTPError(404, "Trabajo no encontrado")
+        return job
+
+    async def dispatch(self, request: Request, writer: asyncio.StreamWriter):
+        path, method = request.path, request.method
+        if path == '/health' and method == 'GET':
+            active = self.service.active_jobs()
+            return await send_json(writer, 200, {
+                'status': 'ok',
+                'running': sum(1 for job in active if job.status == 'running'),
+                'queued': sum(1 for job in active if job.status == 'queued'),
+                'workers': self.service.workers,
+                'compile_workers': compile_workers(),
+            })
+        if path.rstrip('/') == '/jobs':
+            if method != 'POST':
+                raise HTTPError(405, "Método no permitido")
+            job = self.service.submit(payload_to_values(request.payload()))
+            return await send_json(writer, 202, dict(job.as_dict(), events=f"/jobs/{job.id}/events"),
+                                   {'Location': f"/jobs/{job.id}"})
+
+        match = self.ROUTE.match(path)
+        if match is None:
+            raise HTTPError(404, "Ruta no encontrada")
+        job, action = self._job(match.group(1)), match.group(2)
+        if action is None and method == 'GET':
+            return await send_json(writer, 200, job.as_dict())
+        if action is None and method == 'DELETE':
+            self.service.cancel(job)
+            return await send_json(writer, 202, job.as_dict())
+        if action == 'events' and method == 'GET':
+            return await self.send_events(job, writer)
+        if action == 'pdf' and method == 'GET':
+            return await self.send_pdf(job, writer)
+        raise HTTPError(405, "Método no permitido")
+
+    async def send_events(self, job: Job, writer: asyncio.StreamWriter):
+        """Envía el estado actual y cada cambio como evento 'status' hasta que el trabajo termina."""
+        writer.write(response_head(200, {'Content-Type': 'text/event-stream; charset=utf-8',
+                                         'Cache-Control': 'no-cache', 'Connection': 'close'}))
+        queue = job.subscribe()
+        try:
+            snapshot = job.as_dict()
+            while True:
+                writer.write(f"event: status\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n".encode('utf-8'))
+                await writer.drain()
+                if snapshot['status'] not in ('queued', 'running'):
+                    break
+                while True:
+                    try:
+                        snapshot = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                        break
+                    except asyncio.TimeoutError:
+                        writer.write(b": ping\n\n")  # Mantiene viva la conexión a través de proxies
+                        await writer.drain()
+        finally:
+            job.unsubscribe(queue)
+
+    async def send_pdf(self, job: Job, writer: asyncio.StreamWriter):
+        if job.status != 'done':
+            raise HTTPError(409, f"El trabajo no ha terminado (estado: {job.status})")
+        path = job.result['pdf']
+        loop = asyncio.get_running_loop()
+        try:
+            f = await loop.run_in_executor(None, open, path, 'rb')
+        except OSError:
+            raise HTTPError(404, "El PDF ya no está disponible")
+        try:
+            size = os.fstat(f.fileno()).st_size
+            name = os.path.basename(path)
+            writer.write(response_head(200, {
+                'Content-Type': 'application/pdf',
+                'Content-Length': size,
+                'Content-Disposition': f"attachment; filename*=UTF-8''{quote(name)}",
+                'Connection': 'close',
+            }))
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            f.close()
+
+
+async def serve(host: str, port: int, workers: int = SERVER_WORKERS, output_dir: str = OUTPUT_DIR):
+    service = GenerationService(workers=workers, output_dir=output_dir)
+    server = await asyncio.start_server(Server(service).handle, host, port)
+    expire = asyncio.get_running_loop().create_task(service.expire())
+    logging.info(f"Servidor escuchando en http://{host}:{port} ({service.workers} trabajos a la vez, "
+                 f"{compile_workers()} compilaciones)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        expire.cancel()
+        service.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP local para generar tareas.")
+    parser.add_argument('--host', default=os.getenv("SERVER_HOST", "127.0.0.1"),
+                        help="Interfaz de escucha (0.0.0.0 para aceptar otras máquinas de la red)")
+    parser.add_argument('--port', type=int, default=int(os.getenv("SERVER_PORT", "8080")))
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="Trabajos ejecutándose a la vez")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    args = parser.parse_args(argv)
+
+    setup_logger()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.output_dir))
+    except KeyboardInterrupt:
+        logging.info("Servidor detenido")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
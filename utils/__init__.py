@@ -1 +1 @@
-from .build_student_data import build_student_data
\ No newline at end of file
+from .build_student_data import build_student_data, build_section_code
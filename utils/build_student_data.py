@@ -1,11 +1,15 @@
 from datetime import datetime
-from gui.handlers import build_section_code  # Asegúrate de que build_section_code esté implementado
+
+def build_section_code(values):
+    """Construye el código de sección DCM/DCN + trimestre + sección"""
+    turno = "DCM" if values['-MORNING-'] else "DCN"
+    return f"{turno}{values['-TRIMESTER-']}{values['-SECTION-']}"
 
 def build_student_data(values):
     """Construye y devuelve un diccionario con los datos del estudiante."""
     student_data = {
         'nombre': values['-NOMBRE-'],
-        'ci': values['-CI-'],
+        'ci': "V-" + values['-CI-'],
         'materia': values['-SUBJECT-'],
         'seccion': build_section_code(values),
         'universidad': "Universidad Alejandro de Humboldt",
@@ -15,4 +19,4 @@ def build_student_data(values):
         'fecha': datetime.now().strftime("%d/%m/%Y"),
         'tema': values['-TOPIC-']
     }
-    return student_data
\ No newline at end of file
+    return student_data
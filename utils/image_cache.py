@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from PIL import Image
+from utils.image_normalize import encode_jpeg
+
+DEFAULT_IMAGE_CACHE_DIR = os.path.join(".cache", "images")
+
+# Distancia de Hamming (sobre 64 bits) por debajo de la cual dos imágenes se consideran la misma
+PHASH_THRESHOLD = 6
+
+
+def normalize_query(query: str) -> str:
+    """Clave estable de una búsqueda: minúsculas, sin acentos ni signos y con las palabras ordenadas."""
+    text = unicodedata.normalize("NFKD", query.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = re.findall(r"[a-z0-9]+", text)
+    return " ".join(sorted(set(words)))
+
+
+def perceptual_hash(image) -> int:
+    """dHash de 64 bits: compara el brillo de píxeles vecinos en una miniatura de 9x8 en grises."""
+    small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ImageCache:
+    """Almacén persistente de imágenes indexado por búsqueda normalizada.
+
+    Cada imagen se guarda una sola vez como <sha256>.jpg (hash del contenido) y el índice
+    (index.json) guarda su dHash, tamaño y último uso. Las imágenes visualmente duplicadas de una
+    misma búsqueda se rechazan. Se desaloja por antigüedad y, después, por LRU hasta max_bytes."""
+
+    def __init__(self, directory: str = DEFAULT_IMAGE_CACHE_DIR, max_bytes: int = 300 * 1024 * 1024,
+                 max_age: float = 90 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _load(self) -> dict:
+        if self._index is None:
+            try:
+                with open(self.index_path, encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("queries", {})
+            self._index.setdefault("images", {})
+        return self._index
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def path_for(self, sha: str) -> str:
+        return os.path.join(self.directory, f"{sha}.jpg")
+
+    def get(self, query: str, limit: int) -> list:
+        """Rutas de hasta `limit` imágenes guardadas para query (sin tocar la red)."""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            index = self._load()
+            paths = []
+            for sha in index["queries"].get(key, []):
+                entry = index["images"].get(sha)
+                path = self.path_for(sha)
+                if entry is None or not os.path.exists(path):
+                    continue
+                entry["last_used"] = now
+                paths.append(path)
+                if len(paths) >= limit:
+                    break
+            if paths:
+                self._save()
+        return paths
+
+    def hashes_for(self, paths: list) -> list:
+        """dHash de imágenes ya guardadas (para deduplicar contra ellas)."""
+        with self._lock:
+            images = self._load()["images"]
+            shas = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+            return [int(images[sha]["phash"], 16) for sha in shas if sha in images]
+
+    def add(self, query: str, image, seen_hashes: list = None):
+        """Guarda image para query y devuelve su ruta, o None si es un duplicado visual.
+
+        seen_hashes acumula los dHash ya aceptados en el trabajo actual."""
+        phash = perceptual_hash(image)
+        seen_hashes = seen_hashes if seen_hashes is not None else []
+        if any(hamming(phash, other) <= PHASH_THRESHOLD for other in seen_hashes):
+            logging.debug("Imagen descartada por ser visualmente duplicada")
+            return None
+
+        data = encode_jpeg(image)
+        sha = hashlib.sha256(data).hexdigest()
+        key = normalize_query(query)
+        now = time.time()
+
+        with self._lock:
+            index = self._load()
+            # Deduplicar también contra lo ya guardado para esta búsqueda
+            for other in index["queries"].get(key, []):
+                entry = index["images"].get(other)
+                if entry and other != sha and hamming(phash, int(entry["phash"], 16)) <= PHASH_THRESHOLD:
+                    logging.debug("Imagen descartada: ya hay una equivalente en caché")
+                    return None
+
+            path = self.path_for(sha)
+            if not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+
+            index["images"][sha] = {
+                "phash": f"{phash:016x}",
+                "size": len(data),
+                "created": index["images"].get(sha, {}).get("created", now),
+                "last_used": now,
+            }
+            shas = index["queries"].setdefault(key, [])
+            if sha not in shas:
+                shas.append(sha)
+            self._evict(now)
+            self._save()
+
+        seen_hashes.append(phash)
+        logging.info(f"Imagen guardada en caché: {path}")
+        return path
+
+    def _evict(self, now: float):
+        images = self._index["images"]
+        doomed = {sha for sha, e in images.items() if self.max_age and now - e["last_used"] > self.max_age}
+        total = sum(e["size"] for sha, e in images.items() if sha not in doomed)
+        if total > self.max_bytes:
+            for sha, entry in sorted(images.items(), key=lambda item: item[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                if sha not in doomed:
+                    doomed.add(sha)
+                    total -= entry["size"]
+
+        if not doomed:
+            return
+        for sha in doomed:
+            images.pop(sha, None)
+            try:
+                os.remove(self.path_for(sha))
+            except OSError:
+                pass
+        for key in list(self._index["queries"]):
+            remaining = [sha for sha in self._index["queries"][key] if sha not in doomed]
+            if remaining:
+                self._index["queries"][key] = remaining
+            else:
+                del self._index["queries"][key]
+        logging.info(f"Caché de imágenes: {len(doomed)} imágenes desalojadas")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Caché de imágenes compartida, o None si IMAGE_CACHE=off."""
+    global _cache
+    if os.getenv("IMAGE_CACHE", "on").lower() in ("off", "false", "0", "no"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache(
+                directory=os.getenv("IMAGE_CACHE_DIR", DEFAULT_IMAGE_CACHE_DIR),
+                max_bytes=int(float(os.getenv("IMAGE_CACHE_MAX_MB", "300")) * 1024 * 1024),
+                max_age=float(os.getenv("IMAGE_CACHE_MAX_AGE_DAYS", "90")) * 24 * 3600,
+            )
+        return _cache
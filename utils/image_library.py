@@ -0,0 +1,284 @@
+"""Biblioteca local de imágenes con licencia, indexada por palabras clave.
+
+Cada imagen de IMAGE_LIBRARY_DIR (.png, .jpg, .jpeg, .pdf) se indexa por su ruta (carpetas y nombre)
+y, si existen, por su ficha: <imagen>.txt (descripción) o <imagen>.json con "caption", "tags" y
+"license". Ejemplo:
+
+    image_library/redes/topologia_estrella.png
+    image_library/redes/topologia_estrella.json   {"caption": "Topología en estrella", "tags": ["redes", "lan"]}
+
+Uso:
+    python -m utils.image_library index            # (re)indexa y muestra el resumen
+    python -m utils.image_library search "redes de computadoras"
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+
+DEFAULT_LIBRARY_DIR = "image_library"
+DEFAULT_INDEX_PATH = os.path.join(".cache", "image_library.json")
+INDEX_VERSION = 1
+
+# Formatos que pdflatex incluye directamente
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.pdf')
+
+# Peso de cada término según de dónde sale
+FIELD_WEIGHTS = {'tags': 3.0, 'caption': 2.0, 'path': 1.0}
+
+STOPWORDS = {
+    'de', 'del', 'la', 'las', 'el', 'los', 'un', 'una', 'unos', 'unas', 'y', 'o', 'en', 'con', 'por',
+    'para', 'sus', 'que', 'como', 'sobre', 'entre', 'sin', 'img', 'image', 'imagen', 'foto',
+    'the', 'and', 'of', 'for', 'with',
+}
+
+
+def stem(word: str) -> str:
+    """Plural y vocal final fuera ('redes' -> 'red', 'clases' -> 'clas'), igual en índice y consulta."""
+    for suffix in ('s', 'e'):
+        if len(word) > 3 and word.endswith(suffix):
+            word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Términos de text: minúsculas, sin acentos ni palabras vacías y con stem()."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", text) if len(word) > 2 and word not in STOPWORDS]
+
+
+def read_metadata(path: str) -> dict:
+    """Ficha de la imagen (<imagen>.json o <imagen>.txt junto a ella) con 'caption', 'tags' y 'license'."""
+    stem_path = os.path.splitext(path)[0]
+    try:
+        with open(stem_path + ".json", encoding="utf-8") as f:
+            data = json.load(f)
+        tags = data.get('tags') or []
+        return {
+            'caption': str(data.get('caption') or ''),
+            'tags': [str(tag) for tag in (tags if isinstance(tags, list) else str(tags).split(','))],
+            'license': str(data.get('license') or ''),
+        }
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError) as e:
+        logging.warning(f"Ficha inválida para {path}: {e}")
+    try:
+        with open(stem_path + ".txt", encoding="utf-8") as f:
+            return {'caption': f.read().strip(), 'tags': [], 'license': ''}
+    except OSError:
+        return {'caption': '', 'tags': [], 'license': ''}
+
+
+def _metadata_mtime(path: str) -> float:
+    stem_path = os.path.splitext(path)[0]
+    return max((os.path.getmtime(stem_path + ext) for ext in ('.json', '.txt') if os.path.exists(stem_path + ext)),
+               default=0.0)
+
+
+class ImageLibrary:
+    """Índice invertido persistente (término -> {imagen: peso}) sobre una carpeta de imágenes.
+
+    El índice vive en index_path y se actualiza de forma incremental: como mucho cada rescan
+    segundos se recorre la carpeta y solo se reindexan las imágenes (o fichas) nuevas o cambiadas.
+    Las búsquedas son consultas al diccionario en memoria, sin tocar las imágenes."""
+
+    def __init__(self, directory: str = DEFAULT_LIBRARY_DIR, index_path: str = DEFAULT_INDEX_PATH,
+                 rescan: float = 300, min_match: float = 0.5):
+        self.directory = directory
+        self.index_path = index_path
+        self.rescan = rescan
+        self.min_match = min_match
+        self._index = None
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._index is None:
+            try:
+                with open(self.index_path, encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            if (self._index.get('version') != INDEX_VERSION
+                    or self._index.get('directory') != os.path.abspath(self.directory)):
+                self._index = {'version': INDEX_VERSION, 'directory': os.path.abspath(self.directory),
+                               'images': {}, 'postings': {}}
+        return self._index
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _terms(self, relpath: str, metadata: dict) -> dict:
+        terms = {}
+        fields = {
+            'path': os.path.splitext(relpath)[0].replace(os.sep, ' ').replace('_', ' ').replace('-', ' '),
+            'caption': metadata['caption'],
+            'tags': " ".join(metadata['tags']),
+        }
+        for field, text in fields.items():
+            for term in tokenize(text):
+                terms[term] = terms.get(term, 0.0) + FIELD_WEIGHTS[field]
+        return terms
+
+    def _remove(self, relpath: str):
+        entry = self._index['images'].pop(relpath, None)
+        for term in (entry or {}).get('terms', {}):
+            postings = self._index['postings'].get(term)
+            if postings is not None:
+                postings.pop(relpath, None)
+                if not postings:
+                    del self._index['postings'][term]
+
+    def refresh(self, force: bool = False) -> int:
+        """Reindexa lo que cambió en la carpeta (como mucho cada rescan s salvo con force).
+
+        Devuelve cuántas imágenes se añadieron, cambiaron o quitaron."""
+        with self._lock:
+            index = self._load()
+            now = time.monotonic()
+            if not force and self._scanned_at is not None and now - self._scanned_at < self.rescan:
+                return 0
+            self._scanned_at = now
+
+            found = {}
+            for root, dirs, files in os.walk(self.directory):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in files:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        found[os.path.relpath(path, self.directory)] = path
+
+            changed = 0
+            for relpath in [r for r in index['images'] if r not in found]:
+                self._remove(relpath)
+                changed += 1
+            for relpath, path in found.items():
+                try:
+                    signature = [os.path.getmtime(path), os.path.getsize(path), _metadata_mtime(path)]
+                except OSError:
+                    continue
+                entry = index['images'].get(relpath)
+                if entry is not None and entry['signature'] == signature:
+                    continue
+                self._remove(relpath)
+                metadata = read_metadata(path)
+                terms = self._terms(relpath, metadata)
+                index['images'][relpath] = {'signature': signature, 'caption': metadata['caption'],
+                                            'license': metadata['license'], 'terms': terms}
+                for term, weight in terms.items():
+                    index['postings'].setdefault(term, {})[relpath] = weight
+                changed += 1
+
+            if changed:
+                self._save()
+                logging.info(f"Biblioteca de imágenes: {changed} cambios, {len(index['images'])} imágenes indexadas")
+            return changed
+
+    def search(self, query: str, limit: int = 3) -> list:
+        """Hasta limit imágenes para query, de más a menos relevante, como dicts con 'path', 'score',
+        'caption' y 'license'.
+
+        Cada término puntúa idf * peso. Una imagen solo cuenta si sus términos cubren al menos
+        min_match del idf total de la consulta (así 'redes informática' no devuelve cualquier imagen
+        que diga 'informática')."""
+        self.refresh()
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            index = self._load()
+            total = len(index['images'])
+            if not terms or not total:
+                return []
+            idf = {term: math.log(1 + total / max(1, len(index['postings'].get(term, {})))) for term in terms}
+            query_weight = sum(idf.values())
+            scores, coverage = {}, {}
+            for term in terms:
+                for relpath, weight in index['postings'].get(term, {}).items():
+                    scores[relpath] = scores.get(relpath, 0.0) + idf[term] * weight
+                    coverage[relpath] = coverage.get(relpath, 0.0) + idf[term]
+            ranked = sorted(
+                (relpath for relpath in scores if coverage[relpath] / query_weight >= self.min_match),
+                key=lambda relpath: (-coverage[relpath], -scores[relpath], relpath),
+            )
+            results = []
+            for relpath in ranked[:limit]:
+                entry = index['images'][relpath]
+                results.append({
+                    'path': os.path.join(self.directory, relpath),
+                    'score': round(scores[relpath], 3),
+                    'caption': entry['caption'],
+                    'license': entry['license'],
+                })
+            return results
+
+    def stats(self) -> dict:
+        self.refresh()
+        with self._lock:
+            index = self._load()
+            return {'directory': self.directory, 'images': len(index['images']), 'terms': len(index['postings'])}
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_image_library():
+    """Biblioteca compartida, o None si IMAGE_LIBRARY=off o su carpeta no existe."""
+    global _library
+    if os.getenv("IMAGE_LIBRARY", "on").lower() in ("off", "false", "0", "no"):
+        return None
+    directory = os.getenv("IMAGE_LIBRARY_DIR", DEFAULT_LIBRARY_DIR)
+    if not os.path.isdir(directory):
+        return None
+    with _library_lock:
+        if _library is None:
+            _library = ImageLibrary(
+                directory=directory,
+                index_path=os.getenv("IMAGE_LIBRARY_INDEX", DEFAULT_INDEX_PATH),
+                rescan=float(os.getenv("IMAGE_LIBRARY_RESCAN", "300")),
+                min_match=float(os.getenv("IMAGE_LIBRARY_MIN_MATCH", "0.5")),
+            )
+        return _library
+
+
+def main(argv=None):
+    from config.settings import load_settings
+    load_settings()
+    parser = argparse.ArgumentParser(description="Biblioteca local de imágenes.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('index', help="Reindexar la carpeta y mostrar el resumen")
+    search = sub.add_parser('search', help="Buscar imágenes para un tema")
+    search.add_argument('query')
+    search.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    library = get_image_library()
+    if library is None:
+        print(f"No hay biblioteca: cree la carpeta {os.getenv('IMAGE_LIBRARY_DIR', DEFAULT_LIBRARY_DIR)} "
+              "o active IMAGE_LIBRARY")
+        return 1
+    if args.command == 'index':
+        library.refresh(force=True)
+        print(json.dumps(library.stats(), ensure_ascii=False, indent=2))
+        return 0
+    start = time.perf_counter()
+    results = library.search(args.query, args.limit)
+    for result in results:
+        print(f"{result['score']:>8}  {result['path']}  {result['caption']}")
+    print(f"{len(results)} resultado(s) en {(time.perf_counter() - start) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+import tempfile
+from io import BytesIO
+from PIL import Image
+
+# Ancho de las figuras de inject_images (fracción de \textwidth) y \textwidth de templates/preamble.tex
+# (carta con márgenes de 2.5 cm) en pulgadas: con IMAGE_DPI dan los píxeles que se imprimen
+FIGURE_WIDTH = 0.75
+TEXT_WIDTH_IN = 6.5
+
+IMAGE_DPI = int(os.getenv("IMAGE_DPI", "150"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+# Descargas más grandes se descartan sin terminar de bajarlas
+IMAGE_MAX_BYTES = int(float(os.getenv("IMAGE_MAX_MB", "8")) * 1024 * 1024)
+MIN_SIZE = 50
+CHUNK_SIZE = 64 * 1024
+
+
+def normalize_enabled() -> bool:
+    return os.getenv("IMAGE_NORMALIZE", "on").lower() not in ("off", "false", "0", "no")
+
+
+def target_width() -> int:
+    """Píxeles de ancho con los que la figura sale a IMAGE_DPI en el PDF."""
+    return round(TEXT_WIDTH_IN * FIGURE_WIDTH * IMAGE_DPI)
+
+
+def stream_to_file(response, f, max_bytes: int = None) -> bool:
+    """Vuelca una respuesta de requests (stream=True) en el archivo f por bloques, sin tenerla entera
+    en memoria. False si supera max_bytes (IMAGE_MAX_MB por defecto)."""
+    max_bytes = IMAGE_MAX_BYTES if max_bytes is None else max_bytes
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        return False
+    written = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        written += len(chunk)
+        if written > max_bytes:
+            return False
+        f.write(chunk)
+    return written > 0
+
+
+def _flatten(image):
+    """RGB sobre fondo blanco: las transparencias no salen negras al pasar a JPEG."""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+def load_image(source, normalize: bool = None):
+    """Abre source (ruta o archivo) y devuelve la imagen RGB lista para el documento, o None si no
+    sirve (no es imagen o mide menos de MIN_SIZE px).
+
+    Con normalize (IMAGE_NORMALIZE por defecto) los JPEG se decodifican ya reducidos (modo draft,
+    escalado en la DCT, sin pasar por la resolución completa) y todo se reduce a target_width()."""
+    normalize = normalize_enabled() if normalize is None else normalize
+    image = Image.open(source)
+    width, height = image.size
+    if width < MIN_SIZE or height < MIN_SIZE:
+        return None
+    target = target_width()
+    if normalize and width > target:
+        if image.format == "JPEG":
+            image.draft("RGB", (target, max(1, round(height * target / width))))
+        image = _flatten(image)
+        if image.width > target:
+            size = (target, max(1, round(image.height * target / image.width)))
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        return image
+    return _flatten(image)
+
+
+def encode_jpeg(image, quality: int = None) -> bytes:
+    """JPEG base optimizado y sin metadatos (EXIF, perfil ICC, comentarios): solo los píxeles."""
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality or IMAGE_QUALITY, optimize=True, subsampling="4:2:0")
+    return buffer.getvalue()
+
+
+def normalized_copy(path: str, cache_dir: str) -> str:
+    """Versión reducida y sin metadatos de una imagen local (p. ej. de la biblioteca), guardada en
+    cache_dir por ruta, fecha, tamaño y ajustes. Devuelve path tal cual si ya es pequeña, es un PDF o
+    no se puede leer.
+
+    Los PNG siguen siendo PNG (diagramas y capturas pierden nitidez en JPEG)."""
+    if path.lower().endswith(".pdf"):
+        return path
+    try:
+        stat = os.stat(path)
+        target = target_width()
+        key = f"{os.path.abspath(path)}|{stat.st_mtime}|{stat.st_size}|{target}|{IMAGE_QUALITY}"
+        is_png = path.lower().endswith(".png")
+        output = os.path.join(cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+                              + (".png" if is_png else ".jpg"))
+        if os.path.exists(output):
+            return output
+        with Image.open(path) as original:
+            if original.width <= target and stat.st_size <= 512 * 1024:
+                return path
+        image = load_image(path, normalize=True)
+        if image is None:
+            return path
+        if is_png:
+            buffer = BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+            data = buffer.getvalue()
+        else:
+            data = encode_jpeg(image)
+        if len(data) >= stat.st_size:
+            return path
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, output)
+        logging.debug(f"Imagen reducida {path}: {stat.st_size // 1024} KB -> {len(data) // 1024} KB")
+        return output
+    except Exception as e:
+        logging.debug(f"No se pudo reducir {path}: {e}")
+        return path
@@ -1,108 +1,255 @@
 import os
+import re
 import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from PIL import Image
-from io import BytesIO
-import random
-import time
+from config.settings import load_settings
+from utils.image_cache import get_image_cache, perceptual_hash, hamming, PHASH_THRESHOLD
+from utils.image_normalize import load_image, encode_jpeg, stream_to_file
+
+load_settings()
+
+# Headers para simular navegador real
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# Plazo total de download_images y timeouts (connect, read) de cada petición, en segundos
+IMAGE_DEADLINE = float(os.getenv("IMAGE_DEADLINE", "3"))
+SEARCH_TIMEOUT = (2, 3)
+DOWNLOAD_TIMEOUT = (1.5, 2)
+MAX_WORKERS = 8
+
+# Un buscador que falla queda descartado durante este tiempo
+BACKEND_COOLDOWN = 300
+
+_session = None
+_session_lock = threading.Lock()
+_dead_backends = {}
+
+
+def get_session() -> requests.Session:
+    """Sesión HTTP compartida (keep-alive) para búsquedas y descargas."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS * 2)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def search_google(query: str, session: requests.Session) -> list:
+    """Miniaturas (gstatic) de la búsqueda de imágenes de Google."""
+    response = session.get(
+        "https://www.google.com/search",
+        params={"q": query, "tbm": "isch"},
+        timeout=SEARCH_TIMEOUT,
+    )
+    response.raise_for_status()
+
+    # The raw Google HTML for images is messy. It usually hides images in Base64 or separate JSON.
+    # Simplistic approach: look for 'img' tags whose src is a gstatic thumbnail, not the logo.
+    soup = BeautifulSoup(response.text, "html.parser")
+    urls = []
+    for img in soup.find_all("img"):
+        src = img.get('src') or img.get('data-src')
+        # gstatic is usually the thumbnails; 'google' in src usually indicates the main logo
+        if src and src.startswith('http') and 'google' not in src and 'gstatic' in src:
+            urls.append(src)
+    return urls
+
+
+def search_duckduckgo(query: str, session: requests.Session) -> list:
+    """Miniaturas de la API JSON de imágenes de DuckDuckGo (requiere el token vqd de la página)."""
+    response = session.get(
+        "https://duckduckgo.com/",
+        params={"q": query, "iax": "images", "ia": "images"},
+        timeout=SEARCH_TIMEOUT,
+    )
+    response.raise_for_status()
+    match = re.search(r'vqd=["\']?([\d-]+)', response.text)
+    if not match:
+        return []
+
+    response = session.get(
+        "https://duckduckgo.com/i.js",
+        params={"q": query, "o": "json", "vqd": match.group(1), "l": "wt-wt", "p": "1"},
+        headers={"Referer": "https://duckduckgo.com/"},
+        timeout=SEARCH_TIMEOUT,
+    )
+    response.raise_for_status()
+    return [item["thumbnail"] for item in response.json().get("results", []) if item.get("thumbnail")]
+
+
+# Buscadores consultados en paralelo: nombre -> función(query, session) -> lista de URLs
+SEARCH_BACKENDS = {
+    'google': search_google,
+    'duckduckgo': search_duckduckgo,
+}
+
+
+def _backend_alive(name: str) -> bool:
+    return _dead_backends.get(name, 0) <= time.monotonic()
+
 
-def download_images(query: str, output_dir: str, limit: int = 3) -> list:
+def _mark_dead(name: str, error):
+    logging.warning(f"Buscador de imágenes '{name}' descartado durante {BACKEND_COOLDOWN} s: {error}")
+    _dead_backends[name] = time.monotonic() + BACKEND_COOLDOWN
+
+
+def _timed(func, *args):
+    """Ejecuta func(*args) y devuelve (resultado, segundos); las excepciones se devuelven como resultado."""
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+def download_images(query: str, output_dir: str, limit: int = 3, deadline: float = None, metrics=None) -> list:
     """
-    Descarga imágenes relevantes usando DuckDuckGo (versión html/lite) para evitar bloqueos de Google.
+    Busca y descarga hasta `limit` imágenes para query, en paralelo y con plazo total acotado.
+
+    Los buscadores se consultan a la vez; cada URL candidata se descarga en un pool de hilos con
+    la sesión compartida. Se devuelve en cuanto hay `limit` imágenes válidas o vence el plazo
+    (IMAGE_DEADLINE por defecto), aunque queden descargas lentas en curso.
+
+    Con la caché de imágenes activa (utils.image_cache), las búsquedas repetidas se sirven desde
+    disco sin tocar la red y las imágenes nuevas se guardan en ella en lugar de en output_dir.
+    Las imágenes visualmente duplicadas se descartan en ambos casos.
+
+    Con metrics (core.metrics.JobMetrics) se registra cada búsqueda ('image_search') y cada
+    descarga ('image_download') que termine antes del plazo.
     """
-    try:
+    deadline = IMAGE_DEADLINE if deadline is None else deadline
+    end = time.monotonic() + deadline
+    cache = get_image_cache()
+    image_paths = []
+    seen_hashes = []
+
+    if cache is not None:
+        image_paths = cache.get(query, limit)
+        if len(image_paths) >= limit:
+            logging.info(f"Imágenes servidas desde caché para: {query}")
+            if metrics is not None:
+                metrics.set(image_cache_hit=True)
+            return image_paths
+        seen_hashes = cache.hashes_for(image_paths)
+    else:
         os.makedirs(output_dir, exist_ok=True)
-        image_paths = []
-        
-        logging.info(f"Buscando imágenes para: {query}")
-        
-        # Headers para simular navegador real
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+    session = get_session()
+    seen = set()
+
+    logging.info(f"Buscando imágenes para: {query}")
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        searches = {
+            executor.submit(_timed, search, query, session): name
+            for name, search in SEARCH_BACKENDS.items()
+            if _backend_alive(name)
         }
-        
-        # Usamos DuckDuckGo HTML que es más fácil de scrapear sin JS
-        url = f"https://duckduckgo.com/html/?q={query}"
-        
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, "html.parser")
-        
-        # DuckDuckGo images in HTML mode are usually in 'a.result__a' or similar. 
-        # Actually standard HTML DDG disables images sometimes. 
-        # Let's try a robust Google selector fallback if we stick to Google, 
-        # but the previous error was fetching the google logo.
-        
-        # New Google Logic:
-        # Search URL
-        google_url = f"https://www.google.com/search?q={query}&tbm=isch&udm=2" # udm=2 forces "Web" but tbm=isch is images.
-        # Adding 'gl=us' or 'hl=es' might help.
-        
-        response = requests.get(google_url, headers=headers)
-        
-        # The raw Google HTML for images is messy. It usually hides images in Base64 or separate JSON.
-        # Fallback simplistic approach: Look for 'img' tags that have 'src' starting with http 
-        # and are NOT the logo.
-        
-        soup = BeautifulSoup(response.text, "html.parser")
-        img_tags = soup.find_all("img")
-        
-        count = 0
-        for img in img_tags:
-            if count >= limit:
+        pending = set(searches)
+
+        while pending and len(image_paths) < limit:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                logging.warning(f"Plazo de imágenes agotado ({deadline} s)")
                 break
-                
-            src = img.get('src')
-            if not src:
-                src = img.get('data-src')
-                
-            if src and src.startswith('http') and 'google' not in src and 'gstatic' in src: 
-                # gstatic is usually the thumbnails.
-                # 'google' in src usually indicates the main logo (www.google.com/...)
-                
-                try:
-                    # Download
-                    desc = f"{query}_{count}"
-                    path = download_image(src, output_dir, desc)
-                    if path:
-                        image_paths.append(path)
-                        count += 1
-                except Exception:
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future in searches:
+                    name = searches[future]
+                    urls, seconds = future.result()
+                    if metrics is not None:
+                        metrics.add('image_search', seconds, backend=name, ok=not isinstance(urls, Exception))
+                    if isinstance(urls, Exception):
+                        _mark_dead(name, urls)
+                        continue
+                    logging.debug(f"'{name}' devolvió {len(urls)} candidatas")
+                    for url in urls:
+                        if url not in seen:
+                            seen.add(url)
+                            pending.add(executor.submit(_timed, fetch_image, url, session))
                     continue
 
-        if not image_paths:
-             logging.warning("No se encontraron imágenes en el primer intento.")
-        
-        return image_paths
-    
-    except Exception as e:
-        logging.error(f"Error al descargar imágenes: {str(e)}")
-        return []
+                image, seconds = future.result()
+                if metrics is not None:
+                    metrics.add('image_download', seconds, ok=image is not None)
+                if image is None or len(image_paths) >= limit:
+                    continue
+                if cache is not None:
+                    path = cache.add(query, image, seen_hashes)
+                else:
+                    path = _save_unique(image, output_dir, f"{query}_{len(image_paths)}", seen_hashes)
+                if path:
+                    image_paths.append(path)
+    finally:
+        # No esperar a las descargas lentas: se descartan sus resultados
+        executor.shutdown(wait=False, cancel_futures=True)
 
-def download_image(image_url: str, output_dir: str, name_suffix: str) -> str:
+    return image_paths
+
+
+def fetch_image(image_url: str, session: requests.Session = None):
+    """Descarga una imagen y la devuelve RGB y normalizada (utils.image_normalize), o None si no sirve.
+
+    La respuesta se vuelca por bloques a un temporal en disco (no se carga entera en memoria) y se
+    decodifica ya reducida al tamaño con el que se imprime."""
     try:
-        response = requests.get(image_url, timeout=5)
-        response.raise_for_status()
-        
-        image = Image.open(BytesIO(response.content))
-        
-        if image.mode in ("P", "RGBA"):
-            image = image.convert("RGB")
-            
-        # Resize if too small (thumbnails)
-        if image.width < 50 or image.height < 50:
-            return None
+        with (session or get_session()).get(image_url, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            with tempfile.TemporaryFile() as f:
+                if not stream_to_file(response, f):
+                    return None
+                f.seek(0)
+                image = load_image(f)
+                if image is not None:
+                    image.load()
+                return image
+    except Exception:
+        return None
+
+
+def _save_unique(image, output_dir: str, name_suffix: str, seen_hashes: list):
+    phash = perceptual_hash(image)
+    if any(hamming(phash, other) <= PHASH_THRESHOLD for other in seen_hashes):
+        logging.debug("Imagen descartada por ser visualmente duplicada")
+        return None
+    seen_hashes.append(phash)
+    return save_image(image, output_dir, name_suffix)
+
 
+def save_image(image, output_dir: str, name_suffix: str) -> str:
+    """Guarda la imagen como img_<sufijo>.jpg en output_dir y devuelve la ruta."""
+    try:
         filename = f"img_{name_suffix}.jpg"
         # Sanitize filename
         filename = "".join([c for c in filename if c.isalnum() or c in ('_','.')])
-        
+
         filepath = os.path.join(output_dir, filename)
-        image.save(filepath)
+        with open(filepath, 'wb') as f:
+            f.write(encode_jpeg(image))
         logging.info(f"Imagen guardada: {filepath}")
         return filepath
     except Exception as e:
-        # logging.debug(f"Error bajando imagen individual: {e}")
+        logging.debug(f"Error guardando imagen: {e}")
+        return None
+
+
+def download_image(image_url: str, output_dir: str, name_suffix: str) -> str:
+    """Descarga una sola imagen y la guarda; devuelve la ruta o None."""
+    image = fetch_image(image_url)
+    if image is None:
         return None
+    return save_image(image, output_dir, name_suffix)
@@ -0,0 +1,109 @@
+import logging
+import os
+import time
+
+# Orden por defecto: primero la biblioteca local (milisegundos, sin red), luego la web
+DEFAULT_IMAGE_SOURCES = "library,web"
+
+
+class ImageSource:
+    """Interfaz de un origen de imágenes para download_images.
+
+    find devuelve hasta limit rutas de imágenes locales para query (descargándolas a output_dir si
+    hace falta) y nunca debe tardar mucho más que deadline segundos."""
+
+    name = "base"
+
+    def find(self, query: str, output_dir: str, limit: int, deadline: float = None, metrics=None) -> list:
+        raise NotImplementedError
+
+
+class LibrarySource(ImageSource):
+    """Biblioteca local indexada (utils.image_library); no descarga nada."""
+
+    name = "library"
+
+    def find(self, query, output_dir, limit, deadline=None, metrics=None):
+        from utils.image_library import get_image_library
+        library = get_image_library()
+        if library is None:
+            return []
+        start = time.perf_counter()
+        results = library.search(query, limit)
+        if metrics is not None:
+            metrics.add('image_library', time.perf_counter() - start, hits=len(results))
+        if results:
+            logging.info(f"Imágenes de la biblioteca local para: {query} ({len(results)})")
+        return [self.normalized(result['path']) for result in results]
+
+    @staticmethod
+    def normalized(path: str) -> str:
+        """Copia reducida de path (utils.image_normalize) en la caché de imágenes; la original si
+        IMAGE_NORMALIZE=off o PIL no está instalado."""
+        try:
+            from utils.image_normalize import normalize_enabled, normalized_copy
+        except ImportError:
+            return path
+        if not normalize_enabled():
+            return path
+        cache_dir = os.path.join(os.getenv("IMAGE_CACHE_DIR", os.path.join(".cache", "images")), "library")
+        return normalized_copy(path, cache_dir)
+
+
+class WebSource(ImageSource):
+    """Búsqueda y descarga en la web (utils.image_scraper), con la caché de imágenes."""
+
+    name = "web"
+
+    def find(self, query, output_dir, limit, deadline=None, metrics=None):
+        # requests, bs4 y PIL solo se cargan si la biblioteca local no bastó
+        from utils.image_scraper import download_images as search_web
+        return search_web(query, output_dir, limit=limit, deadline=deadline, metrics=metrics)
+
+
+# Nombre (el de IMAGE_SOURCES en el .env) -> fábrica sin argumentos que devuelve un ImageSource
+IMAGE_SOURCE_FACTORIES = {
+    'library': LibrarySource,
+    'web': WebSource,
+}
+
+_sources = {}
+
+
+def register_image_source(name: str, factory):
+    """Registra (o reemplaza) un origen de imágenes; se usa si aparece en IMAGE_SOURCES."""
+    IMAGE_SOURCE_FACTORIES[name] = factory
+    _sources.pop(name, None)
+
+
+def get_image_source(name: str) -> ImageSource:
+    if name not in IMAGE_SOURCE_FACTORIES:
+        raise ValueError(f"Origen de imágenes desconocido: {name}")
+    source = _sources.get(name)
+    if source is None:
+        source = _sources[name] = IMAGE_SOURCE_FACTORIES[name]()
+    return source
+
+
+def image_source_order() -> list:
+    """Orígenes de IMAGE_SOURCES (separados por comas), en el orden en que se consultan."""
+    names = os.getenv("IMAGE_SOURCES", DEFAULT_IMAGE_SOURCES)
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def download_images(query: str, output_dir: str, limit: int = 3, deadline: float = None, metrics=None) -> list:
+    """Hasta limit imágenes para query, consultando los orígenes de IMAGE_SOURCES en orden y
+    pasando al siguiente solo si el anterior no completó limit. Nunca lanza excepciones."""
+    paths = []
+    for name in image_source_order():
+        try:
+            found = get_image_source(name).find(query, output_dir, limit - len(paths), deadline, metrics)
+        except Exception as e:
+            logging.warning(f"El origen de imágenes '{name}' falló: {e}")
+            continue
+        paths += [path for path in found if path not in paths]
+        if len(paths) >= limit:
+            break
+    if not paths:
+        logging.warning("No se encontraron imágenes.")
+    return paths[:limit]
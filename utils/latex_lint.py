@@ -0,0 +1,365 @@
+import logging
+import os
+import re
+import subprocess
+import threading
+from collections import Counter
+
+# Entornos donde '&' separa columnas y no debe escaparse
+ALIGN_ENVS = {
+    'tabular', 'tabular*', 'tabularx', 'tabulary', 'longtable', 'array', 'align', 'align*', 'aligned',
+    'alignat', 'alignat*', 'eqnarray', 'eqnarray*', 'matrix', 'pmatrix', 'bmatrix', 'Bmatrix', 'vmatrix',
+    'Vmatrix', 'smallmatrix', 'cases', 'dcases', 'dcases*', 'split', 'flalign', 'flalign*', 'tblr', 'supertabular',
+}
+MATH_ENVS = {
+    'equation', 'equation*', 'align', 'align*', 'gather', 'gather*', 'multline', 'multline*',
+    'displaymath', 'math', 'eqnarray', 'eqnarray*', 'flalign', 'flalign*', 'alignat', 'alignat*',
+    'dcases', 'dcases*',
+}
+VERBATIM_ENVS = {'verbatim', 'verbatim*', 'lstlisting', 'minted', 'Verbatim', 'comment'}
+# Entornos con sintaxis propia ('_' y '&' en nombres de nodos, opciones...) que no se escapan
+RAW_ENVS = {'tikzpicture', 'axis', 'circuitikz', 'forest', 'pgfpicture'}
+
+# Comandos cuyos argumentos se copian tal cual (rutas, etiquetas, URLs, nombres de paquete y las
+# matemáticas de \ensuremath)
+PROTECTED_COMMANDS = {
+    'documentclass', 'usepackage', 'RequirePackage', 'includegraphics', 'input', 'include', 'label',
+    'ref', 'pageref', 'eqref', 'autoref', 'cref', 'cite', 'url', 'href', 'bibliography',
+    'bibliographystyle', 'graphicspath', 'newcommand', 'renewcommand', 'providecommand', 'def',
+    'newenvironment', 'renewenvironment', 'definecolor', 'hypersetup', 'lstset', 'geometry',
+    'setlength', 'addtolength', 'tikzset', 'pgfplotsset', 'usetikzlibrary', 'path', 'color',
+    'textcolor', 'pagecolor', 'colorbox', 'fcolorbox', 'begin', 'end', 'ensuremath',
+}
+
+GRAPHICS_EXTENSIONS = ('', '.pdf', '.png', '.jpg', '.jpeg', '.eps')
+MISSING_IMAGE = "\\fbox{\\parbox{0.6\\textwidth}{\\centering Imagen no disponible}}"
+
+_FENCE_LINE = re.compile(r'^\s*```[a-zA-Z]*\s*$')
+_installed_packages = {}
+_packages_lock = threading.Lock()
+
+
+def missing_packages(packages) -> set:
+    """Paquetes de la lista que kpsewhich no encuentra (vacío si kpsewhich no está disponible)."""
+    with _packages_lock:
+        unknown = [p for p in packages if p not in _installed_packages]
+        if unknown:
+            try:
+                found = subprocess.run(
+                    ["kpsewhich"] + [f"{p}.sty" for p in unknown],
+                    capture_output=True, text=True, timeout=10,
+                ).stdout
+            except (OSError, subprocess.SubprocessError):
+                return set()
+            found_names = {os.path.splitext(os.path.basename(line.strip()))[0] for line in found.splitlines()}
+            for p in unknown:
+                _installed_packages[p] = p in found_names
+        return {p for p in packages if not _installed_packages.get(p, True)}
+
+
+def _read_group(text: str, i: int, open_char: str, close_char: str):
+    """Si text[i] abre un grupo, devuelve el índice tras su cierre (con anidamiento); si no, i."""
+    if i >= len(text) or text[i] != open_char:
+        return i
+    depth = 0
+    j = i
+    while j < len(text):
+        c = text[j]
+        if c == '\\':
+            j += 2
+            continue
+        if c == open_char:
+            depth += 1
+        elif c == close_char:
+            depth -= 1
+            if depth == 0:
+                return j + 1
+        j += 1
+    return len(text)
+
+
+def _skip_spaces(text: str, i: int) -> int:
+    while i < len(text) and text[i] in ' \t':
+        i += 1
+    return i
+
+
+class _Linter:
+    """Recorre el documento una sola vez, reescribiéndolo y anotando cada corrección."""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self.fixes = Counter()
+        self.out = []
+        self.stack = []
+        self.math = None  # Delimitador que cierra el modo matemático en línea actual
+        self.verbatim = None
+        self.packages = []
+        self.graphicspath = False
+        self.saw_end_document = False
+
+    def fix(self, message: str):
+        self.fixes[message] += 1
+
+    def run(self, content: str):
+        for line in content.split('\n'):
+            if self.saw_end_document:
+                if line.strip():
+                    self.fix("texto tras \\end{document} eliminado")
+                continue
+            self.line(line)
+
+        if not self.saw_end_document:
+            self.close_envs(len(self.stack))
+            if '\\begin{document}' in content:
+                self.out.append('\\end{document}')
+                self.fix("\\end{document} añadido (documento truncado)")
+
+    def close_envs(self, count: int):
+        for _ in range(count):
+            env = self.stack.pop()
+            if env == 'document':
+                self.stack.append(env)
+                break
+            self.out.append(f"\\end{{{env}}}")
+            self.fix(f"entorno '{env}' sin cerrar")
+
+    def line(self, line: str):
+        if self.verbatim:
+            self.out.append(line)
+            if f"\\end{{{self.verbatim}}}" in line:
+                self.stack.pop()
+                self.verbatim = None
+            return
+        if line.lstrip().startswith('%'):
+            self.out.append(line)
+            return
+
+        buf = []
+        i = 0
+        n = len(line)
+        command_end = -1  # Índice tras el último nombre de comando (su última letra no es texto)
+        # Los caracteres solo se escapan en el cuerpo: el preámbulo define macros con '#1', '_'...
+        body = 'document' in self.stack
+        while i < n:
+            c = line[i]
+            if c == '\\':
+                i = command_end = self.command(line, i, buf)
+                if self.verbatim:
+                    rest = line[i:]
+                    buf.append(rest)
+                    if f"\\end{{{self.verbatim}}}" in rest:
+                        self.stack.pop()
+                        self.verbatim = None
+                    break
+                continue
+            if c == '$':
+                if line.startswith('$$', i):
+                    self.math = None if self.math == '$$' else (self.math or '$$')
+                    buf.append('$$')
+                    i += 2
+                    continue
+                self.math = None if self.math == '$' else (self.math or '$')
+            elif c == '%':
+                if body and self.literal_percent(line, i, command_end):
+                    buf.append('\\%')
+                    self.fix("'%' escapado")
+                    i += 1
+                    continue
+                buf.append(line[i:])  # Comentario real hasta el final de la línea
+                break
+            elif not body:
+                pass
+            elif c == '&' and not any(env in ALIGN_ENVS or env in RAW_ENVS for env in self.stack):
+                buf.append('\\&')
+                self.fix("'&' escapado")
+                i += 1
+                continue
+            elif c == '_' and not self.in_math():
+                buf.append('\\_')
+                self.fix("'_' escapado fuera de modo matemático")
+                i += 1
+                continue
+            elif c == '#':
+                buf.append('\\#')
+                self.fix("'#' escapado")
+                i += 1
+                continue
+            buf.append(c)
+            i += 1
+        self.out.append(''.join(buf))
+
+    @staticmethod
+    def literal_percent(line: str, i: int, command_end: int) -> bool:
+        """Si el '%' de line[i] es texto (un porcentaje) y no un comentario: tras un número, aunque
+        haya espacios ('50 %'), o pegado a una palabra con más texto detrás en la línea."""
+        j = i
+        while j > 0 and line[j - 1] in ' \t':
+            j -= 1
+        if j > 0 and line[j - 1].isdigit():
+            return True
+        return (j == i and i > 0 and line[i - 1].isalpha() and i != command_end
+                and bool(line[i + 1:].strip()))
+
+    def in_math(self) -> bool:
+        return self.math is not None or any(env in MATH_ENVS or env in RAW_ENVS for env in self.stack)
+
+    def command(self, line: str, i: int, buf: list) -> int:
+        """Procesa el comando que empieza en line[i] ('\\') y devuelve el índice siguiente."""
+        if i + 1 >= len(line):
+            buf.append('\\')
+            return i + 1
+        nxt = line[i + 1]
+        if not nxt.isalpha():
+            if nxt in '([':
+                self.math = '\\)' if nxt == '(' else '\\]'
+            elif nxt in ')]':
+                self.math = None
+            buf.append(line[i:i + 2])
+            return i + 2
+
+        j = i + 1
+        while j < len(line) and line[j].isalpha():
+            j += 1
+        name = line[i + 1:j]
+        if name == 'lstinline':
+            # \lstinline[opciones]{código} o \lstinline|código|: como \verb
+            j = _read_group(line, j, '[', ']')
+            if j < len(line) and line[j] == '{':
+                end = _read_group(line, j, '{', '}')
+                buf.append(line[i:end])
+                return end
+        if name in ('verb', 'lstinline') and j < len(line):
+            # \verb|...|: copiar hasta el delimitador de cierre
+            close = line.find(line[j], j + 1)
+            end = len(line) if close == -1 else close + 1
+            buf.append(line[i:end])
+            return end
+        if name == 'hyperref':
+            # \hyperref[etiqueta]{texto}: la etiqueta se copia tal cual, el texto se revisa
+            end = _read_group(line, _skip_spaces(line, j), '[', ']')
+            buf.append(line[i:end])
+            return end
+        if name not in PROTECTED_COMMANDS:
+            buf.append(line[i:j])
+            return j
+        if name == 'graphicspath':
+            self.graphicspath = True
+
+        # Copiar [opcional] y {argumentos} sin tocarlos
+        k = _skip_spaces(line, j)
+        k = _read_group(line, k, '[', ']')
+        arg_start = _skip_spaces(line, k)
+        end = _read_group(line, arg_start, '{', '}')
+        arg = line[arg_start + 1:end - 1] if end > arg_start else ''
+        if name in ('newcommand', 'renewcommand', 'providecommand', 'newenvironment', 'renewenvironment'):
+            # \newcommand{\x}[n][def]{definición} (y {inicio}{fin} en entornos): no se tocan
+            for open_char, close_char in (('[', ']'), ('[', ']'), ('{', '}')):
+                end = _read_group(line, _skip_spaces(line, end), open_char, close_char)
+            if name.endswith('environment'):
+                end = _read_group(line, _skip_spaces(line, end), '{', '}')
+
+        if name == 'begin':
+            return self.begin(arg, line, i, end, buf)
+        if name == 'end':
+            return self.end(arg, line, i, end, buf)
+        if name in ('usepackage', 'RequirePackage'):
+            self.packages.append((len(self.out), line[i:end], [p.strip() for p in arg.split(',') if p.strip()]))
+        if name == 'includegraphics' and arg and not self.graphicspath and not self.graphic_exists(arg):
+            buf.append(MISSING_IMAGE)
+            self.fix(f"imagen inexistente reemplazada: {arg}")
+            return end
+        buf.append(line[i:end])
+        return end
+
+    def begin(self, env: str, line: str, i: int, end: int, buf: list) -> int:
+        buf.append(line[i:end])
+        self.stack.append(env)
+        if env in VERBATIM_ENVS:
+            self.verbatim = env
+        return end
+
+    def end(self, env: str, line: str, i: int, end: int, buf: list) -> int:
+        if env in self.stack:
+            # Cerrar primero los entornos que quedaron abiertos dentro de éste
+            while self.stack[-1] != env:
+                inner = self.stack.pop()
+                buf.append(f"\\end{{{inner}}}")
+                self.fix(f"entorno '{inner}' sin cerrar")
+            self.stack.pop()
+            buf.append(line[i:end])
+            if env == 'document':
+                self.saw_end_document = True
+                if line[end:].strip():
+                    self.fix("texto tras \\end{document} eliminado")
+                return len(line)
+            return end
+        self.fix(f"\\end{{{env}}} sin \\begin eliminado")
+        return end
+
+    def graphic_exists(self, path: str) -> bool:
+        full = os.path.normpath(os.path.join(self.base_dir, path))
+        return any(os.path.exists(full + ext) for ext in GRAPHICS_EXTENSIONS)
+
+    def drop_missing_packages(self):
+        names = {p for _, _, pkgs in self.packages for p in pkgs}
+        missing = missing_packages(names)
+        for index, command, pkgs in self.packages:
+            gone = [p for p in pkgs if p in missing]
+            if not gone:
+                continue
+            kept = [p for p in pkgs if p not in missing]
+            line = self.out[index]
+            if kept:
+                brace = command.rfind('{', 0, len(command) - 1)
+                # Cambiar solo la lista de paquetes (el último grupo) y conservar las opciones
+                replacement = command[:brace] + '{' + ','.join(kept) + '}'
+                self.out[index] = line.replace(command, replacement, 1)
+            elif line.strip() == command:
+                self.out[index] = '% ' + line
+            else:
+                self.out[index] = line.replace(command, '', 1)
+            for p in gone:
+                self.fix(f"paquete no instalado eliminado: {p}")
+
+
+def strip_fences(content: str) -> tuple:
+    """Quita las líneas de bloque markdown (```latex / ```) y el texto previo a \\documentclass."""
+    fixes = Counter()
+    lines = []
+    for line in content.split('\n'):
+        if _FENCE_LINE.match(line):
+            fixes["bloque markdown ``` eliminado"] += 1
+            continue
+        lines.append(line)
+    content = '\n'.join(lines)
+    if '```' in content:
+        content = content.replace('```latex', '').replace('```', '')
+        fixes["bloque markdown ``` eliminado"] += 1
+
+    start = content.find('\\documentclass')
+    if start > 0 and content[:start].strip():
+        fixes["texto previo a \\documentclass eliminado"] += 1
+        content = content[start:]
+    return content, fixes
+
+
+def lint_latex(content: str, base_dir: str = ".") -> tuple:
+    """Corrige en una pasada los errores típicos de la salida del LLM antes de llamar a pdflatex.
+
+    Escapa '&', '%', '_' y '#' sueltos en el texto, elimina bloques markdown, cierra entornos
+    desbalanceados (y un documento truncado), comenta paquetes no instalados y sustituye
+    \\includegraphics cuyo archivo no existe (rutas relativas a base_dir, la carpeta de compilación).
+
+    Devuelve (contenido_corregido, lista de cambios legibles)."""
+    content, fence_fixes = strip_fences(content)
+    linter = _Linter(base_dir)
+    linter.run(content)
+    linter.drop_missing_packages()
+    content = '\n'.join(linter.out)
+
+    fixes = fence_fixes + linter.fixes
+    report = [f"{message} (x{count})" if count > 1 else message for message, count in fixes.items()]
+    if report:
+        logging.info("Correcciones LaTeX: " + "; ".join(report))
+    return content, report
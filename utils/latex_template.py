@@ -0,0 +1,97 @@
+import os
+import re
+from functools import lru_cache
+from utils.latex_lint import strip_fences
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+# El documento se compila desde generated_docs, así que el logo queda un nivel arriba
+LOGO_PATH = "../logos/UAH.png"
+
+_PLACEHOLDER = re.compile(r"<<(\w+)>>")
+_LATEX_SPECIALS = {
+    '\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_',
+    '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}',
+}
+_PREAMBLE_LINE = re.compile(r"^\s*\\(documentclass|usepackage|RequirePackage|title|author|date|maketitle)\b")
+
+
+def template_enabled() -> bool:
+    """Portada y preámbulo locales (LOCAL_TEMPLATE, activo por defecto): el modelo solo escribe el cuerpo."""
+    return os.getenv("LOCAL_TEMPLATE", "on").lower() not in ("off", "false", "0", "no")
+
+
+def escape_latex(text) -> str:
+    return "".join(_LATEX_SPECIALS.get(c, c) for c in str(text))
+
+
+@lru_cache(maxsize=None)
+def load_template(name: str) -> str:
+    with open(os.path.join(TEMPLATE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def render_template(name: str, context: dict, raw: dict = None) -> str:
+    """Sustituye cada <<clave>> de templates/name por context[clave], escapado para LaTeX, o por
+    raw[clave] tal cual (rutas, código LaTeX). Las claves sin valor se dejan vacías."""
+    raw = raw or {}
+
+    def value(match):
+        key = match.group(1)
+        if key in raw:
+            return raw[key]
+        return escape_latex(context.get(key, ""))
+
+    return _PLACEHOLDER.sub(value, load_template(name))
+
+
+def render_cover(student_data: dict) -> str:
+    """Portada con los datos de build_student_data."""
+    return render_template("cover.tex", student_data, raw={'logo': LOGO_PATH})
+
+
+def render_front_matter(student_data: dict) -> str:
+    """Preámbulo fijo (idéntico en todos los documentos, así su .fmt se reutiliza) más
+    \\begin{document} y la portada con los datos de build_student_data."""
+    return load_template("preamble.tex").rstrip() + "\n\n\\begin{document}\n\n" + render_cover(student_data)
+
+
+def extract_body(text: str) -> str:
+    """Cuerpo del documento a partir de la respuesta del modelo.
+
+    Si el modelo añadió igualmente preámbulo, \\begin{document}, portada o \\end{document},
+    se descartan; solo queda el contenido."""
+    text, _ = strip_fences(text or "")
+    begin = text.find("\\begin{document}")
+    if begin != -1:
+        text = text[begin + len("\\begin{document}"):]
+    end = text.find("\\end{document}")
+    if end != -1:
+        text = text[:end]
+    # Portada propia del modelo: se quita, ya va la local
+    text = re.sub(r"\\begin\{titlepage\}.*?\\end\{titlepage\}\s*(\\clearpage|\\newpage)?", "", text, flags=re.DOTALL)
+    lines = [line for line in text.split("\n") if not _PREAMBLE_LINE.match(line)]
+    return "\n".join(lines).strip() + "\n"
+
+
+def assemble_document(student_data: dict, body: str) -> str:
+    """Documento completo: preámbulo y portada locales, el cuerpo del modelo y \\end{document}."""
+    return render_front_matter(student_data) + "\n" + extract_body(body) + "\n\\end{document}\n"
+
+
+def render_body_document(body: str) -> str:
+    """Documento sin portada (preámbulo fijo y cuerpo) para compilarlo una vez y compartir sus
+    páginas entre estudiantes (core.fanout)."""
+    return (load_template("preamble.tex").rstrip() + "\n\n\\begin{document}\n\n" + extract_body(body)
+            + "\n\\end{document}\n")
+
+
+def render_cover_document(student_data: dict, body_pdf: str) -> str:
+    """Portada de student_data seguida de las páginas ya compiladas de body_pdf (pdfpages): pdflatex
+    solo compone la portada. Los metadatos del PDF (autor, título) van tras \\begin{document} para
+    que el preámbulo, y con él su .fmt, sea el mismo para todos los estudiantes."""
+    metadata = "\\hypersetup{{pdfauthor={{{}}}, pdftitle={{{}}}, pdfsubject={{{}}}}}".format(
+        escape_latex(student_data['nombre']), escape_latex(student_data['tema']), escape_latex(student_data['materia'])
+    )
+    return (load_template("preamble.tex").rstrip() + "\n\\usepackage{pdfpages}\n\n\\begin{document}\n"
+            + metadata + "\n\n" + render_cover(student_data) + f"\\includepdf[pages=-]{{{body_pdf}}}\n\\end{{document}}\n")
@@ -0,0 +1,35 @@
+import re
+import subprocess
+import sys
+
+# Módulos que no se importan al arrancar sino con el primer trabajo que los necesita
+DEFERRED_MODULES = ('api.openai_client', 'api.gemini', 'utils.image_scraper')
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def import_times(statement: str, cwd: str = None) -> list:
+    """Ejecuta statement en un intérprete nuevo con -X importtime y devuelve
+    [(módulo, propio_s, acumulado_s, profundidad)] en el orden en que se importaron."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            entries.append((module, int(own) / 1e6, int(cumulative) / 1e6, len(indent) // 2))
+    if result.returncode != 0 and not entries:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else statement)
+    return entries
+
+
+def print_import_times(title: str, entries: list, top: int = 15):
+    """Total del import y los top módulos con más tiempo acumulado."""
+    total = sum(e[2] for e in entries if e[3] == 0)
+    print(f"\n{title}: {total * 1000:.0f} ms en {len(entries)} módulos")
+    print(f"  {'módulo':<40}{'acumulado ms':>14}{'propio ms':>11}")
+    for module, own, cumulative, _ in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        print(f"  {module:<40}{cumulative * 1000:>14.1f}{own * 1000:>11.1f}")
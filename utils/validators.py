@@ -1,4 +1,5 @@
 import re
+from .build_student_data import build_section_code
 
 def validate_ci(ci: str) -> bool:
     """Valida el formato de la cédula de identidad (V-XXXXXXXX)"""
@@ -9,3 +10,18 @@ def validate_section(section: str) -> bool:
     """Valida el formato de la sección (DCM/DCN0[1-4]0[1-4])"""
     pattern = r"^(DCM|DCN)0[1-4]0[1-4]$"
     return bool(re.match(pattern, section))
+
+def collect_input_errors(values) -> list:
+    """Devuelve la lista de errores de los campos de entrada (vacía si son válidos)"""
+    errors = []
+
+    if not values.get('-TOPIC-'):
+        errors.append("Debe ingresar un tema principal")
+
+    if not values.get('-INSTRUCTIONS-'):
+        errors.append("Debe ingresar indicaciones")
+
+    if not validate_section(build_section_code(values)):
+        errors.append("Código de sección inválido")
+
+    return errors